@@ -0,0 +1,46 @@
+"""
+Import time of the client (import wrun) and of the server modules, from python -X importtime
+
+python -m tests.bench_import [BUDGET_MS]  (exit status 1 if the client median exceeds BUDGET_MS)
+"""
+import statistics
+import subprocess
+import sys
+
+REPEAT = 20
+IMPORTS = {
+    "client": "import wrun; wrun.Proxy",
+    "server": "import wrun; wrun.Service",
+}
+
+
+def import_times_ms(statement):
+    """ Cumulative import time of each top level module, and the number of imported modules """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement], stderr=subprocess.PIPE, check=True).stderr
+    times, modules = {}, 0
+    for line in stderr.decode().splitlines():  # "import time: <self us> | <cumulative us> | <indented name>"
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules += 1
+        if not name.startswith("  "):
+            times[name.strip()] = int(cumulative) / 1000
+    return times, modules
+
+
+def main(budget_ms=None):
+    print("{:>10} {:>12} {:>12} {:>10}".format("import", "median ms", "max ms", "modules"))
+    medians = {}
+    for label, statement in IMPORTS.items():
+        runs = [import_times_ms(statement) for _ in range(REPEAT)]
+        totals = [sum(times.values()) for times, _ in runs]
+        medians[label] = statistics.median(totals)
+        print("{:>10} {:>12.2f} {:>12.2f} {:>10}".format(label, medians[label], max(totals), runs[-1][1]))
+    if budget_ms is not None and medians["client"] > float(budget_ms):
+        print("client import exceeds {} ms".format(budget_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,40 @@
+"""
+Spawn latency against daemon RSS, with and without the spawner helper process
+
+python -m tests.bench_spawn [RSS_MB ...]
+"""
+import resource
+import time
+
+from wrun import run_executable
+from wrun.spawn import Spawner
+
+from tests.config import *
+
+REPEAT = 50
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 2 ** 20
+
+
+def latency_ms(run):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        run(exe_path=EXECUTABLE_PATH, exe_name=EXECUTABLE_NAME, args=["P1"], input_stdin="")
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main(*sizes):
+    spawner = Spawner()
+    ballast = []
+    print("{:>10} {:>12} {:>12}".format("RSS MB", "direct ms", "helper ms"))
+    for size in sizes or (0, 256, 1024):
+        ballast.append(b"x" * max(0, int(size) * 2 ** 20 - sum(map(len, ballast))))  # touched pages
+        print("{:>10} {:>12.2f} {:>12.2f}".format(rss_mb(), latency_ms(run_executable), latency_ms(spawner.run)))
+    spawner.stop()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
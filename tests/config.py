@@ -1,9 +1,14 @@
 import logging
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 
+from wrun import Config, Service, daemon
+
 
 if sys.platform == 'win32':
     EXECUTABLE_NAME = "sample.bat"
@@ -68,3 +73,51 @@ class LogTestMixin(object):
     def assertLogMatch(self, action, expected):
         path = self._log_path(action)
         self.assertRegex(self._get_log(path), expected)
+
+
+class ThreadDaemon:
+    def __init__(self, action, server_address=("localhost", 0), **kwargs):
+        servers = []
+        kwargs.setdefault("threads", 4)
+        self._thread = threading.Thread(
+            target=daemon, args=(server_address, action), kwargs=dict(kwargs, on_open=servers.append))
+        self._thread.start()
+        while not servers:
+            time.sleep(0.01)
+        self.server = servers[0]
+        self.target = self.server.server_address
+
+    def stop(self):
+        self.server.stop()
+        self._thread.join()
+
+
+class ServiceTestMixin:
+    """ Services with their settings file and log in a temporary directory, self.tmp_dir """
+    SERVICE_CLASS = Service
+    SETTINGS = {}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.settings_file = os.path.join(self.tmp_dir, "settings_test.py")
+        self.daemon = None
+
+    def tearDown(self):
+        if self.daemon:
+            self.daemon.stop()
+        for h in list(logging.root.handlers):
+            h.close()
+            logging.root.removeHandler(h)
+        shutil.rmtree(self.tmp_dir)
+
+    def _service(self, **settings):
+        """ PORT is 0: a daemon binds an ephemeral port """
+        Config.store(self.settings_file, **dict(
+            LOG_PATH=os.path.join(self.tmp_dir, "test.log"), EXECUTABLE_PATH=EXECUTABLE_PATH, PORT=0,
+            **dict(self.SETTINGS, **settings)))
+        return self.SERVICE_CLASS(self.settings_file)
+
+    def _serve(self, service, **kwargs):
+        """ A ThreadDaemon running service requests, stopped by tearDown """
+        self.daemon = ThreadDaemon(service.execute, **kwargs)
+        return self.daemon
@@ -2,13 +2,21 @@ import json
 import logging
 import multiprocessing
 import os
+import shutil
 import signal
+import socket
+import stat
 import sys
+import tempfile
+import threading
 import time
 import unittest
 import unittest.mock
 
-from wrun import BaseConfig, Config, Proxy, client, daemon, executor, log_config
+from wrun import BaseConfig, Config, Proxy, Service, client, daemon, executor, log_config, run_executable
+from wrun.catalog import Catalog, ConcurrencyLimits, Entry
+from wrun.coalesce import SingleFlight
+from wrun.spawn import Spawner
 
 from tests.config import *
 
@@ -126,6 +134,142 @@ class TestClientServer(TestCommunication):
         self.assertLogContains(client, "CLIENT: closed")
 
 
+class TestDaemonStop(unittest.TestCase):
+    def test_stop(self):
+        servers = []
+        thread = threading.Thread(
+            target=daemon, args=(("localhost", 0), TestClientServer_revert), kwargs={"on_open": servers.append})
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(client(servers[0].server_address, "prova"), "avorp")
+        servers[0].stop()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+
+
+@unittest.skipIf(sys.platform == 'win32', "no AF_UNIX sockets on Windows")
+class TestUnixClientServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "wrun.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_request(self):
+        d = ThreadDaemon(TestClientServer_revert, self.path, mode=0o600)
+        try:
+            self.assertEqual(d.target, self.path)
+            self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+            self.assertEqual(client(self.path, "prova"), "avorp")
+        finally:
+            d.stop()
+
+    def test_proxy(self):
+        d = ThreadDaemon(lambda command: executor(EXECUTABLE_PATH, command), self.path)
+        try:
+            self.assertEqual(
+                Proxy(self.path).run(EXECUTABLE_NAME, ["P1"]),
+                {"stdout": os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), "returncode": 0})
+        finally:
+            d.stop()
+
+    def test_stale_socket_file_replaced(self):
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(self.path)
+        stale.close()
+        self.assertRaises(ConnectionRefusedError, client, self.path, "prova")
+        d = ThreadDaemon(TestClientServer_revert, self.path)
+        try:
+            self.assertEqual(client(self.path, "prova"), "avorp")
+        finally:
+            d.stop()
+
+    def test_other_files_kept(self):
+        with open(self.path, "w") as f:
+            f.write("data")
+        self.assertRaises(OSError, daemon, self.path, TestClientServer_revert)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "data")
+
+
+def TestDaemonThreads_slow_revert(request):
+    time.sleep(0.5)
+    return request[::-1]
+
+
+class TestDaemonThreads(unittest.TestCase):
+    def test_concurrent_requests(self):
+        servers = []
+        thread = threading.Thread(
+            target=daemon, args=(("localhost", 0), TestDaemonThreads_slow_revert),
+            kwargs={"on_open": servers.append, "threads": 3})
+        thread.start()
+        time.sleep(0.1)
+        results = []
+        clients = [
+            threading.Thread(target=lambda r: results.append(client(servers[0].server_address, r)), args=(r,))
+            for r in ["uno", "due", "tre"]]
+        start = time.monotonic()
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(sorted(results), ["ert", "eud", "onu"])
+        servers[0].stop()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.calls = []
+
+    def _slow(self, value):
+        self.calls.append(value)
+        time.sleep(0.2)
+        if value == "BOOM!!!":
+            raise Exception(value)
+        return {"value": value}
+
+    def _concurrent(self, *keys):
+        results = []
+
+        def call(key):
+            try:
+                results.append(self.single_flight.do(key, self._slow, key))
+            except Exception as exc:
+                results.append(str(exc))
+
+        threads = [threading.Thread(target=call, args=(key,)) for key in keys]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_same_key(self):
+        results = self._concurrent("A", "A", "A")
+        self.assertEqual(self.calls, ["A"])
+        self.assertEqual(results, [{"value": "A"}] * 3)
+
+    def test_different_keys(self):
+        results = self._concurrent("A", "B")
+        self.assertEqual(sorted(self.calls), ["A", "B"])
+        self.assertEqual(len(results), 2)
+
+    def test_exception_is_shared(self):
+        self.assertEqual(self._concurrent("BOOM!!!", "BOOM!!!"), ["BOOM!!!", "BOOM!!!"])
+        self.assertEqual(self.calls, ["BOOM!!!"])
+
+    def test_no_caching(self):
+        self._concurrent("A")
+        self._concurrent("A")
+        self.assertEqual(self.calls, ["A", "A"])
+
+
 class TestSecureClientServer(TestCommunication):
     SERVER_ADDRESS = ('localhost', 3333)
     CERFILE = os.path.join(SSL_PATH, "server.crt")
@@ -194,6 +338,118 @@ class TestExecutor(unittest.TestCase):
         self.assertEqual(json.loads(result), expected)
 
 
+@unittest.skipIf(sys.platform == 'win32', "SLEEP is not available in sample.bat")
+class TestExecutorPolicies(unittest.TestCase):
+    def test_timeout(self):
+        result = run_executable(EXECUTABLE_PATH, EXECUTABLE_NAME, ["SLEEP", "2"], "", timeout=0.2)
+        self.assertEqual(result["error"], "timeout")
+        self.assertNotEqual(result["returncode"], 0)
+
+    def test_max_output(self):
+        result = run_executable(EXECUTABLE_PATH, EXECUTABLE_NAME, ["P1"], "", max_output=4)
+        self.assertEqual(result, {"stdout": EXECUTABLE_PATH[:4], "returncode": 0})
+
+    def test_usage(self):
+        result = run_executable(EXECUTABLE_PATH, EXECUTABLE_NAME, ["SLEEP", "0.2"], "", collect_usage=True)
+        usage = result["usage"]
+        self.assertEqual(sorted(usage), ["max_rss", "system_time", "user_time", "wall_time"])
+        self.assertGreaterEqual(usage["wall_time"], 0.2)
+        self.assertLess(usage["user_time"] + usage["system_time"], 0.2)
+        self.assertGreater(usage["max_rss"], 0)
+
+    def test_usage_after_timeout(self):
+        result = run_executable(EXECUTABLE_PATH, EXECUTABLE_NAME, ["SLEEP", "1"], "", timeout=0.2, collect_usage=True)
+        self.assertEqual(result["error"], "timeout")
+        self.assertIn("max_rss", result["usage"])
+
+
+class TestSpawner(unittest.TestCase):
+    def setUp(self):
+        self.spawner = Spawner()
+
+    def tearDown(self):
+        self.spawner.stop()
+
+    def test_run(self):
+        for arg in ["P1", "P2", "ERROR"]:
+            result = self.spawner.run(
+                exe_path=EXECUTABLE_PATH, exe_name=EXECUTABLE_NAME, args=[arg], input_stdin="", collect_stderr=True)
+            self.assertEqual(
+                result, run_executable(EXECUTABLE_PATH, EXECUTABLE_NAME, [arg], "", collect_stderr=True))
+
+    def test_run_with_stdin(self):
+        result = self.spawner.run(
+            exe_path=EXECUTABLE_PATH, exe_name=EXECUTABLE_NAME, args=["STDIN"], input_stdin="INPUT_STDIN")
+        self.assertEqual(result, {"stdout": os.linesep.join([EXECUTABLE_PATH, "INPUT_STDIN", ""]), "returncode": 0})
+
+    def test_restart_dead_helper(self):
+        self.spawner.run(exe_path=EXECUTABLE_PATH, exe_name=EXECUTABLE_NAME, args=["P1"], input_stdin="")
+        self.spawner._idle[0].kill()
+        self.spawner._idle[0].wait()
+        result = self.spawner.run(exe_path=EXECUTABLE_PATH, exe_name=EXECUTABLE_NAME, args=["P1"], input_stdin="")
+        self.assertEqual(result["returncode"], 0)
+        self.assertEqual(len(self.spawner._helpers), 1)
+
+    @unittest.skipIf(sys.platform == 'win32', "SLEEP is not available in sample.bat")
+    def test_concurrent_runs(self):
+        kwargs = dict(exe_path=EXECUTABLE_PATH, exe_name=EXECUTABLE_NAME, args=["SLEEP", "0.5"], input_stdin="")
+        threads = [threading.Thread(target=self.spawner.run, kwargs=kwargs) for _ in range(4)]
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(len(self.spawner._helpers), 4)
+        self.spawner.run(**kwargs)
+        self.assertEqual(len(self.spawner._helpers), 4)  # idle helpers are reused
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        shutil.copy(os.path.join(EXECUTABLE_PATH, EXECUTABLE_NAME), self.path)
+        self.catalog = Catalog(self.path, {EXECUTABLE_NAME: {"timeout": 5}})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_get(self):
+        entry = self.catalog.get(EXECUTABLE_NAME)
+        self.assertEqual(entry.path, os.path.join(self.path, EXECUTABLE_NAME))
+        self.assertEqual(entry.policy, {"timeout": 5})
+
+    def test_unknown(self):
+        self.assertIsNone(self.catalog.get("missing.exe"))
+        self.assertIsNone(self.catalog.get(os.path.join("..", EXECUTABLE_NAME)))
+
+    def test_describe(self):
+        self.assertEqual(self.catalog.describe(), [{"name": EXECUTABLE_NAME, "timeout": 5}])
+
+    def test_invalid_max_concurrency(self):
+        for limit in (0, -1, 1.5, "2", True):
+            self.assertRaises(ValueError, Catalog, self.path, {EXECUTABLE_NAME: {"max_concurrency": limit}})
+
+    def test_refresh(self):
+        time.sleep(0.01)  # be sure the directory mtime changes
+        shutil.copy(os.path.join(EXECUTABLE_PATH, EXECUTABLE_NAME), os.path.join(self.path, "copy_" + EXECUTABLE_NAME))
+        self.assertEqual(self.catalog.get("copy_" + EXECUTABLE_NAME).policy, {})
+        os.remove(os.path.join(self.path, EXECUTABLE_NAME))
+        self.assertIsNone(self.catalog.get(EXECUTABLE_NAME))
+
+
+class TestConcurrencyLimits(unittest.TestCase):
+    def test_slots(self):
+        limits = ConcurrencyLimits()
+        entry = Entry("a", "a", {"max_concurrency": 1})
+        with limits.slots([entry, Entry("b", "b", {}), entry]):  # a pipeline takes one slot of each executable
+            self.assertFalse(limits._semaphore(entry).acquire(blocking=False))
+            changed = Entry("a", "a", {"max_concurrency": 2})
+            with limits.slots([changed]):
+                pass
+        self.assertTrue(limits._semaphore(entry).acquire(blocking=False))
+
+
 class TestProxy(unittest.TestCase):
     def setUp(self):
         def _mock_client(*args, **kwargs):
@@ -201,7 +457,7 @@ class TestProxy(unittest.TestCase):
             return json.dumps(self._mock_client_return_value)
 
         self._mock_client_calls = []
-        self.patch = unittest.mock.patch("wrun.client", _mock_client)
+        self.patch = unittest.mock.patch("wrun.proxy.client", _mock_client)
         self.patch.start()
 
     def tearDown(self):
@@ -228,6 +484,20 @@ class TestProxy(unittest.TestCase):
         self.assertEqual(result, {"stdout": "OUTPUT", "returncode": 0})
         self.assertEqual(self._mock_client_calls, [((('HOST', 'PORT'), '["SAMPLE_EXE", [], "INPUT_STDIN"]'), {})])
 
+    def test_run_with_idempotency_key(self):
+        p = Proxy("HOST", "PORT")
+        self._mock_client_return_value = {"stdout": "OUTPUT", "returncode": 0}
+        p.run("SAMPLE_EXE", [], idempotency_key="K1")
+        self.assertEqual(self._mock_client_calls, [
+            ((('HOST', 'PORT'), '["SAMPLE_EXE", [], "", {"idempotency_key": "K1"}]'), {})])
+
+    def test_catalog(self):
+        p = Proxy("HOST", "PORT")
+        self._mock_client_return_value = [{"name": "SAMPLE_EXE"}]
+        result = p.catalog()
+        self.assertEqual(result, [{"name": "SAMPLE_EXE"}])
+        self.assertEqual(self._mock_client_calls, [((('HOST', 'PORT'), '{"action": "catalog"}'), {})])
+
     def test_run_secure(self):
         p = Proxy("HOST", "PORT", cafile="mock_cafile")
         self._mock_client_return_value = {"stdout": "OUTPUT", "returncode": 0}
@@ -385,6 +655,18 @@ datefmt=
         self.assertTrue(config.LOG_PATH)
         self.assertLogContains("INFO:wrun:settings")
 
+    def test_secrets_not_logged(self):
+        Config.store(
+            self.config_file, LOG_PATH=self.log_file, HMAC_KEY="shared-secret",
+            SECURE={"password": "tls-password"})
+        config = Config(self.config_file)
+        self.assertEqual(config.HMAC_KEY, "shared-secret")
+        with open(self.log_file) as f:
+            content = f.read()
+        self.assertIn("'HMAC_KEY': '<redacted>'", content)
+        self.assertNotIn("shared-secret", content)
+        self.assertNotIn("tls-password", content)
+
     def test_log_fileconfig(self):
         Config.store(self.config_file, LOG_FILECONFIG=self.log_fileconfig)
         config = Config(self.config_file)
@@ -431,5 +713,196 @@ datefmt=
         self.assertRaises(AssertionError, Config, self.config_file)
 
 
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.settings_file = os.path.join(CWD, "settings_test.py")
+        self.log_file = os.path.join(CWD, "test_reload.log")
+        self.settings = {
+            "LOG_PATH": self.log_file, "EXECUTABLE_PATH": EXECUTABLE_PATH, "PORT": 3333, "RELOAD_INTERVAL": 0}
+        Config.store(self.settings_file, **self.settings)
+        self.service = Service(self.settings_file)
+
+    def tearDown(self):
+        for h in list(logging.root.handlers):
+            h.close()
+            logging.root.removeHandler(h)
+        os_remove(self.settings_file)
+        os_remove(self.log_file)
+
+    def _store(self, **kwargs):
+        time.sleep(0.01)  # be sure the settings file mtime changes
+        Config.store(self.settings_file, **dict(self.settings, **kwargs))
+
+    def _execute(self, exe_name=EXECUTABLE_NAME):
+        return json.loads(self.service.execute(json.dumps([exe_name, ["P1"], ""])))
+
+    def _request(self, request):
+        return json.loads(self.service.execute(json.dumps(request)))
+
+    def _control(self, **request):
+        return self._request(request)
+
+    def test_unknown_executable(self):
+        self.assertEqual(self._execute("missing.exe"), {"error": "unknown executable"})
+
+    def test_catalog(self):
+        self.assertIn({"name": EXECUTABLE_NAME}, self._control(action="catalog"))
+
+    def test_unknown_action(self):
+        self.assertEqual(self._control(action="missing"), {"error": "unknown action"})
+
+    def test_executable_policies(self):
+        self._store(EXECUTABLE_POLICIES={EXECUTABLE_NAME: {"max_output": 4}})
+        self.assertEqual(self._execute(), {"stdout": EXECUTABLE_PATH[:4], "returncode": 0})
+
+    def _concurrent_execute(self, *requests):
+        results = []
+        threads = [
+            threading.Thread(target=lambda r: results.append(self._request(r)), args=(r,)) for r in requests]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    @unittest.skipIf(sys.platform == 'win32', "SLEEP is not available in sample.bat")
+    def test_coalesce(self):
+        self._store(COALESCE=True)
+        self._execute()  # settings reload
+        with unittest.mock.patch("wrun.server.run_executable", side_effect=run_executable) as mock_run:
+            results = self._concurrent_execute(*[[EXECUTABLE_NAME, ["SLEEP", "0.3"], ""]] * 3)
+            self.assertEqual(mock_run.call_count, 1)
+        expected = {"stdout": os.linesep.join([EXECUTABLE_PATH, "slept 0.3", ""]), "returncode": 0}
+        self.assertEqual(results, [expected] * 3)
+
+    @unittest.skipIf(sys.platform == 'win32', "SLEEP is not available in sample.bat")
+    def test_coalesce_idempotency_key(self):
+        self._store(EXECUTABLE_POLICIES={EXECUTABLE_NAME: {"coalesce": True}})
+        self._execute()  # settings reload
+        with unittest.mock.patch("wrun.server.run_executable", side_effect=run_executable) as mock_run:
+            self._concurrent_execute(
+                [EXECUTABLE_NAME, ["SLEEP", "0.3"], "", {"idempotency_key": "K1"}],
+                [EXECUTABLE_NAME, ["SLEEP", "0.2"], "", {"idempotency_key": "K1"}],
+                [EXECUTABLE_NAME, ["SLEEP", "0.3"], "", {"idempotency_key": "K2"}])
+            self.assertEqual(mock_run.call_count, 2)
+
+    @unittest.skipIf(sys.platform == 'win32', "SLEEP is not available in sample.bat")
+    def test_coalesce_limits(self):
+        self._store(COALESCE=True)
+        self._execute()  # settings reload
+        with unittest.mock.patch("wrun.server.run_executable", side_effect=run_executable) as mock_run:
+            self._concurrent_execute(
+                [EXECUTABLE_NAME, ["SLEEP", "0.3"], "", {"idempotency_key": "K1"}],
+                [EXECUTABLE_NAME, ["SLEEP", "0.3"], "", {"idempotency_key": "K1", "limits": {"cpu_time": 5}}],
+                [EXECUTABLE_NAME, ["SLEEP", "0.3"], ""],
+                [EXECUTABLE_NAME, ["SLEEP", "0.3"], "", {"limits": {"cpu_time": 5}}])
+            self.assertEqual(mock_run.call_count, 4)
+
+    @unittest.skipIf(sys.platform == 'win32', "SLEEP is not available in sample.bat")
+    def test_max_concurrency(self):
+        self._store(EXECUTABLE_POLICIES={EXECUTABLE_NAME: {"max_concurrency": 1}})
+        self._execute()  # settings reload
+        start = time.monotonic()
+        results = self._concurrent_execute(*[[EXECUTABLE_NAME, ["SLEEP", "0.2"], ""]] * 3)
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+        self.assertEqual([r["returncode"] for r in results], [0] * 3)
+
+    def test_no_coalesce(self):
+        with unittest.mock.patch("wrun.server.run_executable", side_effect=run_executable) as mock_run:
+            self._concurrent_execute(*[[EXECUTABLE_NAME, ["P1"], ""]] * 2)
+            self.assertEqual(mock_run.call_count, 2)
+
+    def test_spawn_helper(self):
+        self._store(SPAWN_HELPER=True)
+        self.assertEqual(
+            self._execute(), {"stdout": os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), "returncode": 0})
+        self.assertEqual(len(self.service.spawner._helpers), 1)
+        self.service.spawner.stop()
+
+    def test_usage(self):
+        self.assertNotIn("usage", self._execute())
+        self._execute("missing.exe")
+        self._store(COLLECT_USAGE=True)
+        self.assertIn("user_time", self._execute()["usage"])
+        usage = self._control(action="usage")
+        self.assertEqual([u["name"] for u in usage], [EXECUTABLE_NAME])
+        self.assertEqual(usage[0]["count"], 2)
+
+    @unittest.skipIf(sys.platform == 'win32', "no resource limits on Windows")
+    def test_resource_limits(self):
+        self._store(
+            RESOURCE_LIMITS={"cpu_time": 10, "open_files": 128},
+            EXECUTABLE_POLICIES={EXECUTABLE_NAME: {"limits": {"open_files": 64}}})
+        request = [EXECUTABLE_NAME, ["LIMITS"], "", {"limits": {"cpu_time": 5, "open_files": 256}}]
+        stdout = self._request(request)["stdout"]
+        self.assertEqual([line.split()[-1] for line in stdout.splitlines()[1:]], ["5", "64"])
+        self.assertEqual(
+            self._request([EXECUTABLE_NAME, ["LIMITS"], "", {"limits": {"threads": 1}}]), {"error": "invalid limits"})
+
+    @unittest.skipIf(sys.platform == 'win32', "no resource limits on Windows")
+    def test_resource_limits_not_loosened(self):
+        self._store(RESOURCE_LIMITS={"cpu_time": 10, "open_files": 128})
+        for limits in ({"cpu_time": -1}, {"open_files": -1}, {"open_files": "unlimited"}):
+            self.assertEqual(
+                self._request([EXECUTABLE_NAME, ["LIMITS"], "", {"limits": limits}]), {"error": "invalid limits"})
+        stdout = self._request([EXECUTABLE_NAME, ["LIMITS"], "", {"limits": {"cpu_time": 20}}])["stdout"]
+        self.assertEqual([line.split()[-1] for line in stdout.splitlines()[1:]], ["10", "128"])
+
+    @unittest.skipIf(sys.platform == 'win32', "SEQ is not available in sample.bat")
+    def test_output_filter(self):
+        self.assertEqual(
+            self._request([EXECUTABLE_NAME, ["SEQ", "10"], "", {"output_filter": {"tail": 2}}]),
+            {"stdout": "9\n10\n", "returncode": 0})
+        for output_filter in [{"regex": "("}, {"regex": 5}, {"head": "3"}, {"bytes": ["a"]}]:
+            self.assertEqual(
+                self._request([EXECUTABLE_NAME, ["SEQ", "10"], "", {"output_filter": output_filter}]),
+                {"error": "invalid output filter"})
+
+    def test_reload(self):
+        self.assertNotIn("stderr", self._execute())
+        self._store(COLLECT_STDERR=True)
+        self.assertEqual(self._execute()["stderr"], "")
+        self.assertTrue(self.service.settings.COLLECT_STDERR)
+
+    def test_reload_during_request(self):
+        def reload_and_run(**kwargs):
+            self._store(COLLECT_USAGE=True, EXECUTABLE_POLICIES={EXECUTABLE_NAME: {"max_output": 4}})
+            self.service.watch_settings()
+            return run_executable(**kwargs)
+
+        with unittest.mock.patch("wrun.server.run_executable", side_effect=reload_and_run):
+            result = self._execute()
+        self.assertEqual(result, {"stdout": os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), "returncode": 0})
+        self.assertTrue(self.service.settings.COLLECT_USAGE)
+        self.assertEqual(self.service.catalog.get(EXECUTABLE_NAME).policy, {"max_output": 4})
+
+    def test_restart_settings_are_kept(self):
+        self._store(PORT=3334, COLLECT_STDERR=True)
+        self._execute()
+        self.assertEqual(self.service.settings.PORT, 3333)
+        self.assertTrue(self.service.settings.COLLECT_STDERR)
+
+    def test_invalid_settings_are_ignored(self):
+        settings = self.service.settings
+        with open(self.settings_file, "a") as f:
+            f.write("COLLECT_STDERR = \n")
+        self.assertNotIn("stderr", self._execute())
+        self.assertIs(self.service.settings, settings)
+
+    def test_missing_mandatory_setting(self):
+        settings = self.service.settings
+        time.sleep(0.01)
+        Config.store(self.settings_file, LOG_PATH=self.log_file, PORT=3333, COLLECT_STDERR=True)
+        self.assertNotIn("stderr", self._execute())
+        self.assertIs(self.service.settings, settings)
+
+    def test_reload_disabled(self):
+        self._store(RELOAD_INTERVAL=None)
+        self._execute()
+        self._store(RELOAD_INTERVAL=None, COLLECT_STDERR=True)
+        self.assertNotIn("stderr", self._execute())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from wrun.accounting import UsageStats
+
+
+class TestUsageStats(unittest.TestCase):
+    def test_describe(self):
+        stats = UsageStats()
+        stats.add("cheap", {"wall_time": 1.0, "user_time": 0.1, "system_time": 0.1, "max_rss": 1000})
+        stats.add("expensive", {"wall_time": 1.0, "user_time": 0.5, "system_time": 0.5, "max_rss": 2000})
+        stats.add("expensive", {"wall_time": 2.0, "user_time": 1.0, "system_time": 0.5, "max_rss": 1500})
+        self.assertEqual(stats.describe(), [
+            {"name": "expensive", "count": 2, "wall_time": 3.0, "user_time": 1.5, "system_time": 1.0, "max_rss": 2000},
+            {"name": "cheap", "count": 1, "wall_time": 1.0, "user_time": 0.1, "system_time": 0.1, "max_rss": 1000},
+        ])
+
+    def test_wall_time_only(self):
+        stats = UsageStats()
+        stats.add("sample", {"wall_time": 1.0})
+        self.assertEqual(
+            stats.describe(),
+            [{"name": "sample", "count": 1, "wall_time": 1.0, "user_time": 0, "system_time": 0, "max_rss": 0}])
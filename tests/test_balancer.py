@@ -0,0 +1,191 @@
+import time
+import unittest
+
+from wrun import executor
+from wrun.balancer import EWMA, BalancedProxy, NoReplicaError
+
+from tests.config import *
+
+
+class FakeProxy:
+    def __init__(self, name, delay=0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.probes = 0
+
+    def run(self, *args, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"stdout": self.name, "returncode": 0}
+
+    def catalog(self):
+        self.probes += 1
+        if self.error:
+            raise self.error
+        return []
+
+
+def balanced_fakes(*proxies, **kwargs):
+    balanced = BalancedProxy([("localhost", idx) for idx in range(len(proxies))], **kwargs)
+    for replica, proxy in zip(balanced.replicas, proxies):
+        replica.proxy = proxy
+    return balanced
+
+
+def wait_probe(replica, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if not replica.probing:
+            return
+        time.sleep(0.01)
+
+
+class TestBalancedProxy(unittest.TestCase):
+    def test_least_outstanding(self):
+        a, b = FakeProxy("A"), FakeProxy("B")
+        balanced = balanced_fakes(a, b)
+        balanced.replicas[0].outstanding = 1
+        self.assertEqual(balanced.run("EXE", [])["stdout"], "B")
+
+    def test_least_outstanding_latency_tie_break(self):
+        a, b = FakeProxy("A", delay=0.05), FakeProxy("B")
+        balanced = balanced_fakes(a, b)
+        for _ in range(4):
+            balanced.run("EXE", [])
+        self.assertEqual((a.calls, b.calls), (1, 3))
+
+    def test_ewma(self):
+        a, b = FakeProxy("A", delay=0.05), FakeProxy("B")
+        balanced = balanced_fakes(a, b, strategy=EWMA)
+        balanced.replicas[0].latency = 0.01
+        balanced.replicas[1].latency = 0.02
+        balanced.replicas[1].outstanding = 5
+        balanced.run("EXE", [])
+        self.assertEqual(a.calls, 1)
+        self.assertGreater(balanced.replicas[0].latency, 0.01)
+
+    def test_retry_refused_connection(self):
+        a, b = FakeProxy("A", error=ConnectionRefusedError()), FakeProxy("B", delay=0.01)
+        balanced = balanced_fakes(a, b)
+        self.assertEqual(balanced.run("EXE", [])["stdout"], "B")
+        self.assertEqual(balanced.replicas[0].failures, 1)
+
+    def test_no_retry_on_other_errors(self):
+        a, b = FakeProxy("A", error=ConnectionResetError()), FakeProxy("B", delay=0.01)
+        balanced = balanced_fakes(a, b)
+        self.assertRaises(ConnectionResetError, balanced.run, "EXE", [])
+        self.assertEqual(b.calls, 0)
+
+    def test_retries_exhausted(self):
+        proxies = [FakeProxy(name, error=ConnectionRefusedError()) for name in "ABC"]
+        balanced = balanced_fakes(*proxies, retries=1)
+        self.assertRaises(ConnectionRefusedError, balanced.run, "EXE", [])
+        self.assertEqual(sum(p.calls for p in proxies), 2)
+
+    def test_ejection_and_readmission(self):
+        a, b = FakeProxy("A", error=ConnectionRefusedError()), FakeProxy("B", delay=0.01)
+        balanced = balanced_fakes(a, b, failure_threshold=2, ejection_time=0.1)
+        balanced.run("EXE", [])
+        balanced.run("EXE", [])
+        self.assertIsNotNone(balanced.replicas[0].ejected_until)
+        for _ in range(3):
+            balanced.run("EXE", [])
+        self.assertEqual(a.calls, 2)
+        time.sleep(0.1)
+        self.assertEqual(balanced.run("EXE", [])["stdout"], "B")
+        wait_probe(balanced.replicas[0])
+        self.assertEqual(a.probes, 1)
+        self.assertIsNotNone(balanced.replicas[0].ejected_until)  # failed probe
+        a.error = None
+        time.sleep(0.1)
+        balanced.run("EXE", [])
+        wait_probe(balanced.replicas[0])
+        self.assertEqual(a.probes, 2)
+        self.assertIsNone(balanced.replicas[0].ejected_until)
+        self.assertEqual(balanced.run("EXE", [])["stdout"], "A")
+
+    def test_probe_does_not_hold_up_requests(self):
+        a, b = FakeProxy("A", error=ConnectionRefusedError()), FakeProxy("B")
+        balanced = balanced_fakes(a, b, failure_threshold=1, ejection_time=0.05)
+        balanced.run("EXE", [])
+        time.sleep(0.05)
+        a.catalog = lambda: time.sleep(1)  # silently dropped packets
+        start = time.monotonic()
+        self.assertEqual(balanced.run("EXE", [])["stdout"], "B")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertTrue(balanced.replicas[0].probing)
+        self.assertEqual(balanced.run("EXE", [])["stdout"], "B")  # a single probe at a time
+        wait_probe(balanced.replicas[0])
+        self.assertIsNone(balanced.replicas[0].ejected_until)
+
+    def test_no_replica_available(self):
+        a = FakeProxy("A", error=ConnectionRefusedError())
+        balanced = balanced_fakes(a, failure_threshold=1)
+        self.assertRaises(ConnectionRefusedError, balanced.run, "EXE", [])
+        self.assertRaises(NoReplicaError, balanced.run, "EXE", [])
+
+
+class TestHedging(unittest.TestCase):
+    def _timed_run(self, balanced, **kwargs):
+        start = time.monotonic()
+        result = balanced.run("EXE", [], **kwargs)
+        return result["stdout"], time.monotonic() - start
+
+    def test_hedge(self):
+        slow, fast = FakeProxy("SLOW", delay=0.5), FakeProxy("FAST")
+        balanced = balanced_fakes(slow, fast, hedge_delay=0.05, hedge_budget=1)
+        output, elapsed = self._timed_run(balanced, hedge=True)
+        self.assertEqual(output, "FAST")
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual((slow.calls, fast.calls), (1, 1))
+
+    def test_no_hedge_when_fast(self):
+        a, b = FakeProxy("A"), FakeProxy("B")
+        balanced = balanced_fakes(a, b, hedge_delay=0.2, hedge_budget=1)
+        self.assertEqual(self._timed_run(balanced, hedge=True)[0], "A")
+        self.assertEqual(b.calls, 0)
+
+    def test_not_idempotent(self):
+        slow, fast = FakeProxy("SLOW", delay=0.2), FakeProxy("FAST")
+        balanced = balanced_fakes(slow, fast, hedge_delay=0.05, hedge_budget=1)
+        self.assertEqual(self._timed_run(balanced)[0], "SLOW")
+        self.assertEqual(fast.calls, 0)
+
+    def test_budget(self):
+        slow, fast = FakeProxy("SLOW", delay=0.2), FakeProxy("FAST")
+        balanced = balanced_fakes(slow, fast, hedge_delay=0.05, hedge_budget=0.5)
+        balanced.replicas[1].outstanding = 10  # always pick SLOW first
+        self.assertEqual(self._timed_run(balanced, hedge=True)[0], "SLOW")
+        self.assertEqual(self._timed_run(balanced, hedge=True)[0], "FAST")
+        self.assertEqual(self._timed_run(balanced, hedge=True)[0], "SLOW")
+
+    def test_hedge_failure(self):
+        slow, broken = FakeProxy("SLOW", delay=0.2), FakeProxy("BROKEN", error=ConnectionResetError())
+        balanced = balanced_fakes(slow, broken, hedge_delay=0.05, hedge_budget=1)
+        self.assertEqual(self._timed_run(balanced, hedge=True)[0], "SLOW")
+        self.assertEqual(broken.calls, 1)
+
+    def test_percentile(self):
+        balanced = balanced_fakes(FakeProxy("A"), hedge_delay=1, hedge_percentile=90)
+        balanced._latencies.extend([0.1] * 5)
+        self.assertEqual(balanced._hedge_after(), 1)  # not enough samples
+        balanced._latencies.extend([0.1] * 4 + [0.5] * 2)
+        self.assertEqual(balanced._hedge_after(), 0.5)
+
+
+class TestBalancedProxyAcceptance(unittest.TestCase):
+    def setUp(self):
+        self.daemon = ThreadDaemon(lambda command: executor(EXECUTABLE_PATH, command))
+
+    def tearDown(self):
+        self.daemon.stop()
+
+    def test_run(self):
+        dead_target = ("localhost", 1)
+        balanced = BalancedProxy([dead_target, self.daemon.target])
+        for _ in range(3):
+            result = balanced.run(EXECUTABLE_NAME, ["P1"])
+            self.assertEqual(result, {"stdout": os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), "returncode": 0})
@@ -0,0 +1,118 @@
+import io
+import json
+import tempfile
+import threading
+import time
+import unittest
+
+from wrun import executor
+from wrun.batch import Batch, Stats, main, read_jobs
+
+from tests.config import *
+
+
+def slow_executor(command):
+    time.sleep(0.5)
+    return executor(EXECUTABLE_PATH, command)
+
+
+class TestReadJobs(unittest.TestCase):
+    def test_defaults(self):
+        lines = ['{"executable": "E", "args": ["A"]}', "", "# comment", '{"host": "H", "port": 1, "executable": "F"}']
+        self.assertEqual(list(read_jobs(lines, "localhost", 3333)), [
+            (1, {"host": "localhost", "port": 3333, "executable": "E", "args": ["A"]}),
+            (4, {"host": "H", "port": 1, "executable": "F"})])
+
+    def test_invalid(self):
+        jobs = list(read_jobs(["{", '{"host": "H"}', "[]"]))
+        self.assertEqual([number for number, _ in jobs], [1, 2, 3])
+        for _, job in jobs:
+            self.assertIn("invalid", job)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.daemon = ThreadDaemon(lambda command: executor(EXECUTABLE_PATH, command))
+        self.slow = ThreadDaemon(slow_executor)
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.slow.stop()
+
+    def _job(self, daemon, *args):
+        return {"host": daemon.target[0], "port": daemon.target[1], "executable": EXECUTABLE_NAME, "args": list(args)}
+
+    def test_run(self):
+        jobs = [(1, self._job(self.slow, "P1")), (2, self._job(self.daemon, "P2")), (3, {"invalid": "no host"})]
+        records = list(Batch().run(jobs))
+        self.assertEqual([r["job"] for r in records], [3, 2, 1])  # as they complete
+        self.assertFalse(records[0]["ok"])
+        self.assertTrue(records[1]["ok"])
+        self.assertEqual(records[1]["result"]["stdout"], os.linesep.join([EXECUTABLE_PATH, "hello P2", ""]))
+
+    def test_results_while_reading(self):
+        first = threading.Event()
+
+        def jobs():
+            yield 1, self._job(self.daemon, "P1")
+            self.assertTrue(first.wait(5))  # a slow producer: the first result is yielded meanwhile
+            yield 2, self._job(self.daemon, "P2")
+
+        records = []
+        for record in Batch().run(jobs()):
+            records.append(record["job"])
+            first.set()
+        self.assertEqual(records, [1, 2])
+
+    def test_bounded_pending(self):
+        read = []
+
+        def jobs():
+            for n in range(6):
+                read.append(n)
+                yield n, self._job(self.slow, "P")
+
+        records = Batch(parallelism=1).run(jobs())
+        next(records)
+        self.assertLessEqual(len(read), 4)
+        self.assertEqual(len(list(records)), 5)
+
+    def test_proxy_reuse(self):
+        batch = Batch()
+        list(batch.run([(n, self._job(self.daemon, "P")) for n in range(3)]))
+        self.assertEqual(len(batch._proxies), 1)
+
+    def test_parallelism(self):
+        start = time.monotonic()
+        self.assertEqual(len(list(Batch(parallelism=2).run([(n, self._job(self.slow, "P")) for n in range(4)]))), 4)
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+
+    def test_timeout(self):
+        records = list(Batch(timeout=0.2).run([(1, self._job(self.slow, "P")), (2, self._job(self.daemon, "P"))]))
+        self.assertEqual([r["ok"] for r in records], [True, False])
+        self.assertIn("timed out", records[1]["error"])
+
+    def test_main(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as jobs:
+            jobs.write(json.dumps({"executable": EXECUTABLE_NAME, "args": ["P1"]}) + "\n")
+            jobs.write(json.dumps({"executable": EXECUTABLE_NAME, "args": ["ERROR"]}) + "\n")
+        try:
+            stdout, stderr = io.StringIO(), io.StringIO()
+            status = main([jobs.name, "--host", "localhost", "--port", str(self.daemon.target[1])], stdout, stderr)
+        finally:
+            os_remove(jobs.name)
+        self.assertEqual(status, 1)
+        records = sorted((json.loads(line) for line in stdout.getvalue().splitlines()), key=lambda r: r["job"])
+        self.assertEqual([(r["job"], r["ok"]) for r in records], [(1, True), (2, False)])
+        self.assertIn("2 done, 1 failed", stderr.getvalue())
+
+
+class TestStats(unittest.TestCase):
+    def test_progress(self):
+        stream = io.StringIO()
+        stats = Stats(stream, interval=0)
+        stats.add({"ok": True, "elapsed": 1})
+        stats.add({"ok": False})
+        self.assertIn("2 done, 1 failed", stream.getvalue().splitlines()[-1])
+        stats.summary()
+        self.assertIn("max 1.000s", stream.getvalue())
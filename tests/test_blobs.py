@@ -0,0 +1,65 @@
+import unittest
+import unittest.mock
+
+from wrun import Proxy
+from wrun.blobs import BlobStore, blob_hash
+
+from tests.config import *
+
+
+class TestBlobStore(unittest.TestCase):
+    def test_put_get(self):
+        store = BlobStore(100)
+        key = store.put("àbc")
+        self.assertEqual(key, blob_hash("àbc"))
+        self.assertEqual(store.get(key), "àbc")
+        self.assertIn(key, store)
+        self.assertEqual(store.size, 4)
+        self.assertEqual(store.put("àbc"), key)
+        self.assertEqual(store.size, 4)
+
+    def test_missing(self):
+        self.assertIsNone(BlobStore(100).get(blob_hash("abc")))
+
+    def test_lru_eviction(self):
+        store = BlobStore(10)
+        first, second = store.put("1234"), store.put("5678")
+        store.get(first)
+        third = store.put("90ab")
+        self.assertEqual([key in store for key in (first, second, third)], [True, False, True])
+        self.assertEqual(store.size, 8)
+
+    def test_too_large(self):
+        store = BlobStore(3)
+        self.assertIsNone(store.put("1234"))
+        self.assertEqual(store.size, 0)
+
+
+@unittest.skipIf(sys.platform == 'win32', "STDIN is not the same in sample.bat")
+class TestProxyBlobs(ServiceTestMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self._service(BLOB_CACHE_SIZE=1000)
+        self.proxy = Proxy(*self._serve(self.service).target)
+
+    def test_put_blob(self):
+        key = self.proxy.put_blob("some input")
+        self.assertTrue(self.proxy.has_blob(key))
+        self.assertFalse(self.proxy.has_blob(blob_hash("other input")))
+        result = self.proxy.run(EXECUTABLE_NAME, ["STDIN"], stdin_hash=key)
+        self.assertEqual(result["stdout"], os.linesep.join([EXECUTABLE_PATH, "some input", ""]))
+
+    def test_put_blob_too_large(self):
+        self.assertIsNone(self.proxy.put_blob("x" * 1001))
+
+    def test_unknown_blob(self):
+        self.assertEqual(
+            self.proxy.run(EXECUTABLE_NAME, ["STDIN"], stdin_hash=blob_hash("some input")), {"error": "unknown blob"})
+
+    def test_run_cached(self):
+        expected = {"stdout": os.linesep.join([EXECUTABLE_PATH, "some input", ""]), "returncode": 0}
+        self.assertEqual(self.proxy.run_cached(EXECUTABLE_NAME, ["STDIN"], "some input"), expected)
+        self.assertTrue(self.proxy.has_blob(blob_hash("some input")))
+        with unittest.mock.patch.object(self.service.blobs, "put") as mock_put:
+            self.assertEqual(self.proxy.run_cached(EXECUTABLE_NAME, ["STDIN"], "some input"), expected)
+            mock_put.assert_not_called()
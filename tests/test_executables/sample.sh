@@ -10,6 +10,31 @@ if [[ $1 == "STDIN" ]]
         echo $(cat)
         exit 0
 fi
+if [[ $1 == "SLEEP" ]]
+    then
+        sleep $2
+        echo slept $2
+        exit 0
+fi
+if [[ $1 == "LIMITS" ]]
+    then
+        ulimit -t -n
+        exit 0
+fi
+if [[ $1 == "SPIN" ]]
+    then
+        while :; do :; done
+fi
+if [[ $1 == "SEQ" ]]
+    then
+        seq $2
+        exit 0
+fi
+if [[ $1 == "WC" ]]
+    then
+        wc -l | tr -d ' '
+        exit 0
+fi
 if [[ $1 == "INVALID" ]]
     then
         invalid_command
@@ -0,0 +1,66 @@
+import time
+import unittest
+
+from wrun import executor
+from wrun.fanout import ProxyGroup, Reply, Summary
+
+from tests.config import *
+
+
+def slow_executor(command):
+    time.sleep(0.5)
+    return executor(EXECUTABLE_PATH, command)
+
+
+class TestProxyGroup(unittest.TestCase):
+    def setUp(self):
+        self.daemons = [ThreadDaemon(lambda command: executor(EXECUTABLE_PATH, command)) for _ in range(3)]
+        self.slow = ThreadDaemon(slow_executor)
+        self.targets = [d.target for d in self.daemons]
+
+    def tearDown(self):
+        for d in self.daemons + [self.slow]:
+            d.stop()
+
+    def test_run(self):
+        replies = list(ProxyGroup(self.targets).run(EXECUTABLE_NAME, ["P1"]))
+        self.assertEqual(sorted(r.target for r in replies), sorted(self.targets))
+        for r in replies:
+            self.assertTrue(r.ok)
+            self.assertEqual(r.result["stdout"], os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]))
+
+    def test_replies_as_they_arrive(self):
+        replies = list(ProxyGroup([self.slow.target] + self.targets).run(EXECUTABLE_NAME, ["P1"]))
+        self.assertEqual(replies[-1].target, self.slow.target)
+
+    def test_parallelism(self):
+        group = ProxyGroup([self.slow.target] * 4, parallelism=2)
+        start = time.monotonic()
+        self.assertEqual(len(list(group.run(EXECUTABLE_NAME, ["P1"]))), 4)
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+
+    def test_timeout(self):
+        summary = ProxyGroup([self.slow.target] + self.targets, timeout=0.2).run_all(EXECUTABLE_NAME, ["P1"])
+        self.assertEqual(len(summary.successes), 3)
+        self.assertEqual([r.target for r in summary.failures], [self.slow.target])
+        self.assertIsInstance(summary.failures[0].error, OSError)
+
+    def test_summary(self):
+        dead_target = ("localhost", 1)
+        summary = ProxyGroup(self.targets + [dead_target, self.slow.target]).run_all(EXECUTABLE_NAME, ["ERROR"])
+        self.assertEqual(summary.successes, [])
+        self.assertEqual(len(summary.failures), 5)
+        self.assertEqual(summary.slowest(1)[0].target, self.slow.target)
+        self.assertEqual(len(summary.slowest()), 5)
+
+
+class TestSummary(unittest.TestCase):
+    def test_ok(self):
+        self.assertTrue(Reply("T", {"stdout": "", "returncode": 0}, None, 0.1).ok)
+        self.assertFalse(Reply("T", {"stdout": "", "returncode": 1}, None, 0.1).ok)
+        self.assertFalse(Reply("T", {"error": "unknown executable"}, None, 0.1).ok)
+        self.assertFalse(Reply("T", None, OSError(), 0.1).ok)
+
+    def test_slowest(self):
+        summary = Summary(Reply(t, None, OSError(), elapsed) for t, elapsed in [("A", 1), ("B", 3), ("C", 2)])
+        self.assertEqual([r.target for r in summary.slowest(2)], ["B", "C"])
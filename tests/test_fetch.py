@@ -0,0 +1,94 @@
+import shutil
+import socket
+import tempfile
+import unittest
+import unittest.mock
+
+from wrun import Proxy
+from wrun.transport import FileResponse
+
+from tests.config import *
+
+KEY = "shared-secret"
+
+
+class TestFileResponse(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "artifact")
+        with open(self.path, "wb") as f:
+            f.write(b"0123456789")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read(self):
+        self.assertEqual(FileResponse(self.path).read(), b'{"offset": 0, "size": 10}\n0123456789')
+        self.assertEqual(FileResponse(self.path, 8).read(), b'{"offset": 8, "size": 2}\n89')
+        self.assertEqual(FileResponse(self.path, 2, 3).read(), b'{"offset": 2, "size": 3}\n234')
+        self.assertEqual(FileResponse(self.path, 20).read(), b'{"offset": 10, "size": 0}\n')
+
+
+class TestProxyFetch(ServiceTestMixin, unittest.TestCase):
+    PROXY_KWARGS = {}
+
+    def setUp(self):
+        super().setUp()
+        self.artifact_path = os.path.join(self.tmp_dir, "artifacts")
+        os.mkdir(self.artifact_path)
+        self.data = os.urandom(1000000)
+        with open(os.path.join(self.artifact_path, "report.bin"), "wb") as f:
+            f.write(self.data)
+        with open(os.path.join(self.tmp_dir, "secret"), "wb") as f:
+            f.write(b"secret")
+        os.symlink(os.path.join(self.tmp_dir, "secret"), os.path.join(self.artifact_path, "link"))
+        daemon = self._serve(self._service(ARTIFACT_PATH=self.artifact_path), **self.PROXY_KWARGS)
+        self.proxy = Proxy(*daemon.target, **self.PROXY_KWARGS)
+        self.local_path = os.path.join(self.tmp_dir, "local.bin")
+
+    def _local_data(self):
+        with open(self.local_path, "rb") as f:
+            return f.read()
+
+    def test_fetch(self):
+        with unittest.mock.patch.object(
+                socket.socket, "sendfile", autospec=True, side_effect=socket.socket.sendfile) as mock_sendfile:
+            self.assertEqual(self.proxy.fetch("report.bin", self.local_path), {"offset": 0, "size": len(self.data)})
+        self.assertEqual(self._local_data(), self.data)
+        self.assertEqual(mock_sendfile.called, not self.PROXY_KWARGS)
+
+    def test_range(self):
+        self.assertEqual(self.proxy.fetch("report.bin", self.local_path, 10, 5), {"offset": 10, "size": 5})
+        self.assertEqual(self._local_data(), bytes(10) + self.data[10:15])
+
+    def test_resume(self):
+        with open(self.local_path, "wb") as f:
+            f.write(self.data[:1234])
+        self.proxy.fetch("report.bin", self.local_path, os.path.getsize(self.local_path))
+        self.assertEqual(self._local_data(), self.data)
+
+    def test_overwrite_longer_file(self):
+        with open(self.local_path, "wb") as f:
+            f.write(os.urandom(len(self.data) + 1000))
+        self.proxy.fetch("report.bin", self.local_path)
+        self.assertEqual(self._local_data(), self.data)
+        self.proxy.fetch("report.bin", self.local_path, 10, 5)
+        self.assertEqual(self._local_data(), self.data[:15])
+
+    def test_not_available(self):
+        for name in ["missing.bin", "../secret", "link", os.path.join(self.tmp_dir, "secret"), "."]:
+            self.assertEqual(self.proxy.fetch(name, self.local_path), {"error": "artifact not available"})
+        self.assertFalse(os.path.exists(self.local_path))
+
+    def test_invalid_range(self):
+        self.assertEqual(self.proxy.fetch("report.bin", self.local_path, -1), {"error": "invalid range"})
+
+
+class TestSignedProxyFetch(TestProxyFetch):
+    SETTINGS = {"HMAC_KEY": KEY}
+    PROXY_KWARGS = {"hmac_key": KEY}
+
+
+class TestFetchNotEnabled(ServiceTestMixin, unittest.TestCase):
+    def test(self):
+        self.assertEqual(self._service().fetch("sample.sh"), {"error": "artifacts not enabled"})
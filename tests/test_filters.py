@@ -0,0 +1,80 @@
+import json
+import sys
+import unittest
+
+from wrun import run_executable
+from wrun.filters import FilterError, build
+
+from tests.config import *
+
+OUTPUT = b"".join(b"line %d\n" % idx for idx in range(1, 11)) + b"last"
+
+
+def apply(spec, data=OUTPUT, chunk_size=3):
+    output_filter = build(spec)
+    output = [output_filter.feed(data[idx:idx + chunk_size]) for idx in range(0, len(data), chunk_size)]
+    return b"".join(output) + output_filter.end()
+
+
+class TestFilters(unittest.TestCase):
+    def test_regex(self):
+        self.assertEqual(apply({"regex": "line [13]$"}), b"line 1\nline 3\n")
+        self.assertEqual(apply({"regex": "^la"}), b"last")
+
+    def test_head(self):
+        self.assertEqual(apply({"head": 2}), b"line 1\nline 2\n")
+        self.assertEqual(apply({"head": 20}), OUTPUT)
+
+    def test_tail(self):
+        self.assertEqual(apply({"tail": 2}), b"line 10\nlast")
+
+    def test_bytes(self):
+        self.assertEqual(apply({"bytes": [5, 13]}), OUTPUT[5:13])
+        self.assertEqual(apply({"bytes": [70]}), OUTPUT[70:])
+
+    def test_json(self):
+        data = json.dumps({"a": {"b": [1, {"c": "value"}]}}).encode()
+        self.assertEqual(apply({"json": "a.b.1.c"}, data), b'"value"')
+        self.assertEqual(apply({"json": ""}, data), data)
+        self.assertRaises(FilterError, apply, {"json": "a.x"}, data)
+        self.assertRaises(FilterError, apply, {"json": "a"}, OUTPUT)
+
+    def test_chain(self):
+        self.assertEqual(apply([{"regex": "line"}, {"tail": 3}, {"head": 2}]), b"line 8\nline 9\n")
+        self.assertEqual(apply([{"head": 2}, {"bytes": [2, 9]}]), b"ne 1\nli")
+
+    def test_chunk_sizes(self):
+        for chunk_size in [1, 7, 1000]:
+            self.assertEqual(apply({"regex": "1"}, chunk_size=chunk_size), b"line 1\nline 10\n")
+
+    def test_invalid(self):
+        for spec in [
+                {"grep": "x"}, {"head": 1, "tail": 1}, ["head"], {"regex": 5}, {"json": None}, {"head": "3"},
+                {"tail": -1}, {"head": True}, {"bytes": ["a"]}, {"bytes": 1}, {"bytes": [1, 2, 3]}, {"bytes": []}]:
+            self.assertRaises(ValueError, build, spec)
+
+
+@unittest.skipIf(sys.platform == 'win32', "SEQ is not available in sample.bat")
+class TestExecutorFilter(unittest.TestCase):
+    def _run(self, *args, **kwargs):
+        return run_executable(EXECUTABLE_PATH, EXECUTABLE_NAME, list(args), "", **kwargs)
+
+    def test_filter(self):
+        self.assertEqual(
+            self._run("SEQ", "100000", output_filter=[{"regex": "^9999"}, {"tail": 2}]),
+            {"stdout": "99998\n99999\n", "returncode": 0})
+
+    def test_stderr_and_stdin(self):
+        result = run_executable(
+            EXECUTABLE_PATH, EXECUTABLE_NAME, ["ERROR"], "input", collect_stderr=True, output_filter={"head": 1})
+        self.assertEqual(result, {"stdout": EXECUTABLE_PATH + "\n", "stderr": "err_msg ERROR \n", "returncode": 1})
+
+    def test_timeout(self):
+        result = self._run("SLEEP", "1", timeout=0.2, output_filter={"head": 1})
+        self.assertEqual(result["error"], "timeout")
+        self.assertEqual(result["stdout"], EXECUTABLE_PATH + "\n")
+
+    def test_failed(self):
+        self.assertEqual(
+            self._run("P1", output_filter={"json": "a"}),
+            {"stdout": "", "returncode": 0, "error": "output filter failed"})
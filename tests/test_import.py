@@ -0,0 +1,32 @@
+import subprocess
+import unittest
+
+from tests.config import *
+
+SERVER_MODULES = ["wrun.server", "subprocess", "runpy", "ssl", "logging.config", "multiprocessing", "hashlib"]
+
+
+def imported(statement, modules):
+    """ The modules imported by statement, in a fresh interpreter """
+    script = "import sys; {}; print(' '.join(m for m in {!r} if m in sys.modules))".format(statement, modules)
+    return subprocess.check_output([sys.executable, "-c", script], cwd=os.path.dirname(CWD)).decode().split()
+
+
+class TestLazyImport(unittest.TestCase):
+    def test_client(self):
+        self.assertEqual(imported("import wrun; wrun.Proxy, wrun.client, wrun.fetch", SERVER_MODULES), [])
+
+    def test_server(self):
+        modules = ["wrun.server", "subprocess"]
+        self.assertEqual(imported("from wrun import Service", modules), modules)
+
+    def test_transport(self):
+        import wrun
+        from wrun import transport
+        for name in ["TCPClient", "TCPServer", "SecureTCPClient", "SecureTCPServer"]:
+            self.assertIs(getattr(wrun, name), getattr(transport, name))
+        self.assertEqual(imported("from wrun import TCPClient, TCPServer", SERVER_MODULES), [])
+
+    def test_unknown(self):
+        import wrun
+        self.assertRaises(AttributeError, getattr, wrun, "missing")
@@ -0,0 +1,55 @@
+import signal
+import sys
+import unittest
+
+from wrun import run_executable
+from wrun.limits import exceeded, merge
+
+from tests.config import *
+
+
+class TestLimits(unittest.TestCase):
+    def test_merge(self):
+        self.assertEqual(
+            merge({"cpu_time": 10, "open_files": 64}, None, {"cpu_time": 20, "file_size": None}, {"cpu_time": 5}),
+            {"cpu_time": 5, "open_files": 64})
+
+    def test_merge_unknown(self):
+        self.assertRaises(ValueError, merge, {"threads": 1})
+
+    def test_merge_invalid(self):
+        for value in (-1, "10", True, float("inf"), float("nan")):
+            self.assertRaises(ValueError, merge, {"address_space": 500000000}, {"address_space": value})
+
+    def test_exceeded(self):
+        self.assertEqual(exceeded({"cpu_time": 1}, -signal.SIGXCPU), "cpu_time")
+        self.assertEqual(exceeded({"file_size": 1}, -signal.SIGXFSZ), "file_size")
+        self.assertIsNone(exceeded({"open_files": 1}, -signal.SIGXCPU))
+        self.assertEqual(exceeded({"cpu_time": 1}, -signal.SIGKILL, {"user_time": 0.9, "system_time": 0.2}), "cpu_time")
+        self.assertIsNone(exceeded({"cpu_time": 1}, 0, {"user_time": 0.9, "system_time": 0.2}))
+
+
+@unittest.skipIf(sys.platform == 'win32', "no resource limits on Windows")
+class TestExecutorLimits(unittest.TestCase):
+    def _run(self, arg, limits):
+        return run_executable(EXECUTABLE_PATH, EXECUTABLE_NAME, [arg], "", limits=limits)
+
+    def test_applied(self):
+        result = self._run("LIMITS", {"cpu_time": 5, "open_files": 64})
+        lines = result["stdout"].splitlines()
+        self.assertTrue(lines[1].endswith(" 5"))
+        self.assertTrue(lines[2].endswith(" 64"))
+        self.assertEqual(result["returncode"], 0)
+
+    def test_above_hard_limits(self):
+        import resource
+        result = self._run("LIMITS", {"cpu_time": 1e30, "open_files": 10 ** 9})
+        self.assertEqual(result["returncode"], 0)
+        lines = result["stdout"].splitlines()
+        self.assertTrue(lines[2].endswith(" {}".format(resource.getrlimit(resource.RLIMIT_NOFILE)[1])))
+
+    def test_cpu_time_exceeded(self):
+        result = self._run("SPIN", {"cpu_time": 1})
+        self.assertEqual(result["error"], "limit exceeded")
+        self.assertEqual(result["limit"], "cpu_time")
+        self.assertEqual(result["returncode"], -signal.SIGXCPU)
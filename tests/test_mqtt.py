@@ -4,8 +4,11 @@ docker container stop wrun-eclipse-mosquitto
 
 pip install paho-mqtt
 """
+import selectors
+import socket
 import subprocess
 import unittest
+import unittest.mock
 
 from wrun import mqtt
 
@@ -143,3 +146,361 @@ class TestHuge(unittest.TestCase):
         self._process()
         self._process()
         self.assertEqual(subscriber.received, [payload])
+
+
+def remaining_length(length):
+    encoded = bytearray()
+    while True:
+        length, byte = length >> 7, length & 0x7F
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def packet(first_byte, body=b""):
+    return bytes([first_byte]) + remaining_length(len(body)) + body
+
+
+def publish(topic, payload, qos=0):
+    topic = topic.encode()
+    packet_id = b"\x00\x01" if qos else b""
+    return packet(0x30 | qos << 1, len(topic).to_bytes(2, "big") + topic + packet_id + payload)
+
+
+PINGREQ = packet(0xC0)
+DISCONNECT = packet(0xE0)
+
+
+class TestPacketParser(unittest.TestCase):
+    def test_packets(self):
+        data = publish("a/b", b"x" * 200, qos=1) + PINGREQ + publish("c", b"") + DISCONNECT
+        packets = mqtt.PacketParser().feed(data)
+        self.assertEqual(packets, [
+            mqtt.Packet(3, 2, 210, "a/b"), mqtt.Packet(12, 0, 2, None), mqtt.Packet(3, 0, 5, "c"),
+            mqtt.Packet(14, 0, 2, None)])
+
+    def test_split_anywhere(self):
+        data = publish("topic/1", b"y" * 300) + PINGREQ + publish("topic/2", b"z" * 20000)
+        expected = mqtt.PacketParser().feed(data)
+        for size in (1, 2, 3, 7, 1000):
+            parser = mqtt.PacketParser()
+            packets = []
+            for idx in range(0, len(data), size):
+                packets.extend(parser.feed(data[idx:idx + size]))
+            self.assertEqual(packets, expected)
+        self.assertEqual([p.topic for p in expected], ["topic/1", None, "topic/2"])
+        self.assertEqual(expected[2].size, len(publish("topic/2", b"z" * 20000)))
+
+    def test_malformed(self):
+        self.assertRaises(mqtt.ProtocolError, mqtt.PacketParser().feed, b"\x30\xff\xff\xff\xff\x01")
+
+
+class TestStats(unittest.TestCase):
+    def test_describe(self):
+        stats = mqtt.Stats()
+        for packet in mqtt.PacketParser().feed(publish("a", b"1") * 2 + publish("b", b"22" * 10) + PINGREQ):
+            stats.add(packet)
+        description = stats.describe()
+        self.assertEqual(description["packets"], {"PUBLISH": 3, "PINGREQ": 1})
+        self.assertEqual(
+            [(t["topic"], t["messages"], t["bytes"]) for t in description["topics"]], [("b", 1, 25), ("a", 2, 12)])
+        self.assertGreater(description["topics"][0]["message_rate"], 0)
+        self.assertEqual([t["message_rate"] for t in stats.describe()["topics"]], [0, 0])  # since the previous one
+
+
+class SocketPairMixin:
+    """ client and remote Connections, their peers are client_app and remote_app """
+
+    def setUp(self):
+        self.patch = unittest.mock.patch.object(mqtt.log, "debug")
+        self.patch.start()
+        self.pool = selectors.DefaultSelector()
+        self.client_app, client_sock = self._socketpair()
+        remote_sock, self.remote_app = self._socketpair()
+        self.client = self._connection(client_sock)
+        self.remote = self._connection(remote_sock)
+
+    def tearDown(self):
+        for host in (self.client, self.remote):
+            host.destroy()
+        self.client_app.close()
+        self.remote_app.close()
+        self.pool.close()
+        self.patch.stop()
+
+    @staticmethod
+    def _socketpair():
+        a, b = socket.socketpair()
+        for sock in (a, b):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        return a, b
+
+    def _connection(self, sock):
+        connection = mqtt.Connection(self.pool, sock)
+        connection.HIGH_WATERMARK = 16 * 1024
+        connection.LOW_WATERMARK = 4 * 1024
+        return connection
+
+    def _process(self):
+        for key, mask in self.pool.select(timeout=0):
+            key.data(key.fileobj, mask)
+
+    def _receive(self, sock, size):
+        sock.setblocking(False)
+        received = bytearray()
+        for _ in range(10000):
+            self._process()
+            try:
+                received += sock.recv(65536)
+            except BlockingIOError:
+                pass
+            if len(received) >= size:
+                break
+        return bytes(received)
+
+
+class TestConnectionBuffer(SocketPairMixin, unittest.TestCase):
+    DATA = publish("test", b"x" * 1000) * 256
+
+    def test_write_does_not_block(self):
+        self.client.set_dispatch(lambda data: None)
+        self.client.write(self.DATA)
+        self.assertGreater(self.client.buffered, 0)
+        self.assertEqual(self.pool.get_key(self.client.sock).events, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        self.assertEqual(self._receive(self.client_app, len(self.DATA)), self.DATA)
+        self.assertEqual(self.client.buffered, 0)
+        self.assertEqual(self.pool.get_key(self.client.sock).events, selectors.EVENT_READ)
+
+    def test_backpressure(self):
+        mqtt.Channel(self.client, self.remote)
+        self.remote_app.setblocking(False)
+        sent = 0
+        while sent < len(self.DATA) and not self.remote.paused:
+            try:
+                sent += self.remote_app.send(self.DATA[sent:sent + 1024])
+            except BlockingIOError:
+                pass
+            self._process()
+        self.assertTrue(self.remote.paused)  # the client does not read, the remote is not read either
+        self.assertNotIn(self.remote.sock, self.pool.get_map())
+        self.assertLessEqual(self.client.buffered, self.client.HIGH_WATERMARK + 1024)
+        received = self._receive(self.client_app, self.client.buffered)
+        self.assertFalse(self.remote.paused)
+        self.assertEqual(received, self.DATA[:len(received)])
+
+    def test_peer_closed(self):
+        self.client.set_dispatch(lambda data: None)
+        self.client_app.close()
+        self.client.write(b"data")
+        self._process()
+        self.assertTrue(self.client.closed)
+        self.client.write(b"data")  # ignored
+
+
+    def test_peer_reset_while_buffered(self):
+        self.client.set_dispatch(lambda data: None)
+        self.client.write(self.DATA)
+        self.assertGreater(self.client.buffered, 0)
+        self.client_app.close()  # unread data: the connection is reset
+        for _ in range(10):
+            self._process()
+        self.assertTrue(self.client.closed)
+        self.assertEqual(self.client.buffered, 0)
+
+
+class TestChannel(SocketPairMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.channel = mqtt.Channel(self.client, self.remote)
+        self.remote_app.setblocking(False)
+
+    def test_stats(self):
+        self.client_app.sendall(publish("up", b"1", qos=1) + PINGREQ[:1])
+        self.client_app.sendall(PINGREQ[1:])
+        self.remote_app.sendall(publish("down", b"22"))
+        expected = publish("up", b"1", qos=1) + PINGREQ
+        self.assertEqual(self._receive(self.remote_app, len(expected)), expected)
+        self.assertEqual(self._receive(self.client_app, 9), publish("down", b"22"))
+        self.assertEqual(self.channel.published.describe()["packets"], {"PUBLISH": 1, "PINGREQ": 1})
+        self.assertEqual(self.channel.delivered.describe()["topics"][0]["topic"], "down")
+
+    def test_client_disconnect(self):
+        self.client_app.sendall(DISCONNECT)
+        self.assertEqual(self._receive(self.remote_app, 2), DISCONNECT)
+        self.assertTrue(self.client.closed)
+        self.assertTrue(self.remote.closed)
+
+    def test_client_closed(self):
+        self.client_app.close()
+        self._process()
+        self.assertTrue(self.client.closed)
+        self.assertTrue(self.remote.closed)
+
+    def test_client_closed_with_buffered_data(self):
+        data = publish("up", b"x" * 150000)
+        self.client_app.setblocking(False)
+        sent = 0
+        while self.remote.buffered < self.remote.HIGH_WATERMARK:
+            sent += self.client_app.send(data[sent:sent + 1024])
+            self._process()
+        self.client_app.close()  # with data buffered for the remote
+        self.assertEqual(self._receive(self.remote_app, sent), data[:sent])
+        self._process()
+        self.assertTrue(self.client.closed)
+        self.assertTrue(self.remote.closed)
+
+    def test_remote_reset_while_buffered(self):
+        data = publish("up", b"x" * 150000)
+        self.client_app.setblocking(False)
+        sent = 0
+        while not self.client.paused:  # the remote does not read, the client is paused by backpressure
+            sent += self.client_app.send(data[sent:sent + 1024])
+            self._process()
+        self.remote_app.close()
+        for _ in range(10):
+            self._process()
+        self.assertTrue(self.remote.closed)
+        self.assertTrue(self.client.closed)
+
+    def test_remote_closed(self):
+        self.remote_app.sendall(publish("down", b"last"))
+        self.remote_app.close()
+        self.assertEqual(self._receive(self.client_app, 11), publish("down", b"last"))
+        self._process()
+        self.assertTrue(self.remote.closed)
+        self.assertTrue(self.client.closed)
+
+    def test_protocol_error(self):
+        self.client_app.sendall(b"\x30\xff\xff\xff\xff\x01")
+        self._process()
+        self.assertTrue(self.client.closed)
+        self.assertTrue(self.remote.closed)
+
+
+def connect(client_id, level=4):
+    properties = b"\x00" if level == 5 else b""
+    client_id = client_id.encode()
+    variable_header = b"\x00\x04MQTT" + bytes([level, 0x02]) + b"\x00\x3c" + properties
+    return packet(0x10, variable_header + len(client_id).to_bytes(2, "big") + client_id)
+
+
+class TestConnectClientId(unittest.TestCase):
+    def test_client_id(self):
+        self.assertEqual(mqtt.connect_client_id(connect("id-1")), "id-1")
+        self.assertEqual(mqtt.connect_client_id(connect("id-5", level=5) + PINGREQ), "id-5")
+
+    def test_incomplete(self):
+        data = connect("id-1")
+        for size in range(len(data)):
+            self.assertIsNone(mqtt.connect_client_id(data[:size]))
+
+    def test_invalid(self):
+        self.assertRaises(mqtt.ProtocolError, mqtt.connect_client_id, PINGREQ)
+        truncated_client_id = packet(0x10, b"\x00\x04MQTT\x04\x02\x00\x3c\x00\x09x")
+        self.assertRaises(mqtt.ProtocolError, mqtt.connect_client_id, truncated_client_id)
+
+
+class TestBalancingBroker(unittest.TestCase):
+    """ upstream brokers are plain listening sockets """
+
+    def setUp(self):
+        self.patch = unittest.mock.patch.object(mqtt.log, "debug")
+        self.patch.start()
+        self.upstreams = [self._listener() for _ in range(3)]
+        self.sockets = []
+        self.broker = None
+
+    def tearDown(self):
+        self.broker.stop()
+        for sock in self.upstreams + self.sockets:
+            sock.close()
+        self.patch.stop()
+
+    def _listener(self):
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        sock.listen()
+        sock.setblocking(False)
+        return sock
+
+    def _broker(self, strategy=mqtt.ROUND_ROBIN, upstreams=None, **kwargs):
+        upstreams = upstreams or [sock.getsockname() for sock in self.upstreams]
+        self.broker = mqtt.Broker(("localhost", 0), upstreams, strategy, **kwargs)
+
+    def _connect(self, client_id):
+        """ index of the upstream the client is relayed to """
+        client = socket.create_connection(self.broker.address)
+        self.sockets.append(client)
+        client.sendall(connect(client_id))
+        accepted = []  # (upstream index, socket), health probes too
+        for _ in range(100):
+            self.broker.process(0.01)
+            for idx, upstream in enumerate(self.upstreams):
+                try:
+                    sock, _ = upstream.accept()
+                except BlockingIOError:
+                    continue
+                sock.setblocking(False)
+                self.sockets.append(sock)
+                accepted.append((idx, sock))
+            for idx, sock in accepted:
+                try:
+                    if sock.recv(1024) == connect(client_id):
+                        return idx
+                except (BlockingIOError, OSError):
+                    pass
+        self.fail("not relayed")
+
+    def test_round_robin(self):
+        self._broker()
+        self.assertEqual(sorted(self._connect("c{}".format(n)) for n in range(3)), [0, 1, 2])
+
+    def test_least_connections(self):
+        self._broker(mqtt.LEAST_CONNECTIONS)
+        self.broker.upstreams[0].connections = 5
+        self.broker.upstreams[2].connections = 5
+        self.assertEqual(self._connect("c1"), 1)
+        self.assertEqual([u.connections for u in self.broker.upstreams], [5, 1, 5])
+
+    def test_client_id(self):
+        self._broker(mqtt.CLIENT_ID)
+        chosen = self._connect("sensor-7")
+        self.assertEqual(self._connect("sensor-7"), chosen)
+
+    def test_failover(self):
+        self.upstreams[1].close()
+        self.upstreams[1] = self._listener()  # not in the broker upstreams
+        upstreams = [self.upstreams[0].getsockname(), ("localhost", self._closed_port())]
+        self._broker(mqtt.CLIENT_ID, upstreams)
+        client_id = next(
+            "c{}".format(n) for n in range(100) if self.broker.choose("c{}".format(n)) is self.broker.upstreams[1])
+        self.assertEqual(self._connect(client_id), 0)
+        self.assertFalse(self.broker.upstreams[1].healthy)
+        self.assertEqual([u.connections for u in self.broker.upstreams], [1, 0])
+
+    def test_health_check(self):
+        port = self._closed_port()
+        self._broker(upstreams=[self.upstreams[0].getsockname(), ("localhost", port)], health_interval=0)
+        for _ in range(10):
+            self.broker.process(0.01)
+        self.assertEqual([u.healthy for u in self.broker.upstreams], [True, False])
+        revived = socket.socket()
+        self.sockets.append(revived)
+        revived.bind(("localhost", port))
+        revived.listen()
+        for _ in range(10):
+            self.broker.process(0.01)
+        self.assertEqual([u.healthy for u in self.broker.upstreams], [True, True])
+
+    def test_unknown_strategy(self):
+        self._broker()
+        self.assertRaises(ValueError, mqtt.Broker, ("localhost", 0), [], "random")
+
+    @staticmethod
+    def _closed_port():
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
@@ -0,0 +1,66 @@
+import sys
+import unittest
+
+from wrun import Proxy, run_pipeline
+
+from tests.config import *
+
+
+@unittest.skipIf(sys.platform == 'win32', "SEQ and WC are not available in sample.bat")
+class TestRunPipeline(unittest.TestCase):
+    def _run(self, *stages, input_stdin="", **kwargs):
+        return run_pipeline(EXECUTABLE_PATH, [(EXECUTABLE_NAME, args) for args in stages], input_stdin, **kwargs)
+
+    def test_pipeline(self):
+        self.assertEqual(
+            self._run(["SEQ", "100000"], ["WC"]),
+            {"stdout": EXECUTABLE_PATH + "\n100001\n", "returncode": 0, "returncodes": [0, 0]})
+
+    def test_input_stdin(self):
+        self.assertEqual(self._run(["STDIN"], ["WC"], input_stdin="a\nb")["stdout"], EXECUTABLE_PATH + "\n2\n")
+
+    def test_single_stage(self):
+        self.assertEqual(self._run(["STDIN"], input_stdin="a")["stdout"], EXECUTABLE_PATH + "\na\n")
+
+    def test_failing_stage(self):
+        result = self._run(["ERROR"], ["WC"], collect_stderr=True)
+        self.assertEqual(result["returncodes"], [1, 0])
+        self.assertEqual(result["stderr"], ["err_msg ERROR \n", ""])
+
+    def test_output_filter(self):
+        result = self._run(["SEQ", "100"], ["STDIN"], output_filter={"bytes": [0, 4]})
+        self.assertEqual(result["stdout"], EXECUTABLE_PATH[:4])
+
+    def test_timeout(self):
+        result = self._run(["SLEEP", "1"], ["WC"], timeout=0.2)
+        self.assertEqual(result["error"], "timeout")
+        self.assertNotEqual(result["returncodes"][0], 0)
+
+    def test_usage(self):
+        usage = self._run(["SEQ", "10"], ["WC"], collect_usage=True)["usage"]
+        self.assertEqual(len(usage), 2)
+        self.assertIn("max_rss", usage[1])
+
+
+@unittest.skipIf(sys.platform == 'win32', "SEQ and WC are not available in sample.bat")
+class TestProxyPipeline(ServiceTestMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self._service(EXECUTABLE_POLICIES={EXECUTABLE_NAME: {"max_output": 1000}})
+        self.proxy = Proxy(*self._serve(self.service).target)
+
+    def test_run_pipeline(self):
+        result = self.proxy.run_pipeline([(EXECUTABLE_NAME, ["SEQ", "100000"]), (EXECUTABLE_NAME, ["WC"])])
+        self.assertEqual(result, {"stdout": EXECUTABLE_PATH + "\n100001\n", "returncode": 0, "returncodes": [0, 0]})
+        self.assertEqual(self.proxy.usage()[0]["count"], 2)
+
+    def test_unknown_executable(self):
+        self.assertEqual(
+            self.proxy.run_pipeline([(EXECUTABLE_NAME, ["SEQ", "1"]), ("missing.exe", [])]),
+            {"error": "unknown executable"})
+        self.assertEqual(self.proxy.run_pipeline([]), {"error": "unknown executable"})
+
+    def test_options(self):
+        result = self.proxy.run_pipeline(
+            [(EXECUTABLE_NAME, ["STDIN"]), (EXECUTABLE_NAME, ["WC"])], "input", output_filter={"tail": 1})
+        self.assertEqual(result["stdout"], "2\n")
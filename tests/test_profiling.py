@@ -0,0 +1,156 @@
+import cProfile
+import io
+import json
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from wrun import Proxy
+from wrun.profiling import Profiling, RequestProfiler, SamplingProfiler
+
+from tests.config import *
+
+KEY = "shared-secret"
+
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+    return seconds
+
+
+def wait_file(path, timeout=5):
+    for _ in range(int(timeout / 0.05)):
+        if os.path.exists(path):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestProfilers(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "result")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_request_profiler(self):
+        profiler = RequestProfiler()
+        self.assertEqual(profiler.call(busy, 0.01), 0.01)
+        profiler.call(busy, 0.01)
+        profiler.dump(self.path)
+        stats = pstats.Stats(self.path, stream=io.StringIO())
+        calls = [v[1] for k, v in stats.stats.items() if k[2] == "busy"]
+        self.assertEqual(calls, [2])
+
+    def test_request_profiler_busy(self):
+        profiler = RequestProfiler()
+        profiler.call(busy, 0.01)
+        with unittest.mock.patch.object(cProfile.Profile, "enable", side_effect=ValueError("already active")):
+            self.assertEqual(profiler.call(busy, 0.01), 0.01)  # run, not profiled
+        profiler.dump(self.path)
+        stats = pstats.Stats(self.path, stream=io.StringIO())
+        self.assertEqual([v[1] for k, v in stats.stats.items() if k[2] == "busy"], [1])
+
+    def test_request_profiler_concurrent(self):
+        profiler = RequestProfiler()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(profiler.call(busy, 0.1))) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [0.1] * 3)
+
+    def test_sampling_profiler(self):
+        profiler = SamplingProfiler(interval=0.005)
+        profiler.start()
+        profiler.call(busy, 0.2)
+        profiler.stop()
+        profiler.dump(self.path)
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertRegex(stack, r";busy \(test_profiling.py:\d+\)$")
+        self.assertGreater(int(count), 5)
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.profiling = Profiling()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_requests(self):
+        name = self.profiling.start(self.tmp_dir, requests=2)
+        self.assertRegex(name, r"^wrun-\d+-\d+\.pstats$")
+        self.assertIsNone(self.profiling.start(self.tmp_dir))
+        self.profiling.call(busy, 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, name)))
+        self.profiling.call(busy, 0)
+        self.assertEqual(os.listdir(self.tmp_dir), [name])
+        self.assertIsNotNone(self.profiling.start(self.tmp_dir, requests=1))
+
+    def test_seconds(self):
+        name = self.profiling.start(self.tmp_dir, "sampling", seconds=0.2)
+        self.assertRegex(name, r"^wrun-\d+-\d+\.collapsed$")
+        self.assertEqual(self.profiling.call(busy, 0.1), 0.1)
+        self.assertTrue(wait_file(os.path.join(self.tmp_dir, name)))
+
+
+class TestServiceProfiling(ServiceTestMixin, unittest.TestCase):
+    def _service(self, **settings):
+        return super()._service(**dict({"PROFILE_PATH": self.tmp_dir, "HMAC_KEY": KEY}, **settings))
+
+    def _control(self, service, **request):
+        return json.loads(service.execute(json.dumps(request)))
+
+    def test_not_enabled(self):
+        for settings in [{"PROFILE_PATH": None}, {"HMAC_KEY": None}]:
+            service = self._service(**settings)
+            self.assertEqual(self._control(service, action="profile"), {"error": "profiling not enabled"})
+            self.assertEqual(
+                self._control(service, action="profile_result", name="wrun-1-1.pstats"),
+                {"error": "profiling not enabled"})
+
+    def test_unknown_mode(self):
+        self.assertEqual(
+            self._control(self._service(), action="profile", mode="perf"), {"error": "unknown profiling mode"})
+
+    def test_invalid_duration(self):
+        service = self._service()
+        for duration in [{"requests": 0}, {"requests": -1}, {"requests": 1.5}, {"seconds": 0}, {"seconds": "10"},
+                         {"seconds": -1, "requests": 1}]:
+            self.assertEqual(
+                self._control(service, action="profile", **duration), {"error": "invalid profiling duration"})
+        self.assertIn("name", self._control(service, action="profile", requests=1))
+
+    def test_result_name(self):
+        service = self._service()
+        self.assertEqual(
+            self._control(service, action="profile_result", name="../settings_test.py"),
+            {"error": "profile not available"})
+        self.assertEqual(
+            self._control(service, action="profile_result", name="wrun-1-1.pstats"),
+            {"error": "profile not available"})
+
+    def test_proxy(self):
+        proxy = Proxy(*self._serve(self._service(), hmac_key=KEY).target, hmac_key=KEY)
+        name = proxy.profile(requests=2)["name"]
+        self.assertEqual(proxy.profile(), {"error": "profiling in progress"})
+        self.assertEqual(proxy.profile_result(name), {"error": "profile not available"})
+        for _ in range(2):
+            self.assertEqual(proxy.run(EXECUTABLE_NAME, ["P1"])["returncode"], 0)
+        result = proxy.profile_result(name)
+        with open(os.path.join(self.tmp_dir, "result.pstats"), "wb") as f:
+            f.write(result["data"])
+        stats = pstats.Stats(f.name, stream=io.StringIO())
+        self.assertIn("run_command", [k[2] for k in stats.stats])
@@ -0,0 +1,120 @@
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from wrun import Proxy, Service
+from wrun.readiness import read_ready_file, remove_ready_file, sd_notify, wait_ready_file, write_ready_file
+
+from tests.config import *
+
+
+class TestReadyFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "wrun.ready")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_read(self):
+        self.assertIsNone(read_ready_file(self.path))
+        write_ready_file(self.path, {"pid": 1, "address": ["localhost", 3333]})
+        self.assertEqual(wait_ready_file(self.path), {"pid": 1, "address": ["localhost", 3333]})
+        self.assertEqual(os.listdir(self.tmp_dir), ["wrun.ready"])
+
+    def test_wait_timeout(self):
+        self.assertRaises(TimeoutError, wait_ready_file, self.path, timeout=0.05)
+
+    def test_remove(self):
+        write_ready_file(self.path, {"pid": 1})
+        remove_ready_file(self.path, 2)
+        self.assertEqual(read_ready_file(self.path), {"pid": 1})
+        remove_ready_file(self.path, 1)
+        self.assertIsNone(read_ready_file(self.path))
+
+
+@unittest.skipIf(sys.platform == 'win32', "no AF_UNIX sockets on Windows")
+class TestSdNotify(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "notify.sock")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+
+    def tearDown(self):
+        self.sock.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_notify(self):
+        with unittest.mock.patch.dict(os.environ, {"NOTIFY_SOCKET": self.path}):
+            self.assertTrue(sd_notify("READY=1"))
+        self.assertEqual(self.sock.recv(1024), b"READY=1")
+
+    def test_no_socket(self):
+        with unittest.mock.patch.dict(os.environ, {"NOTIFY_SOCKET": ""}):
+            self.assertFalse(sd_notify("READY=1"))
+        with unittest.mock.patch.dict(os.environ, {"NOTIFY_SOCKET": self.path + ".missing"}):
+            self.assertFalse(sd_notify("READY=1"))
+
+
+class ReadyService(Service):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.notified = []
+        self.is_ready = threading.Event()
+
+    def ready(self, info):
+        super().ready(info)
+        self.notified.append(info)
+        self.is_ready.set()
+
+
+class TestServiceReady(ServiceTestMixin, unittest.TestCase):
+    SERVICE_CLASS = ReadyService
+
+    def setUp(self):
+        super().setUp()
+        self.ready_file = os.path.join(self.tmp_dir, "wrun.ready")
+
+    def tearDown(self):
+        for server in (self.service._server, self.service._unix_server):
+            if server:
+                server.stop()
+        self.thread.join()
+        super().tearDown()
+
+    def _start(self, target="serve", **settings):
+        self.service = self._service(READY_FILE=self.ready_file, **settings)
+        self.thread = threading.Thread(target=getattr(self.service, target))
+        self.thread.start()
+        self.assertTrue(self.service.is_ready.wait(5))
+
+    def test_ready(self):
+        self._start()
+        address = self.service._server.server_address
+        self.assertNotEqual(address[1], 0)
+        self.assertEqual(self.service.notified, [{"pid": os.getpid(), "address": address, "unix_socket": None}])
+        self.assertEqual(read_ready_file(self.ready_file)["address"], list(address))
+        ping = Proxy(*address).ping()
+        self.assertEqual(ping["pid"], os.getpid())
+        self.assertLess(ping["uptime"], 5)
+
+    def test_stop_cancels_drain_timeout(self):
+        self._start("run", DRAIN_TIMEOUT=2)
+        with unittest.mock.patch("os._exit") as mock_exit:
+            self.service.stop()
+            self.service._drain_timer.join(1)  # cancelled, not waiting for DRAIN_TIMEOUT
+            self.assertFalse(self.service._drain_timer.is_alive())
+        mock_exit.assert_not_called()
+        self.assertIsNone(read_ready_file(self.ready_file))
+
+    @unittest.skipIf(sys.platform == 'win32', "no AF_UNIX sockets on Windows")
+    def test_ready_with_unix_socket(self):
+        unix_socket = os.path.join(self.tmp_dir, "wrun.sock")
+        self._start(UNIX_SOCKET=unix_socket)
+        self.assertIsNotNone(self.service._unix_server)
+        self.assertEqual(len(self.service.notified), 1)
+        self.assertEqual(Proxy(unix_socket).ping()["pid"], os.getpid())
@@ -0,0 +1,93 @@
+import time
+import unittest
+import unittest.mock
+
+from wrun import Proxy
+from wrun.schedule import Scheduler
+
+from tests.config import *
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.scheduler = Scheduler(self._run, {"fast": {"executable": "fast.exe", "args": ["A"], "interval": 0.1}})
+
+    def _run(self, exe_name, args, input_stdin):
+        self.calls.append(exe_name)
+        return {"stdout": "{} {}".format(exe_name, len(self.calls)), "returncode": 0}
+
+    def test_run_pending(self):
+        self.assertAlmostEqual(self.scheduler.run_pending(), 0.1, delta=0.05)
+        self.assertEqual(self.calls, ["fast.exe"])
+        self.scheduler.run_pending()
+        self.assertEqual(self.calls, ["fast.exe"])
+        time.sleep(0.1)
+        self.scheduler.run_pending()
+        self.assertEqual(self.calls, ["fast.exe", "fast.exe"])
+
+    def test_get(self):
+        self.scheduler.run_pending()
+        result, timestamp = self.scheduler.get("fast")
+        self.assertEqual(result["stdout"], "fast.exe 1")
+        self.assertAlmostEqual(timestamp, time.time(), delta=0.1)
+        self.assertEqual(self.scheduler.get("fast", max_age=10)[0]["stdout"], "fast.exe 1")
+        self.assertEqual(self.calls, ["fast.exe"])
+
+    def test_get_live(self):
+        self.assertEqual(self.scheduler.get("fast")[0]["stdout"], "fast.exe 1")
+        time.sleep(0.05)
+        self.assertEqual(self.scheduler.get("fast", max_age=0.01)[0]["stdout"], "fast.exe 2")
+        self.scheduler.run_pending()  # the live run postponed the next scheduled one
+        self.assertEqual(len(self.calls), 2)
+
+    def test_unknown(self):
+        self.assertIsNone(self.scheduler.get("missing"))
+
+    def test_update(self):
+        self.scheduler.run_pending()
+        self.scheduler.update({"slow": {"executable": "slow.exe", "interval": 10}})
+        self.assertIsNone(self.scheduler.get("fast", max_age=10))
+        self.scheduler.run_pending()
+        self.assertEqual(self.calls, ["fast.exe", "slow.exe"])
+        self.assertRaises(ValueError, self.scheduler.update, {"bad": {"executable": "slow.exe"}})
+
+    def test_failure(self):
+        self.scheduler.update({"fail": {"executable": "fail.exe", "interval": 10}})
+        with unittest.mock.patch.object(self.scheduler, "run", side_effect=OSError("BOOM!!!")):
+            self.assertGreater(self.scheduler.run_pending(), 9)
+        self.assertIsNone(self.scheduler.latest.get("fail"))
+
+    def test_start_stop(self):
+        self.scheduler.start()
+        time.sleep(0.25)
+        self.scheduler.stop()
+        self.assertIn(len(self.calls), [2, 3])
+
+
+class TestProxyLatest(ServiceTestMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self._service(
+            SCHEDULES={"hello": {"executable": EXECUTABLE_NAME, "args": ["P1"], "interval": 60}})
+        self.proxy = Proxy(*self._serve(self.service).target)
+
+    def test_latest(self):
+        self.service.scheduler.run_pending()
+        latest = self.proxy.latest("hello")
+        self.assertEqual(
+            latest["result"], {"stdout": os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), "returncode": 0})
+        self.assertLess(latest["age"], 1)
+        with unittest.mock.patch("wrun.server.run_executable") as mock_run:
+            self.assertEqual(self.proxy.latest("hello", max_age=10)["timestamp"], latest["timestamp"])
+            mock_run.assert_not_called()
+
+    def test_live_run(self):
+        self.service.scheduler.run_pending()
+        time.sleep(0.05)
+        latest = self.proxy.latest("hello", max_age=0.01)
+        self.assertEqual(latest["result"]["returncode"], 0)
+        self.assertLess(latest["age"], 0.05)
+
+    def test_unknown(self):
+        self.assertEqual(self.proxy.latest("missing"), {"error": "unknown schedule"})
@@ -1,8 +1,14 @@
 import json
+import re
+import signal
+import socket
+import stat
+import threading
 import time
 import unittest
 
-from wrun import Config, client
+from wrun import Config, Proxy, client
+from wrun.readiness import read_ready_file, wait_ready_file
 
 from tests.config import *
 
@@ -43,3 +49,236 @@ class TestTwoServers(LogTestMixin, unittest.TestCase):
         self.assertJsonEqual(result_1, stdout=os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), returncode=0)
         result_2 = client(("localhost", 3334), json.dumps([EXECUTABLE_NAME, ["P1"], ""]))
         self.assertJsonEqual(result_2, stdout=os.linesep.join([self.EXECUTABLE_PATH_2, "mandi P1", ""]), returncode=0)
+
+
+class TestWorkers(LogTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.log_path = self._log_path("server_workers")
+        self.settings_file = os.path.join(CWD, "settings_test_workers.py")
+        Config.store(
+            self.settings_file, LOG_PATH=self.log_path,
+            EXECUTABLE_PATH=EXECUTABLE_PATH, HOST="localhost", PORT=3335, WORKERS=2)
+        self.proc = subprocess.Popen([sys.executable, "wrun_server.py", "run", self.settings_file])
+
+    def tearDown(self):
+        self.proc.terminate()
+        self.proc.wait()
+        os.remove(self.settings_file)
+        os_remove(self.log_path)
+
+    def _worker_pids(self):
+        return [int(pid) for pid in re.findall(r"SUPERVISOR: started worker (\d+)", self._get_log(self.log_path))]
+
+    def assertRequestServed(self):
+        result = client(("localhost", 3335), json.dumps([EXECUTABLE_NAME, ["P1"], ""]))
+        self.assertEqual(
+            json.loads(result), {"stdout": os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), "returncode": 0})
+
+    def test_requests(self):
+        time.sleep(0.5)
+        for _ in range(4):
+            self.assertRequestServed()
+        self.assertEqual(len(self._worker_pids()), 2)
+
+    @unittest.skipIf(sys.platform == 'win32', "no clean shutdown on Windows")
+    def test_restart_dead_worker(self):
+        time.sleep(0.5)
+        dead_pid = self._worker_pids()[0]
+        os.kill(dead_pid, signal.SIGKILL)
+        time.sleep(1.5)
+        pids = self._worker_pids()
+        self.assertEqual(len(pids), 3)
+        self.assertNotEqual(pids[-1], dead_pid)
+        self.assertLogContains("server_workers", "SUPERVISOR: worker {} exited with code -9".format(dead_pid))
+        for _ in range(4):
+            self.assertRequestServed()
+
+
+class ServerProcessTestBase(LogTestMixin, unittest.TestCase):
+    PORT = 3336
+    SETTINGS = {}
+
+    def setUp(self):
+        self.log_name = "server_" + type(self).__name__
+        self.log_path = self._log_path(self.log_name)
+        self.settings_file = os.path.join(CWD, "settings_test_{}.py".format(type(self).__name__))
+        self.ready_file = os.path.join(CWD, "test_{}.ready".format(type(self).__name__))
+        os_remove(self.ready_file)
+        Config.store(
+            self.settings_file, LOG_PATH=self.log_path, READY_FILE=self.ready_file,
+            EXECUTABLE_PATH=EXECUTABLE_PATH, HOST="localhost", PORT=self.PORT, **self.SETTINGS)
+        self.proc = subprocess.Popen([sys.executable, "wrun_server.py", "run", self.settings_file])
+        self.ready = wait_ready_file(self.ready_file)
+        self.address = tuple(self.ready["address"])
+
+    def tearDown(self):
+        for pid in self._replacement_pids():
+            os_kill(pid)
+        self.proc.terminate()
+        self.proc.wait()
+        os.remove(self.settings_file)
+        os_remove(self.log_path)
+        os_remove(self.ready_file)
+
+    def _replacement_pids(self):
+        return [int(pid) for pid in re.findall(r"HANDOFF: started replacement (\d+)", self._get_log(self.log_path))]
+
+    def _request(self, *args):
+        return json.loads(client(self.address, json.dumps([EXECUTABLE_NAME, list(args), ""])))
+
+    def _threaded_request(self, *args):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self._request(*args)))
+        thread.start()
+        return thread, results
+
+
+def os_kill(pid, timeout=5):
+    try:
+        os.kill(pid, signal.SIGTERM)
+        for _ in range(int(timeout / 0.1)):
+            time.sleep(0.1)
+            os.kill(pid, 0)
+    except ProcessLookupError:
+        pass
+
+
+@unittest.skipIf(sys.platform == 'win32', "no signals on Windows")
+class TestDrain(ServerProcessTestBase):
+    def test_request_in_progress_completes(self):
+        thread, results = self._threaded_request("SLEEP", "1")
+        time.sleep(0.3)
+        self.proc.send_signal(signal.SIGTERM)
+        self.assertEqual(self.proc.wait(5), 0)
+        thread.join()
+        self.assertEqual(results, [{"stdout": os.linesep.join([EXECUTABLE_PATH, "slept 1", ""]), "returncode": 0}])
+        self.assertRaises(ConnectionRefusedError, self._request, "P1")
+        self.assertLogContains(self.log_name, "SERVICE: draining...")
+
+
+@unittest.skipIf(sys.platform == 'win32', "no signals on Windows")
+class TestDrainTimeout(ServerProcessTestBase):
+    SETTINGS = {"DRAIN_TIMEOUT": 0.5}
+
+    def test_request_in_progress_aborted(self):
+        results = []
+
+        def request():
+            try:
+                results.append(self._request("SLEEP", "2"))
+            except (ValueError, OSError) as exc:  # empty response or connection reset
+                results.append(exc)
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        time.sleep(0.3)
+        self.proc.send_signal(signal.SIGTERM)
+        self.assertEqual(self.proc.wait(5), 1)
+        thread.join()
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0], (ValueError, OSError))
+        self.assertLogContains(self.log_name, "SERVICE: drain timeout expired")
+
+
+@unittest.skipIf(sys.platform == 'win32', "no listening socket handoff on Windows")
+class TestRestart(ServerProcessTestBase):
+    def assertRestartWithoutErrors(self):
+        thread, results = self._threaded_request("SLEEP", "1")
+        time.sleep(0.3)
+        self.proc.send_signal(signal.SIGHUP)
+        for idx in range(20):
+            self.assertEqual(self._request("P{}".format(idx))["stdout"].split(os.linesep)[1], "hello P{}".format(idx))
+            time.sleep(0.05)
+        thread.join()
+        self.assertEqual(results[0]["returncode"], 0)
+        self.assertEqual(self.proc.wait(5), 0)
+        self.assertEqual(len(self._replacement_pids()), 1)
+        self.assertLogContains(self.log_name, "HANDOFF: inherited listening socket")
+
+    def test_restart(self):
+        self.assertRestartWithoutErrors()
+
+
+@unittest.skipIf(sys.platform == 'win32', "no listening socket handoff on Windows")
+class TestRestartWorkers(TestRestart):
+    SETTINGS = {"WORKERS": 2}
+
+
+@unittest.skipIf(sys.platform == 'win32', "no AF_UNIX sockets on Windows")
+class TestUnixSocket(TestRestart):
+    UNIX_SOCKET = os.path.join(CWD, "test_wrun.sock")
+    SETTINGS = {"UNIX_SOCKET": UNIX_SOCKET}
+
+    def tearDown(self):
+        super().tearDown()
+        os_remove(self.UNIX_SOCKET)
+
+    def _unix_request(self, *args):
+        return Proxy(self.UNIX_SOCKET).run(EXECUTABLE_NAME, list(args))
+
+    def test_both_transports(self):
+        expected = {"stdout": os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), "returncode": 0}
+        self.assertEqual(self._request("P1"), expected)
+        self.assertEqual(self._unix_request("P1"), expected)
+        self.assertEqual(stat.S_IMODE(os.stat(self.UNIX_SOCKET).st_mode), 0o660)
+
+    def test_drain(self):
+        self.proc.send_signal(signal.SIGTERM)
+        self.assertEqual(self.proc.wait(5), 0)
+        self.assertRaises(ConnectionRefusedError, self._unix_request, "P1")
+
+    def test_restart_unix_socket(self):
+        self.proc.send_signal(signal.SIGHUP)
+        for idx in range(20):
+            self.assertEqual(self._unix_request("P{}".format(idx))["returncode"], 0)
+            time.sleep(0.05)
+        self.assertEqual(self.proc.wait(5), 0)
+        self.assertLogContains(self.log_name, "HANDOFF: inherited listening socket")
+
+
+@unittest.skipIf(sys.platform == 'win32', "no AF_UNIX sockets on Windows")
+class TestUnixSocketWorkers(TestUnixSocket):
+    SETTINGS = {"UNIX_SOCKET": TestUnixSocket.UNIX_SOCKET, "WORKERS": 2}
+
+
+class TestReadiness(ServerProcessTestBase):
+    PORT = 0
+
+    def test_ephemeral_port(self):
+        self.assertEqual(self.ready["pid"], self.proc.pid)
+        self.assertNotEqual(self.address[1], 0)
+        self.assertIn("uptime", Proxy(*self.address).ping())
+        self.assertEqual(self._request("P1")["returncode"], 0)
+
+    @unittest.skipIf(sys.platform == 'win32', "no signals on Windows")
+    def test_ready_file_removed(self):
+        self.proc.send_signal(signal.SIGTERM)
+        self.assertEqual(self.proc.wait(5), 0)
+        self.assertIsNone(read_ready_file(self.ready_file))
+
+
+@unittest.skipIf(sys.platform == 'win32', "no listening socket handoff on Windows")
+class TestReadinessRestart(ServerProcessTestBase):
+    PORT = 0
+
+    def test_restart_keeps_port(self):
+        self.proc.send_signal(signal.SIGHUP)
+        self.assertEqual(self.proc.wait(5), 0)
+        ready = wait_ready_file(self.ready_file)
+        self.assertEqual(ready["pid"], self._replacement_pids()[0])
+        self.assertEqual(tuple(ready["address"]), self.address)
+        self.assertEqual(self._request("P1")["returncode"], 0)
+
+
+class TestReadinessWorkers(TestReadiness):
+    SETTINGS = {"WORKERS": 2}
+
+
+@unittest.skipIf(not hasattr(socket, "SO_REUSEPORT"), "no SO_REUSEPORT")
+class TestReadinessReusePort(ServerProcessTestBase):
+    PORT = 3337
+    SETTINGS = {"WORKERS": 2, "REUSE_PORT": True}
+
+    def test_ready_when_listening(self):
+        self.assertEqual(self._request("P1")["returncode"], 0)  # right after the ready file
+
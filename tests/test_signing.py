@@ -0,0 +1,98 @@
+import time
+import unittest
+import unittest.mock
+
+from wrun import Proxy, client, executor
+from wrun.signing import ReplayCache, SignatureError, Signer
+
+from tests.config import *
+
+KEY = "shared-secret"
+
+
+class TestSigner(unittest.TestCase):
+    def setUp(self):
+        self.signer = Signer(KEY)
+        self.server_signer = Signer(KEY, replay_cache_size=100)
+
+    def test_verify(self):
+        nonce, envelope = self.signer.sign(b"payload\nwith newline")
+        self.assertEqual(self.server_signer.verify(envelope), (nonce, b"payload\nwith newline"))
+
+    def test_str_and_bytes_key(self):
+        self.assertEqual(Signer(KEY.encode()).verify(self.signer.sign(b"payload")[1])[1], b"payload")
+
+    def test_wrong_key(self):
+        envelope = Signer("other-secret").sign(b"payload")[1]
+        self.assertRaises(SignatureError, self.server_signer.verify, envelope)
+
+    def test_tampered_payload(self):
+        envelope = self.signer.sign(b"payload")[1]
+        self.assertRaises(SignatureError, self.server_signer.verify, envelope[:-1] + b"X")
+
+    def test_malformed(self):
+        self.assertRaises(SignatureError, self.server_signer.verify, b"")
+        self.assertRaises(SignatureError, self.server_signer.verify, b"payload")
+
+    def test_replay(self):
+        envelope = self.signer.sign(b"payload")[1]
+        self.server_signer.verify(envelope)
+        self.assertRaises(SignatureError, self.server_signer.verify, envelope)
+
+    def test_replay_with_full_cache(self):
+        server_signer = Signer(KEY, replay_cache_size=3)
+        envelopes = [self.signer.sign(b"payload")[1] for _ in range(4)]
+        for envelope in envelopes[:3]:
+            server_signer.verify(envelope)
+        self.assertRaises(SignatureError, server_signer.verify, envelopes[3])  # no live nonce is evicted
+        self.assertRaises(SignatureError, server_signer.verify, envelopes[0])
+
+    def test_expired(self):
+        with unittest.mock.patch("time.time", return_value=time.time() - 60):
+            envelope = self.signer.sign(b"payload")[1]
+        self.assertRaises(SignatureError, self.server_signer.verify, envelope)
+
+    def test_reply_to(self):
+        nonce, request = self.signer.sign(b"request")
+        response = self.server_signer.sign(b"response", reply_to=nonce)[1]
+        self.assertEqual(self.signer.verify(response, reply_to=nonce)[1], b"response")
+        other_nonce = self.signer.sign(b"request")[0]
+        self.assertRaises(SignatureError, self.signer.verify, response, reply_to=other_nonce)
+        self.assertRaises(SignatureError, self.signer.verify, response)
+
+
+class TestReplayCache(unittest.TestCase):
+    def test_window(self):
+        cache = ReplayCache(window=10)
+        cache.check(b"N1", now=100)
+        self.assertRaises(SignatureError, cache.check, b"N1", now=105)
+        cache.check(b"N1", now=111)
+
+    def test_size(self):
+        cache = ReplayCache(window=10, size=2)
+        for nonce in [b"N1", b"N2"]:
+            cache.check(nonce, now=100)
+        self.assertRaises(SignatureError, cache.check, b"N3", now=105)  # full of live nonces
+        self.assertRaises(SignatureError, cache.check, b"N1", now=105)  # not evicted: still a replay
+        cache.check(b"N3", now=111)
+        self.assertEqual(list(cache._nonces), [b"N3"])
+
+
+class TestSignedClientServer(unittest.TestCase):
+    def setUp(self):
+        self.daemon = ThreadDaemon(lambda command: executor(EXECUTABLE_PATH, command), hmac_key=KEY)
+
+    def tearDown(self):
+        self.daemon.stop()
+
+    def test_proxy(self):
+        result = Proxy(*self.daemon.target, hmac_key=KEY).run(EXECUTABLE_NAME, ["P1"])
+        self.assertEqual(result, {"stdout": os.linesep.join([EXECUTABLE_PATH, "hello P1", ""]), "returncode": 0})
+
+    def test_wrong_key(self):
+        self.assertRaises(
+            SignatureError, client, self.daemon.target, '["{}", ["P1"], ""]'.format(EXECUTABLE_NAME),
+            hmac_key="other-secret")
+
+    def test_unsigned_request(self):
+        self.assertEqual(client(self.daemon.target, '["{}", ["P1"], ""]'.format(EXECUTABLE_NAME)), "")
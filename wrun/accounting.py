@@ -0,0 +1,56 @@
+import collections
+import os
+import subprocess
+import sys
+import threading
+
+USAGE_FIELDS = ("wall_time", "user_time", "system_time")
+
+
+class AccountedPopen(subprocess.Popen):
+    """ Popen collecting the resource usage of the process when it is reaped (os.wait4) """
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, sts, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return super()._try_wait(wait_flags)
+        if pid == self.pid:
+            self.rusage = rusage
+        return pid, sts
+
+
+Popen = AccountedPopen if hasattr(os, "wait4") else subprocess.Popen
+
+
+def usage(process, wall_time):
+    """ wall, user and system time in seconds, max_rss (peak resident memory) in KiB """
+    result = {"wall_time": wall_time}
+    rusage = getattr(process, "rusage", None)
+    if rusage is not None:
+        max_rss = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+        result.update(user_time=rusage.ru_utime, system_time=rusage.ru_stime, max_rss=max_rss)
+    return result
+
+
+class UsageStats:
+    """ Resource usage aggregated by executable """
+
+    def __init__(self):
+        self._stats = collections.defaultdict(lambda: dict.fromkeys(USAGE_FIELDS + ("count", "max_rss"), 0))
+        self._lock = threading.Lock()
+
+    def add(self, exe_name, usage):
+        with self._lock:
+            stats = self._stats[exe_name]
+            stats["count"] += 1
+            for field in USAGE_FIELDS:
+                stats[field] += usage.get(field, 0)
+            stats["max_rss"] = max(stats["max_rss"], usage.get("max_rss", 0))
+
+    def describe(self):
+        """ Totals by executable, the most CPU expensive first """
+        with self._lock:
+            stats = [dict(stats, name=name) for name, stats in self._stats.items()]
+        return sorted(stats, key=lambda s: s["user_time"] + s["system_time"], reverse=True)
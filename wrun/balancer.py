@@ -0,0 +1,169 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+from . import Proxy
+
+LEAST_OUTSTANDING = "least_outstanding"
+EWMA = "ewma"
+
+log = logging.getLogger(__name__)
+
+
+class NoReplicaError(ConnectionError):
+    pass
+
+
+class Replica:
+    def __init__(self, target, proxy):
+        self.target = target
+        self.proxy = proxy
+        self.outstanding = 0
+        self.latency = 0.0  # exponentially weighted moving average, seconds
+        self.failures = 0  # consecutive
+        self.ejected_until = None
+        self.probing = False
+
+    def __repr__(self):
+        return "Replica({}, outstanding={}, latency={:.3f})".format(self.target, self.outstanding, self.latency)
+
+
+class BalancedProxy:
+    """ Routes each request to one of many equivalent daemons
+
+    failing replicas are ejected (circuit breaker) and readmitted after a successful background probe;
+    requests refused by a replica are retried on another one;
+    hedged requests are sent to a second replica when the first one is late
+    """
+    EWMA_WEIGHT = 0.3
+    LATENCY_WINDOW = 100  # latest latencies used for the hedging percentile
+    HEDGE_MIN_SAMPLES = 10
+    HEDGE_BURST = 10  # max hedge tokens saved up while the daemons are fast
+
+    def __init__(
+            self, replicas, strategy=LEAST_OUTSTANDING, retries=2, failure_threshold=3, ejection_time=10,
+            hedge_delay=None, hedge_percentile=None, hedge_budget=0.05, **kwargs):
+        self.replicas = [Replica(target, Proxy(*target, **kwargs)) for target in replicas]
+        self.key = {
+            LEAST_OUTSTANDING: lambda r: (r.outstanding, r.latency),
+            EWMA: lambda r: (r.latency, r.outstanding),
+        }[strategy]
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self._hedge_tokens = 0.0
+        self._latencies = collections.deque(maxlen=self.LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def _probe(self, replica):
+        try:
+            replica.proxy.catalog()
+        except Exception:
+            log.info("BALANCER: probe of %s failed", replica.target)
+            with self._lock:
+                replica.ejected_until = time.monotonic() + self.ejection_time
+                replica.probing = False
+            return
+        log.info("BALANCER: %s readmitted", replica.target)
+        with self._lock:
+            replica.ejected_until = None
+            replica.failures = 0
+            replica.probing = False
+
+    def _expired_ejections(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [r for r in self.replicas if r.ejected_until and r.ejected_until <= now and not r.probing]
+            for replica in expired:
+                replica.probing = True
+        return expired
+
+    def _acquire(self, excluded):
+        for replica in self._expired_ejections():
+            # in the background: a replica that does not answer must not hold up the request being routed
+            threading.Thread(target=self._probe, args=(replica,), daemon=True).start()
+        with self._lock:
+            candidates = [r for r in self.replicas if not r.ejected_until and r not in excluded]
+            if not candidates:
+                raise NoReplicaError("no replica available")
+            replica = min(candidates, key=self.key)
+            replica.outstanding += 1
+        return replica
+
+    def _release(self, replica, elapsed=None):
+        with self._lock:
+            replica.outstanding -= 1
+            if elapsed is None:
+                replica.failures += 1
+                if replica.failures >= self.failure_threshold and not replica.ejected_until:
+                    log.warning("BALANCER: %s ejected after %s failures", replica.target, replica.failures)
+                    replica.ejected_until = time.monotonic() + self.ejection_time
+            else:
+                replica.failures = 0
+                replica.latency += self.EWMA_WEIGHT * (elapsed - replica.latency)
+                self._latencies.append(elapsed)
+
+    def _run(self, tried, executable_name, args, input_stdin, **options):
+        while True:
+            replica = self._acquire(tried)
+            tried.append(replica)
+            start = time.monotonic()
+            try:
+                result = replica.proxy.run(executable_name, args, input_stdin, **options)
+            except ConnectionRefusedError:
+                # nothing was sent: the request can be safely retried on another replica
+                self._release(replica)
+                if len(tried) > self.retries or len(tried) == len(self.replicas):
+                    raise
+                log.info("BALANCER: %s refused the connection, retrying", replica.target)
+                continue
+            except Exception:
+                self._release(replica)
+                raise
+            self._release(replica, time.monotonic() - start)
+            return result
+
+    def _hedge_after(self):
+        """ Seconds to wait for the first reply before hedging, None if hedging is not possible """
+        with self._lock:
+            if self.hedge_percentile is not None and len(self._latencies) >= self.HEDGE_MIN_SAMPLES:
+                latencies = sorted(self._latencies)
+                return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))]
+            return self.hedge_delay
+
+    def _take_hedge_token(self):
+        with self._lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            return True
+
+    def _hedged_run(self, delay, *args, **kwargs):
+        with self._lock:
+            self._hedge_tokens = min(self.HEDGE_BURST, self._hedge_tokens + self.hedge_budget)
+        tried = []
+        pool = concurrent.futures.ThreadPoolExecutor(2)
+        try:
+            futures = [pool.submit(self._run, tried, *args, **kwargs)]
+            done, _ = concurrent.futures.wait(futures, timeout=delay)
+            if not done and self._take_hedge_token():
+                log.info("BALANCER: no reply after %.3f seconds, hedging", delay)
+                futures.append(pool.submit(self._run, tried, *args, **kwargs))
+            for future in concurrent.futures.as_completed(futures):
+                if future.exception() is None:
+                    return future.result()
+            return futures[0].result()
+        finally:
+            pool.shutdown(wait=False)  # the late request is abandoned, its reply is discarded
+
+    def run(self, executable_name, args, input_stdin="", hedge=False, **options):
+        """ hedge: the request is idempotent, it can be sent to a second replica when the first one is late """
+        delay = self._hedge_after() if hedge else None
+        if delay is None:
+            return self._run([], executable_name, args, input_stdin, **options)
+        return self._hedged_run(delay, executable_name, args, input_stdin, **options)
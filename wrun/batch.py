@@ -0,0 +1,171 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+from . import Proxy
+
+HMAC_KEY_ENV = "WRUN_HMAC_KEY"
+
+log = logging.getLogger(__name__)
+
+
+def read_jobs(lines, host=None, port=None):
+    """ Yields (number, job) from JSON lines, blank and "#" lines are skipped
+
+    job: {"host": ..., "port": ..., "executable": ..., "args": [...], "input_stdin": "", "options": {...}},
+    host and port default to the given ones; without port, host is the path of an AF_UNIX socket
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            job = json.loads(line)
+            job.setdefault("host", host)
+            job.setdefault("port", port)
+            if not job["host"] or not job.get("executable"):
+                raise ValueError("host and executable are mandatory")
+        except (ValueError, AttributeError) as exc:
+            job = {"invalid": str(exc)}
+        yield number, job
+
+
+class Stats:
+    """ Progress and throughput, written to stream at most every "interval" seconds """
+
+    def __init__(self, stream=sys.stderr, interval=1):
+        self.stream = stream
+        self.interval = interval
+        self.start = time.monotonic()
+        self.done = 0
+        self.failed = 0
+        self.elapsed = []
+        self._printed = self.start
+
+    def add(self, record):
+        self.done += 1
+        self.failed += not record["ok"]
+        if "elapsed" in record:
+            self.elapsed.append(record["elapsed"])
+        now = time.monotonic()
+        if now - self._printed >= self.interval:
+            self._printed = now
+            self.stream.write("{} done, {} failed, {:.1f} jobs/s\n".format(
+                self.done, self.failed, self.done / (now - self.start)))
+            self.stream.flush()
+
+    def summary(self):
+        duration = time.monotonic() - self.start
+        elapsed = sorted(self.elapsed) or [0]
+        self.stream.write(
+            "{} done, {} failed in {:.3f}s, {:.1f} jobs/s, latency p50 {:.3f}s p95 {:.3f}s max {:.3f}s\n".format(
+                self.done, self.failed, duration, self.done / duration if duration else 0,
+                elapsed[len(elapsed) // 2], elapsed[int(len(elapsed) * 0.95)], elapsed[-1]))
+        self.stream.flush()
+
+
+class Batch:
+    """ Runs jobs concurrently, one Proxy for each target is reused by its jobs """
+
+    def __init__(self, parallelism=16, timeout=None, **kwargs):
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        self.parallelism = parallelism
+        self.kwargs = kwargs
+        self._proxies = {}
+        self._lock = threading.Lock()
+
+    def _proxy(self, host, port):
+        with self._lock:
+            if (host, port) not in self._proxies:
+                self._proxies[host, port] = Proxy(host, port, **self.kwargs)
+            return self._proxies[host, port]
+
+    def _run(self, number, job):
+        record = {"job": number, "host": job["host"], "port": job["port"], "executable": job["executable"]}
+        start = time.monotonic()
+        try:
+            result = self._proxy(job["host"], job["port"]).run(
+                job["executable"], job.get("args", []), job.get("input_stdin", ""), **job.get("options", {}))
+            record.update(result=result, ok="error" not in result and result.get("returncode") == 0)
+        except Exception as exc:
+            log.warning("BATCH: job %s failed: %r", number, exc)
+            record.update(error=repr(exc), ok=False)
+        record["elapsed"] = time.monotonic() - start
+        return record
+
+    def run(self, jobs):
+        """ Yields the result records as the jobs complete
+
+        jobs are read by another thread while the previous ones run, at most 2 * parallelism of them are pending
+        """
+        records = queue.Queue()
+        slots = threading.BoundedSemaphore(2 * self.parallelism)
+        stopped = threading.Event()
+
+        def completed(future):
+            records.put(future.result())
+            slots.release()
+
+        def submit():
+            try:
+                with concurrent.futures.ThreadPoolExecutor(self.parallelism) as pool:
+                    for number, job in jobs:
+                        if "invalid" in job:
+                            records.put({"job": number, "error": "invalid job: " + job["invalid"], "ok": False})
+                            continue
+                        slots.acquire()
+                        if stopped.is_set():
+                            break
+                        pool.submit(self._run, number, job).add_done_callback(completed)
+            except Exception as exc:
+                records.put(exc)
+            records.put(None)
+
+        reader = threading.Thread(target=submit, daemon=True)
+        reader.start()
+        try:
+            while True:
+                record = records.get()
+                if record is None:
+                    break
+                if isinstance(record, Exception):
+                    raise record
+                yield record
+        finally:
+            stopped.set()
+
+
+def main(argv=None, stdout=sys.stdout, stderr=sys.stderr):
+    parser = argparse.ArgumentParser(
+        prog="wrun_client", description="Runs the jobs (JSON lines) on wrun daemons, results are JSON lines")
+    parser.add_argument("jobs", nargs="?", default="-", help="jobs file (default: stdin)")
+    parser.add_argument("--host", help="default host of the jobs")
+    parser.add_argument("--port", type=int, help="default port of the jobs")
+    parser.add_argument("-j", "--parallelism", type=int, default=16, help="jobs in progress (default: 16)")
+    parser.add_argument("--timeout", type=float, help="seconds, for connection and each socket operation")
+    parser.add_argument("--cafile", help="certificate of the SECURE daemons")
+    parser.add_argument("--quiet", action="store_true", help="no progress and stats")
+    args = parser.parse_args(argv)
+    kwargs = {}
+    if args.cafile:
+        kwargs["cafile"] = args.cafile
+    if os.environ.get(HMAC_KEY_ENV):
+        kwargs["hmac_key"] = os.environ[HMAC_KEY_ENV]
+    with contextlib.ExitStack() as stack:
+        stats = Stats(stack.enter_context(open(os.devnull, "w")) if args.quiet else stderr)
+        batch = Batch(args.parallelism, args.timeout, **kwargs)
+        lines = sys.stdin if args.jobs == "-" else stack.enter_context(open(args.jobs))
+        for record in batch.run(read_jobs(lines, args.host, args.port)):
+            stats.add(record)
+            stdout.write(json.dumps(record) + "\n")
+            stdout.flush()
+        stats.summary()
+    return 1 if stats.failed else 0
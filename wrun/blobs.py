@@ -0,0 +1,47 @@
+import collections
+import hashlib
+import threading
+
+ENCODING = "utf-8"  # of the wrun requests
+
+
+def blob_hash(data):
+    return hashlib.sha256(data.encode(ENCODING)).hexdigest()
+
+
+class BlobStore:
+    """ Content addressed blobs, the least recently used are evicted beyond max_bytes """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._blobs = collections.OrderedDict()  # hash: (data, size), least recently used first
+        self._lock = threading.Lock()
+
+    def put(self, data):
+        """ Hash of data, None if data is larger than the whole store """
+        encoded = data.encode(ENCODING)
+        if len(encoded) > self.max_bytes:
+            return None
+        key = hashlib.sha256(encoded).hexdigest()
+        with self._lock:
+            if key in self._blobs:
+                self._blobs.move_to_end(key)
+                return key
+            self._blobs[key] = data, len(encoded)
+            self.size += len(encoded)
+            while self.size > self.max_bytes:
+                _, (_, size) = self._blobs.popitem(last=False)
+                self.size -= size
+        return key
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._blobs:
+                return None
+            self._blobs.move_to_end(key)
+            return self._blobs[key][0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._blobs
@@ -0,0 +1,83 @@
+import collections
+import contextlib
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+Entry = collections.namedtuple("Entry", "name path policy")
+
+
+class Catalog:
+    """ Index of the executables available in a directory, with their policies """
+
+    def __init__(self, path, policies=None):
+        self.path = path
+        self.policies = policies or {}
+        for name, policy in self.policies.items():
+            limit = policy.get("max_concurrency")
+            if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 1):
+                raise ValueError("invalid max_concurrency {!r} of '{}'".format(limit, name))
+        self.entries = {}
+        self._mtime = None
+        self.refresh()
+
+    def _scan(self):
+        with os.scandir(self.path) as it:
+            for item in it:
+                if item.is_file() and os.access(item.path, os.X_OK):
+                    yield Entry(item.name, item.path, self.policies.get(item.name, {}))
+
+    def refresh(self):
+        """ The directory is scanned again only if its content changed """
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        self.entries = {entry.name: entry for entry in self._scan()}
+        log.info("CATALOG: indexed %s executables in '%s'", len(self.entries), self.path)
+        for name in set(self.policies) - set(self.entries):
+            log.warning("CATALOG: policy for missing executable '%s'", name)
+
+    def get(self, name):
+        self.refresh()
+        return self.entries.get(name)
+
+    def describe(self):
+        self.refresh()
+        return [dict(entry.policy, name=entry.name) for entry in sorted(self.entries.values())]
+
+
+class ConcurrencyLimits:
+    """ The max_concurrency policies: executions beyond it wait for a slot, in each daemon process """
+
+    def __init__(self):
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, entry):
+        limit = entry.policy.get("max_concurrency")
+        if limit is None:
+            return None
+        with self._lock:
+            # a changed limit applies to the following executions, the running ones release the previous semaphore
+            key = entry.name, limit
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.BoundedSemaphore(limit)
+            return self._semaphores[key]
+
+    @contextlib.contextmanager
+    def slots(self, entries):
+        """ A slot of each executable, taken in name order: pipelines waiting for each other cannot deadlock """
+        distinct = {entry.name: entry for entry in entries}
+        semaphores = [self._semaphore(distinct[name]) for name in sorted(distinct)]
+        acquired = []
+        try:
+            for semaphore in filter(None, semaphores):
+                semaphore.acquire()
+                acquired.append(semaphore)
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
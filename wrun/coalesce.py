@@ -0,0 +1,44 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+def request_key(exe_name, args, input_stdin, idempotency_key=None, output_filter=None, limits=None):
+    """ the output filter and the resource limits are applied by the execution:
+    requests with different ones never share it
+    """
+    if idempotency_key is not None:
+        return "key", exe_name, idempotency_key, json.dumps([output_filter, limits], sort_keys=True)
+    digest = hashlib.sha256(
+        json.dumps([exe_name, args, input_stdin, output_filter, limits], sort_keys=True).encode()).hexdigest()
+    return "request", digest
+
+
+class SingleFlight:
+    """ Concurrent calls with the same key share a single execution and its result """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = concurrent.futures.Future()
+        if not leader:
+            log.debug("SINGLEFLIGHT: waiting for in-flight %s", key)
+            return call.result()
+        try:
+            call.set_result(func(*args, **kwargs))
+        except BaseException as exc:
+            call.set_exception(exc)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return call.result()
@@ -0,0 +1,67 @@
+import collections
+import concurrent.futures
+import logging
+import time
+
+from . import Proxy
+
+log = logging.getLogger(__name__)
+
+
+class Reply(collections.namedtuple("Reply", "target result error elapsed")):
+    """ Outcome of a request to a single target: result (dict) or error (exception) """
+
+    @property
+    def ok(self):
+        return self.error is None and "error" not in self.result and self.result.get("returncode") == 0
+
+
+class Summary:
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+
+    def add(self, reply):
+        self.replies.append(reply)
+
+    @property
+    def successes(self):
+        return [reply for reply in self.replies if reply.ok]
+
+    @property
+    def failures(self):
+        return [reply for reply in self.replies if not reply.ok]
+
+    def slowest(self, count=5):
+        return sorted(self.replies, key=lambda reply: reply.elapsed, reverse=True)[:count]
+
+
+class ProxyGroup:
+    """ Runs the same command on many (host, port) targets concurrently """
+
+    def __init__(self, targets, parallelism=16, timeout=None, **kwargs):
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        self.targets = list(targets)
+        self.parallelism = parallelism
+        self.proxies = {target: Proxy(*target, **kwargs) for target in self.targets}
+
+    def _run(self, target, *args, **kwargs):
+        start = time.monotonic()
+        try:
+            result, error = self.proxies[target].run(*args, **kwargs), None
+        except Exception as exc:
+            log.warning("FANOUT: %s failed: %r", target, exc)
+            result, error = None, exc
+        return Reply(target, result, error, time.monotonic() - start)
+
+    def run(self, executable_name, args, input_stdin="", **options):
+        """ Yields the replies as they arrive, at most "parallelism" requests are in progress """
+        with concurrent.futures.ThreadPoolExecutor(self.parallelism) as pool:
+            futures = [
+                pool.submit(self._run, target, executable_name, args, input_stdin, **options)
+                for target in self.targets]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+
+    def run_all(self, executable_name, args, input_stdin="", **options):
+        return Summary(self.run(executable_name, args, input_stdin, **options))
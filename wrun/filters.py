@@ -0,0 +1,206 @@
+import collections
+import json
+import re
+import threading
+
+ENCODING = "utf-8"  # of the wrun requests
+READ_SIZE = 65536
+
+
+class FilterError(Exception):
+    pass
+
+
+class LineFilter:
+    """ Filters complete lines, the last one can miss the line end """
+
+    def __init__(self):
+        self._partial = bytes()
+
+    def feed(self, data):
+        lines = (self._partial + data).splitlines(keepends=True)
+        self._partial = lines.pop() if lines and not lines[-1].endswith(b"\n") else bytes()
+        return b"".join(self.lines(lines))
+
+    def end(self):
+        partial, self._partial = self._partial, bytes()
+        return b"".join(self.lines([partial] if partial else [])) + self.flush()
+
+    def flush(self):
+        return bytes()
+
+
+class Regex(LineFilter):
+    def __init__(self, pattern):
+        super().__init__()
+        self.pattern = re.compile(pattern.encode(ENCODING))
+
+    def lines(self, lines):
+        return [line for line in lines if self.pattern.search(line)]
+
+
+class Head(LineFilter):
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+    def lines(self, lines):
+        lines = lines[:self.count]
+        self.count -= len(lines)
+        return lines
+
+
+class Tail(LineFilter):
+    def __init__(self, count):
+        super().__init__()
+        self._lines = collections.deque(maxlen=count)
+
+    def lines(self, lines):
+        self._lines.extend(lines)
+        return []
+
+    def flush(self):
+        return b"".join(self._lines)
+
+
+class ByteRange:
+    def __init__(self, start, stop=None):
+        self.start = start
+        self.stop = stop
+        self._position = 0
+
+    def feed(self, data):
+        position, self._position = self._position, self._position + len(data)
+        stop = len(data) if self.stop is None else self.stop - position
+        return data[max(0, self.start - position):max(0, stop)]
+
+    def end(self):
+        return bytes()
+
+
+class JsonField:
+    """ The value at path (dot separated keys and list indexes) of the JSON output, the only one buffered """
+
+    def __init__(self, path):
+        self.path = path.split(".") if path else []
+        self._data = []
+
+    def feed(self, data):
+        self._data.append(data)
+        return bytes()
+
+    def end(self):
+        try:
+            value = json.loads(b"".join(self._data).decode(ENCODING))
+            for key in self.path:
+                value = value[int(key)] if isinstance(value, list) else value[key]
+        except (ValueError, KeyError, IndexError, TypeError) as exc:
+            raise FilterError("json {}: {!r}".format(".".join(self.path), exc))
+        return json.dumps(value).encode(ENCODING)
+
+
+FILTERS = {"regex": Regex, "head": Head, "tail": Tail, "bytes": ByteRange, "json": JsonField}
+
+
+class Chain:
+    def __init__(self, filters):
+        self.filters = filters
+
+    def feed(self, data):
+        for output_filter in self.filters:
+            data = output_filter.feed(data)
+        return data
+
+    def end(self):
+        data = bytes()
+        for output_filter in self.filters:
+            data = output_filter.feed(data) + output_filter.end()
+        return data
+
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _valid_args(name, args):
+    if name in ("regex", "json"):
+        return isinstance(args, str)
+    if name in ("head", "tail"):
+        return _is_count(args)
+    return (isinstance(args, (list, tuple)) and len(args) in (1, 2) and _is_count(args[0])
+            and (len(args) == 1 or args[1] is None or _is_count(args[1])))
+
+
+def build(spec):
+    """ Filter from its declaration: a dict, or a list of them applied in order
+
+    {"regex": <pattern>}, {"head": <lines>}, {"tail": <lines>}, {"bytes": [<start>, <stop>]}, {"json": <path>}
+    ValueError for other declarations, before anything is run
+    """
+    specs = [spec] if isinstance(spec, dict) else spec
+    filters = []
+    for item in specs:
+        if not isinstance(item, dict) or len(item) != 1 or next(iter(item)) not in FILTERS:
+            raise ValueError("invalid output filter {!r}".format(item))
+        (name, args), = item.items()
+        if not _valid_args(name, args):
+            raise ValueError("invalid arguments of output filter {!r}".format(item))
+        if name == "bytes":
+            filters.append(ByteRange(*args))
+        else:
+            filters.append(FILTERS[name](args))
+    return Chain(filters)
+
+
+def read(stream, output_filter):
+    """ The filtered content of stream, read chunk by chunk """
+    output = [output_filter.feed(data) for data in iter(lambda: stream.read1(READ_SIZE), b"")]
+    output.append(output_filter.end())
+    return b"".join(output)
+
+
+def communicate(processes, input_data, output_filter, timeout=None):
+    """ Like Popen.communicate for a pipeline of processes, stdout of the last one is filtered while it is read
+
+    input_data is written to the first process: (output, errors of each process, timed_out)
+    """
+    killed = threading.Event()
+
+    def kill():
+        killed.set()
+        for process in processes:
+            process.kill()
+
+    def write(stdin):
+        try:
+            stdin.write(input_data)
+        except BrokenPipeError:
+            pass
+        finally:
+            stdin.close()
+
+    def read_error(idx, stderr):
+        errors[idx] = stderr.read()
+        stderr.close()
+
+    errors = [bytes()] * len(processes)
+    threads = [
+        threading.Thread(target=read_error, args=(idx, process.stderr))
+        for idx, process in enumerate(processes) if process.stderr]
+    if processes[0].stdin:
+        threads.append(threading.Thread(target=write, args=(processes[0].stdin,)))
+    timer = threading.Timer(timeout, kill) if timeout is not None else None
+    for thread in threads + ([timer] if timer else []):
+        thread.daemon = True
+        thread.start()
+    try:
+        output = read(processes[-1].stdout, output_filter)
+    finally:
+        for thread in threads:
+            thread.join()
+        processes[-1].stdout.close()
+        for process in processes:
+            process.wait()
+        if timer:
+            timer.cancel()
+    return output, errors, killed.is_set()
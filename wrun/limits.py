@@ -0,0 +1,78 @@
+import logging
+import math
+import signal
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# limit name: (resource, signal sent to the process exceeding it)
+RLIMITS = {
+    "cpu_time": ("RLIMIT_CPU", "SIGXCPU"),  # seconds
+    "address_space": ("RLIMIT_AS", None),  # bytes
+    "open_files": ("RLIMIT_NOFILE", None),
+    "file_size": ("RLIMIT_FSIZE", "SIGXFSZ"),  # bytes
+}
+
+log = logging.getLogger(__name__)
+
+
+def merge(*limits):
+    """ The strictest value of each limit
+
+    values are finite numbers >= 0: a negative one would mean unlimited to setrlimit, lifting the stricter ones
+    """
+    merged = {}
+    for item in limits:
+        for name, value in (item or {}).items():
+            if name not in RLIMITS:
+                raise ValueError("unknown limit '{}'".format(name))
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value < math.inf:
+                raise ValueError("invalid value {!r} of limit '{}'".format(value, name))
+            merged[name] = min(value, merged.get(name, value))
+    return merged
+
+
+def _clamp(rlimit, value):
+    """ value within the hard limit of the daemon process, that setrlimit cannot raise """
+    hard = resource.getrlimit(rlimit)[1]
+    if hard == resource.RLIM_INFINITY:
+        return value if value < 2 ** 63 else resource.RLIM_INFINITY  # rlim_t range
+    return min(value, hard)
+
+
+def preexec(limits):
+    """ Function applying the limits in the child process, before exec """
+    if resource is None:
+        log.warning("resource limits are not supported on this platform")
+        return None
+    rlimits = []
+    for name, value in limits.items():
+        value = math.ceil(value)
+        # SIGXCPU at the soft limit, SIGKILL one second later if the process ignores it
+        hard = value + 1 if name == "cpu_time" else value
+        rlimit = getattr(resource, RLIMITS[name][0])
+        rlimits.append((rlimit, (_clamp(rlimit, value), _clamp(rlimit, hard))))
+
+    def apply():
+        for rlimit, values in rlimits:
+            resource.setrlimit(rlimit, values)
+    return apply
+
+
+def exceeded(limits, returncode, usage=None):
+    """ Name of the limit the process was stopped by, if any
+
+    processes exceeding address_space or open_files are not stopped, their allocations fail
+    """
+    for name in limits:
+        signame = RLIMITS[name][1]
+        if signame and returncode == -getattr(signal, signame, 0):
+            return name
+    if "cpu_time" in limits and usage and returncode != 0:
+        if usage.get("user_time", 0) + usage.get("system_time", 0) >= limits["cpu_time"]:
+            return "cpu_time"
+    return None
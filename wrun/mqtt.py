@@ -1,5 +1,27 @@
+import collections
+import errno
+import os
 import selectors
 import socket
+import time
+import zlib
+
+PACKET_TYPES = {
+    1: "CONNECT", 2: "CONNACK", 3: "PUBLISH", 4: "PUBACK", 5: "PUBREC", 6: "PUBREL", 7: "PUBCOMP", 8: "SUBSCRIBE",
+    9: "SUBACK", 10: "UNSUBSCRIBE", 11: "UNSUBACK", 12: "PINGREQ", 13: "PINGRESP", 14: "DISCONNECT", 15: "AUTH",
+}
+CONNECT = 1
+PUBLISH = 3
+DISCONNECT = 14
+
+# upstream selection strategies
+ROUND_ROBIN = "round_robin"
+LEAST_CONNECTIONS = "least_connections"
+CLIENT_ID = "client_id"  # a client is relayed to the same upstream while it is healthy
+
+
+class ProtocolError(Exception):
+    pass
 
 
 class Log:
@@ -11,6 +33,141 @@ class Log:
 log = Log()
 
 
+Packet = collections.namedtuple("Packet", "type flags size topic")  # size: bytes of the whole packet
+
+
+def decode_length(data, pos):
+    """ Variable byte integer at pos: (value, position after it), None if data ends before it """
+    value = 0
+    for idx in range(4):
+        if pos + idx >= len(data):
+            return None
+        value |= (data[pos + idx] & 0x7F) << (7 * idx)
+        if not data[pos + idx] & 0x80:
+            return value, pos + idx + 1
+    raise ProtocolError("malformed length")
+
+
+def connect_client_id(data):
+    """ Client identifier of the CONNECT packet at the start of data (MQTT 3.1, 3.1.1 and 5)
+
+    None until the whole packet is in data
+    """
+    if not data:
+        return None
+    if data[0] >> 4 != CONNECT:
+        raise ProtocolError("CONNECT expected")
+    header = decode_length(data, 1)
+    if header is None or header[0] + header[1] > len(data):
+        return None
+    remaining, pos = header
+    packet = bytes(data[:pos + remaining])
+    pos += 2 + int.from_bytes(packet[pos:pos + 2], "big")  # protocol name
+    level = packet[pos] if pos < len(packet) else None
+    pos += 4  # level, flags, keep alive
+    if level == 5:
+        properties = decode_length(packet, pos)
+        if properties is None:
+            raise ProtocolError("malformed CONNECT")
+        pos = properties[1] + properties[0]
+    size = int.from_bytes(packet[pos:pos + 2], "big")
+    if pos + 2 + size > len(packet):
+        raise ProtocolError("malformed CONNECT")
+    return packet[pos + 2:pos + 2 + size].decode("utf-8", "replace")
+
+
+class PacketParser:
+    """ Incremental framing of the MQTT packets of a stream, the data can be split anywhere
+
+    data is inspected through a memoryview: only the fixed headers and the PUBLISH topics are copied
+    """
+
+    def __init__(self):
+        self._header = bytearray()
+        self._remaining = None  # bytes of the current packet still to come, None while reading the fixed header
+        self._topic = None  # PUBLISH: topic length (2 bytes) and topic, while they are collected
+
+    def _collect_topic(self, view):
+        """ bytes of view are appended to the topic, up to its end """
+        while True:
+            needed = 2 if len(self._topic) < 2 else 2 + int.from_bytes(self._topic[:2], "big")
+            count = min(needed - len(self._topic), len(view))
+            if not count:
+                return
+            self._topic += view[:count]
+            view = view[count:]
+
+    def _packet(self):
+        packet_type, flags = self._header[0] >> 4, self._header[0] & 0x0F
+        size = len(self._header) + self._size
+        topic = None
+        if self._topic is not None:
+            topic = bytes(self._topic[2:]).decode("utf-8", "replace")
+        self._header = bytearray()
+        self._remaining = self._topic = None
+        return Packet(packet_type, flags, size, topic)
+
+    def feed(self, data):
+        """ Packets completed by data """
+        packets = []
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view) or self._remaining == 0:
+            if self._remaining is None:
+                byte = view[pos]
+                pos += 1
+                self._header.append(byte)
+                if len(self._header) == 1 or byte & 0x80:
+                    if len(self._header) == 5:
+                        raise ProtocolError("malformed remaining length")
+                    continue
+                self._size = self._remaining = sum(
+                    (b & 0x7F) << (7 * idx) for idx, b in enumerate(self._header[1:]))
+                if self._header[0] >> 4 == PUBLISH:
+                    self._topic = bytearray()
+                continue
+            if self._remaining:
+                count = min(self._remaining, len(view) - pos)
+                if self._topic is not None:
+                    self._collect_topic(view[pos:pos + count])
+                pos += count
+                self._remaining -= count
+            if self._remaining == 0:
+                packets.append(self._packet())
+        return packets
+
+
+class Stats:
+    """ Counts of packets by type, messages and bytes of the PUBLISH packets by topic """
+
+    def __init__(self):
+        self.packets = collections.Counter()
+        self.topics = collections.defaultdict(lambda: [0, 0])  # topic: [messages, bytes]
+        self._previous = {}, time.monotonic()  # totals and time of the previous describe
+
+    def add(self, packet):
+        self.packets[PACKET_TYPES.get(packet.type, packet.type)] += 1
+        if packet.type == PUBLISH:
+            totals = self.topics[packet.topic]
+            totals[0] += 1
+            totals[1] += packet.size
+
+    def describe(self):
+        """ Totals by topic, the busiest first, with the rates (per second) since the previous describe """
+        previous, since = self._previous
+        now = time.monotonic()
+        elapsed = max(now - since, 1e-9)
+        topics = []
+        for topic, (messages, size) in self.topics.items():
+            previous_messages, previous_size = previous.get(topic, (0, 0))
+            topics.append({
+                "topic": topic, "messages": messages, "bytes": size,
+                "message_rate": (messages - previous_messages) / elapsed,
+                "byte_rate": (size - previous_size) / elapsed})
+        self._previous = {topic: tuple(totals) for topic, totals in self.topics.items()}, now
+        return {"packets": dict(self.packets), "topics": sorted(topics, key=lambda t: t["bytes"], reverse=True)}
+
+
 class Host:
     def __init__(self, pool, sock=None):
         self.pool = pool
@@ -18,35 +175,208 @@ class Host:
         self.sock.setblocking(False)
         log.debug("Host.__init__", self.sock)
         self._dispatch = None
+        self._events = 0
+        self.closed = False
+        self.on_close = None
 
     def set_dispatch(self, _dispatch):
-        assert not self._dispatch
+        """ the dispatch can be replaced, e.g. once a handshake is done """
         self._dispatch = _dispatch
-        self.pool.register(self.sock, selectors.EVENT_READ, self.read)
+        self._update_events()
+
+    def _update_events(self):
+        self._set_events(selectors.EVENT_READ if self._dispatch else 0)
+
+    def _set_events(self, events):
+        """ the selector has no registration without events """
+        if events == self._events or self.closed:
+            return
+        if not self._events:
+            self.pool.register(self.sock, events, self.handle)
+        elif not events:
+            self.pool.unregister(self.sock)
+        else:
+            self.pool.modify(self.sock, events, self.handle)
+        self._events = events
+
+    def handle(self, sock, mask):
+        if mask & selectors.EVENT_READ and not self.closed:
+            self.read(sock)
 
     def read(self, data):
         assert False, "to be implemented"
 
     def destroy(self):
+        if self.closed:
+            return
         log.debug("Host.Destroy", self.sock)
-        self.pool.unregister(self.sock)
+        self._set_events(0)
+        self.closed = True
         self.sock.close()
+        if self.on_close:
+            self.on_close()
 
 
 class Connection(Host):
+    """ Writes are buffered: the data the peer is not ready for is sent when the socket becomes writable
+
+    above HIGH_WATERMARK buffered bytes on_pressure(True) is called, e.g. to pause reading the data source,
+    on_pressure(False) once the buffer is drained to LOW_WATERMARK
+    """
+    HIGH_WATERMARK = 256 * 1024
+    LOW_WATERMARK = 64 * 1024
+    READ_SIZE = 65536
+
+    def __init__(self, pool, sock=None):
+        super().__init__(pool, sock)
+        self._buffer = collections.deque()
+        self.buffered = 0
+        self.paused = False  # reading
+        self.on_pressure = lambda pressure: None
+        self._pressure = False
+        self._closing = False
+
+    def handle(self, sock, mask):
+        if mask & selectors.EVENT_WRITE and not self.closed:
+            self.flush()
+        if mask & selectors.EVENT_READ and not self.closed:
+            self.read(sock)
+
     def read(self, sock):
         assert sock == self.sock
-        data = self.sock.recv(1024)
+        try:
+            data = self.sock.recv(self.READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            log.debug("Connection.recv failed", self.sock, exc)
+            data = bytes()
         self._dispatch(data)
 
+    def _update_events(self):
+        events = 0 if self.paused or self._closing or not self._dispatch else selectors.EVENT_READ
+        self._set_events(events | (selectors.EVENT_WRITE if self.buffered else 0))
+
+    def pause_reading(self, paused=True):
+        self.paused = paused
+        self._update_events()
+
+    def _send(self, data):
+        """ bytes sent, the socket is destroyed on errors other than a full send buffer """
+        try:
+            return self.sock.send(data)
+        except (BlockingIOError, InterruptedError):
+            return 0
+        except OSError as exc:
+            log.debug("Connection.send failed", self.sock, exc)
+            self._buffer.clear()
+            self.buffered = 0
+            self.destroy()
+            return len(data)
+
     def write(self, data):
-        self.sock.sendall(data)
+        if self.closed:
+            return
+        sent = 0 if self.buffered else self._send(data)
+        if sent < len(data) and not self.closed:
+            self._buffer.append(memoryview(data)[sent:])
+            self.buffered += len(data) - sent
+            self._update_events()
+        if self.buffered > self.HIGH_WATERMARK and not self._pressure:
+            log.debug("Connection.write high watermark", self.sock, self.buffered)
+            self._pressure = True
+            self.on_pressure(True)
+
+    def flush(self):
+        while self._buffer and not self.closed:
+            data = self._buffer[0]
+            sent = self._send(data)
+            if self.closed:  # destroyed by a send error, the buffer is dropped
+                return
+            self.buffered -= min(sent, len(data))
+            if sent < len(data):
+                self._buffer[0] = data[sent:]
+                break
+            self._buffer.popleft()
+        if self._closing and not self.buffered:
+            self.destroy()
+            return
+        self._update_events()
+        if self._pressure and self.buffered <= self.LOW_WATERMARK:
+            log.debug("Connection.flush low watermark", self.sock, self.buffered)
+            self._pressure = False
+            self.on_pressure(False)
+
+    def shutdown(self):
+        """ Destroyed once the buffered data is sent, nothing more is read """
+        if not self.buffered:
+            self.destroy()
+            return
+        self._closing = True
+        self._update_events()
 
 
 class NewConnection(Connection):
+    """ The writes are buffered until connected, then on_connect(error) is called: error is None on success
+
+    without on_connect, a failed connection is destroyed
+    """
+
     def __init__(self, pool, address):
         super().__init__(pool)
+        self.address = address
+        self.connected = False
+        self.on_connect = None
         self.sock.connect_ex(address)
+        self._update_events()
+
+    def _update_events(self):
+        if self.connected:
+            super()._update_events()
+        else:
+            self._set_events(selectors.EVENT_WRITE)
+
+    def write(self, data):
+        if self.connected:
+            return super().write(data)
+        self._buffer.append(data)
+        self.buffered += len(data)
+
+    def handle(self, sock, mask):
+        if self.connected or self.closed:
+            return super().handle(sock, mask)
+        error = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            log.debug("NewConnection failed", self.address, os.strerror(error))
+            self.destroy()
+            if self.on_connect:
+                self.on_connect(OSError(error, os.strerror(error)))
+            return
+        self.connected = True
+        if self.on_connect:
+            self.on_connect(None)
+        self.flush()
+
+
+class HealthProbe(Host):
+    """ TCP connection attempt, on_result(healthy) """
+
+    def __init__(self, pool, address, on_result):
+        super().__init__(pool)
+        self.started = time.monotonic()
+        self.on_result = on_result
+        if self.sock.connect_ex(address) not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.result(False)
+        else:
+            self._set_events(selectors.EVENT_WRITE)
+
+    def handle(self, sock, mask):
+        self.result(not self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR))
+
+    def result(self, healthy):
+        if not self.closed:
+            self.destroy()
+            self.on_result(healthy)
 
 
 class Listener(Host):
@@ -64,51 +394,235 @@ class Listener(Host):
 
 
 class Channel:
-    def __init__(self, client, remote):
+    """ Relays the data between client and remote unchanged, the packets are framed for the stats only
+
+    published: stats of the packets sent by the client, delivered: of the ones sent by the remote
+    """
+
+    def __init__(self, client, remote, published=None, delivered=None):
         self.client = client
         self.remote = remote
+        self.published = published or Stats()
+        self.delivered = delivered or Stats()
+        self._client_packets = PacketParser()
+        self._remote_packets = PacketParser()
         self.client.set_dispatch(self.client_data)
         self.remote.set_dispatch(self.remote_data)
+        # backpressure: the side that cannot keep up pauses reading on the other side
+        self.client.on_pressure = self.remote.pause_reading
+        self.remote.on_pressure = self.client.pause_reading
+        # a side closed by an error (e.g. a reset while sending) closes the other one, once its data is sent
+        self._close_with(self.client, self.remote)
+        self._close_with(self.remote, self.client)
+
+    @staticmethod
+    def _close_with(connection, other):
+        previous = connection.on_close
+
+        def on_close():
+            if previous:
+                previous()
+            if not other.closed:
+                other.shutdown()
+        connection.on_close = on_close
+
+    def _parse(self, parser, data):
+        try:
+            return parser.feed(data)
+        except ProtocolError as exc:
+            log.debug("protocol error", exc)
+            self.client.destroy()
+            self.remote.destroy()
+            return None
 
     def client_data(self, data):
-        log.debug("read_client", data)
-        if data:
-            log.debug("remote send...")
-            self.remote.write(data)
-        # TODO: ... perché è necessario?!?
-        if data == b'\xe0\x00':
+        if not data:
             log.debug("client disconnect")
             self.client.destroy()
+            self.remote.shutdown()
+            return
+        packets = self._parse(self._client_packets, data)
+        if packets is None:
+            return
+        self.remote.write(data)
+        for packet in packets:
+            self.published.add(packet)
+            if packet.type == DISCONNECT:
+                # the client must not send anything else, the remote closes its side too
+                log.debug("client DISCONNECT")
+                self.client.destroy()
+                self.remote.shutdown()
 
     def remote_data(self, data):
-        log.debug("read_remote", data)
-        if data:
-            log.debug("client send...")
-            self.client.write(data)
-        else:
+        if not data:
             log.debug("remote disconnect")
             self.remote.destroy()
+            self.client.shutdown()
+            return
+        packets = self._parse(self._remote_packets, data)
+        if packets is None:
+            return
+        self.client.write(data)
+        for packet in packets:
+            self.delivered.add(packet)
+
+
+class Upstream:
+    def __init__(self, address):
+        self.address = address
+        self.connections = 0
+        self.healthy = True
+        self.next_check = 0  # monotonic time
+        self.probe = None
+
+    def release(self):
+        self.connections -= 1
+
+    def __repr__(self):
+        return "Upstream({}, connections={}, healthy={})".format(self.address, self.connections, self.healthy)
+
+
+class Handshake:
+    """ Client data is kept until its CONNECT packet chooses the upstream and the upstream is connected
+
+    an upstream failing the connection is marked unhealthy and the next one is tried
+    """
+    MAX_SIZE = 65536
+
+    def __init__(self, broker, client):
+        self.broker = broker
+        self.client = client
+        self.data = bytearray()
+        self.client_id = None
+        self.tried = []
+        self.remote = None
+        client.set_dispatch(self.client_data)
+        broker.clients.add(self)
+        client.on_close = lambda: broker.clients.discard(self)
+
+    def close(self):
+        self.client.destroy()
+        if self.remote:
+            self.remote.destroy()
+
+    def client_data(self, data):
+        if not data:
+            log.debug("client disconnect")
+            self.client.destroy()
+            return
+        self.data += data
+        try:
+            self.client_id = connect_client_id(self.data)
+            if self.client_id is None and len(self.data) > self.MAX_SIZE:
+                raise ProtocolError("CONNECT too large")
+        except ProtocolError as exc:
+            log.debug("protocol error", exc)
+            self.client.destroy()
+            return
+        if self.client_id is not None:
+            self.connect()
+
+    def connect(self):
+        upstream = self.broker.choose(self.client_id, self.tried)
+        if upstream is None:
+            log.debug("no upstream available", self.client_id)
+            self.client.destroy()
+            return
+        self.tried.append(upstream)
+        upstream.connections += 1
+        remote = self.remote = NewConnection(self.broker.hosts, upstream.address)
+        remote.on_close = upstream.release
+        remote.on_connect = lambda error: self.connected(upstream, remote, error)
+        self.client.pause_reading()
+
+    def connected(self, upstream, remote, error):
+        if error is not None:
+            self.broker.health(upstream, False)
+            if not self.client.closed:
+                self.connect()
+            return
+        if self.client.closed:
+            remote.destroy()
+            return
+        self.client.pause_reading(False)
+        channel = Channel(self.client, remote, self.broker.published, self.broker.delivered)
+        channel.client_data(bytes(self.data))
 
 
 class Broker:
-    def __init__(self):
+    """ Relays each client to one of the upstream brokers, chosen by strategy among the healthy ones
+
+    an upstream is checked every health_interval seconds (a TCP connection within health_timeout seconds),
+    or marked unhealthy when a client connection to it fails
+    """
+
+    def __init__(
+            self, address=("localhost", 1883), upstreams=(("localhost", 1884),), strategy=ROUND_ROBIN,
+            health_interval=5, health_timeout=2):
+        if strategy not in (ROUND_ROBIN, LEAST_CONNECTIONS, CLIENT_ID):
+            raise ValueError("unknown strategy '{}'".format(strategy))
         self.hosts = selectors.DefaultSelector()
-        self.doorkeeper = Listener(self.hosts, ("localhost", 1883))
+        self.doorkeeper = Listener(self.hosts, address)
         self.doorkeeper.set_dispatch(self.create)
+        self.address = self.doorkeeper.sock.getsockname()
+        self.upstreams = [Upstream(tuple(upstream)) for upstream in upstreams]
+        self.strategy = strategy
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.published = Stats()
+        self.delivered = Stats()
+        self.clients = set()  # Handshake of each client
+        self._turn = 0
 
     def create(self, client):
-        remote = NewConnection(self.hosts, ("localhost", 1884))
-        Channel(client, remote)
+        Handshake(self, client)
+
+    def choose(self, client_id, excluded=()):
+        """ Upstream for the client, None if all of them were excluded """
+        candidates = [upstream for upstream in self.upstreams if upstream not in excluded]
+        candidates = [upstream for upstream in candidates if upstream.healthy] or candidates
+        if not candidates:
+            return None
+        if self.strategy == LEAST_CONNECTIONS:
+            return min(candidates, key=lambda upstream: upstream.connections)
+        if self.strategy == CLIENT_ID:  # rendezvous hashing: only the clients of a failed upstream move
+            return max(candidates, key=lambda u: zlib.crc32("{} {}".format(client_id, u.address).encode()))
+        self._turn += 1
+        return candidates[self._turn % len(candidates)]
+
+    def health(self, upstream, healthy):
+        if healthy != upstream.healthy:
+            log.debug("upstream healthy" if healthy else "upstream unhealthy", upstream.address)
+        upstream.healthy = healthy
+        upstream.next_check = time.monotonic() + self.health_interval
 
-    def process(self):
-        selected = self.hosts.select(timeout=1)
+    def _probed(self, upstream, healthy):
+        upstream.probe = None
+        self.health(upstream, healthy)
+
+    def check_health(self):
+        now = time.monotonic()
+        for upstream in self.upstreams:
+            if upstream.probe and now - upstream.probe.started > self.health_timeout:
+                upstream.probe.result(False)
+            if not upstream.probe and now >= upstream.next_check:
+                probe = HealthProbe(self.hosts, upstream.address, lambda ok, u=upstream: self._probed(u, ok))
+                upstream.probe = None if probe.closed else probe
+
+    def process(self, timeout=1):
+        selected = self.hosts.select(timeout=timeout)
         if not selected:
             log.debug("select timeout")
-            return
         for key, mask in selected:
             callback = key.data
-            callback(key.fileobj)
+            callback(key.fileobj, mask)
+        self.check_health()
 
     def stop(self):
+        for upstream in self.upstreams:
+            if upstream.probe:
+                upstream.probe.destroy()
+        for client in list(self.clients):
+            client.close()
         self.doorkeeper.destroy()
         self.hosts.close()
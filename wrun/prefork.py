@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+LISTEN_FD_ENV = "WRUN_LISTEN_FD"
+UNIX_LISTEN_FD_ENV = "WRUN_UNIX_LISTEN_FD"
+
+SIGNALS = [getattr(signal, name) for name in ("SIGTERM", "SIGHUP") if hasattr(signal, name)]
+
+log = logging.getLogger(__name__)
+
+
+def _mask_signals(how):
+    if hasattr(signal, "pthread_sigmask"):
+        signal.pthread_sigmask(how, SIGNALS)
+
+
+def worker_main(target, args):
+    # signal handlers inherited from the supervisor belong to the supervisor
+    for signum in SIGNALS:
+        signal.signal(signum, signal.SIG_DFL)
+    _mask_signals(getattr(signal, "SIG_UNBLOCK", None))
+    target(*args)
+
+
+def handoff(listen_socket=None, unix_socket=None):
+    """ Starts a replacement of the running daemon, the listening sockets (if any) are inherited """
+    env = dict(os.environ)
+    pass_fds = []
+    for name, sock in ((LISTEN_FD_ENV, listen_socket), (UNIX_LISTEN_FD_ENV, unix_socket)):
+        if sock is not None:
+            fd = sock.fileno()
+            env[name] = str(fd)
+            pass_fds.append(fd)
+    process = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=pass_fds)
+    log.info("HANDOFF: started replacement %s", process.pid)
+    return process
+
+
+def inherited_socket(name=LISTEN_FD_ENV):
+    """ Listening socket handed off by the replaced daemon, if any """
+    fd = os.environ.pop(name, None)
+    if fd is None:
+        return None
+    log.info("HANDOFF: inherited listening socket %s", fd)
+    return socket.socket(fileno=int(fd))
+
+
+class Supervisor:
+    """ Keeps a fixed number of worker processes alive """
+    RESTART_DELAY = 1  # seconds, throttles restarts of workers crashing at start-up
+    POLL_INTERVAL = 0.5  # seconds between checks of the shutdown request
+
+    def __init__(self, target, workers, args=(), drain_timeout=None):
+        self.target = target
+        self.workers = workers
+        self.args = args
+        self.drain_timeout = drain_timeout
+        self.processes = []
+        self._started = {}
+        self._running = True
+
+    def _spawn(self):
+        process = multiprocessing.Process(target=worker_main, args=(self.target, self.args))
+        # until worker_main resets them, a signal would run the supervisor handlers in the worker
+        _mask_signals(getattr(signal, "SIG_BLOCK", None))
+        try:
+            process.start()
+        finally:
+            _mask_signals(getattr(signal, "SIG_UNBLOCK", None))
+        self._started[process.pid] = time.monotonic()
+        log.info("SUPERVISOR: started worker %s", process.pid)
+        return process
+
+    def _restart(self, process):
+        process.join()
+        log.warning("SUPERVISOR: worker %s exited with code %s", process.pid, process.exitcode)
+        uptime = time.monotonic() - self._started.pop(process.pid)
+        if uptime < self.RESTART_DELAY:
+            time.sleep(self.RESTART_DELAY - uptime)
+        return self._spawn()
+
+    def start(self):
+        self.processes = [self._spawn() for _ in range(self.workers)]
+
+    def watch(self, timeout=None):
+        sentinels = {p.sentinel: idx for idx, p in enumerate(self.processes)}
+        for sentinel in multiprocessing.connection.wait(list(sentinels), timeout):
+            if not self._running:
+                break
+            idx = sentinels[sentinel]
+            self.processes[idx] = self._restart(self.processes[idx])
+
+    def stop(self):
+        """ Drains the workers: they complete the requests in progress, then they are killed after the timeout """
+        log.info("SUPERVISOR: stopping workers...")
+        for process in self.processes:
+            process.terminate()
+        deadline = None if self.drain_timeout is None else time.monotonic() + self.drain_timeout
+        for process in self.processes:
+            process.join(None if deadline is None else max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning("SUPERVISOR: worker %s drain timeout, killing", process.pid)
+                process.kill()
+                process.join()
+        self.processes = []
+        log.info("SUPERVISOR: stopped workers")
+
+    def shutdown(self, *args):
+        self._running = False
+
+    def run(self):
+        self.start()
+        try:
+            while self._running:
+                self.watch(self.POLL_INTERVAL)
+        finally:
+            self.stop()
@@ -0,0 +1,164 @@
+import collections
+import cProfile
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+DEFAULT_SECONDS = 10
+RESULT_NAME = re.compile(r"^wrun-\d+-\d+\.(pstats|collapsed)$")
+
+log = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    """ cProfile of each request, merged in a single pstats result """
+    SUFFIX = ".pstats"
+
+    def __init__(self):
+        self.stats = pstats.Stats()
+        self._lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def call(self, func, *args):
+        """ the request is run anyway: when another profiler is active it is just not profiled """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Python >= 3.12: a single cProfile at a time, concurrent requests are missed
+            log.debug("PROFILER: request not profiled, another one is in progress")
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            with self._lock:
+                self.stats.add(profile)
+
+    def dump(self, path):
+        self.stats.dump_stats(path)
+
+
+class SamplingProfiler:
+    """ Periodic samples of the stacks of all threads, in collapsed stacks format (flame graphs) """
+    SUFFIX = ".collapsed"
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        ident = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_ident, frame in sys._current_frames().items():
+                if thread_ident != ident:
+                    self.samples[self._stack(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def call(self, func, *args):
+        return func(*args)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+
+class Session:
+    def __init__(self, profiler, result_path, requests, timer):
+        self.profiler = profiler
+        self.result_path = result_path
+        self.requests = requests  # still to be profiled, None for no limit
+        self.active = 0  # requests in progress
+        self.timer = timer
+
+
+class Profiling:
+    """ One profiling session at a time, lasting some seconds and/or requests
+
+    the result is written in a file of the given directory when the session ends
+    """
+    MODES = {"cprofile": RequestProfiler, "sampling": SamplingProfiler}
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    def start(self, path, mode="cprofile", seconds=None, requests=None):
+        """ Name of the result file, None if another session is in progress """
+        if seconds is None and requests is None:
+            seconds = DEFAULT_SECONDS
+        with self._lock:
+            if self._session:
+                return None
+            profiler = self.MODES[mode]()
+            name = "wrun-{}-{}{}".format(os.getpid(), time.time_ns() // 1000000, profiler.SUFFIX)
+            timer = None
+            if seconds is not None:
+                timer = threading.Timer(seconds, self._finish, args=(profiler,))
+                timer.daemon = True
+            self._session = Session(profiler, os.path.join(path, name), requests, timer)
+            profiler.start()
+            if timer:
+                timer.start()
+        log.info("PROFILER: %s started for %s seconds, %s requests", name, seconds, requests)
+        return name
+
+    def _finish(self, profiler):
+        with self._lock:
+            session = self._session
+            if not session or session.profiler is not profiler:
+                return
+            self._session = None
+        if session.timer:
+            session.timer.cancel()
+        profiler.stop()
+        profiler.dump(session.result_path + ".tmp")
+        os.replace(session.result_path + ".tmp", session.result_path)  # results are never read half written
+        log.info("PROFILER: written '%s'", session.result_path)
+
+    def call(self, func, *args):
+        with self._lock:
+            session = self._session
+            if session and session.requests is not None:
+                if session.requests == 0:
+                    session = None
+                else:
+                    session.requests -= 1
+            if session:
+                session.active += 1
+        if not session:
+            return func(*args)
+        try:
+            return session.profiler.call(func, *args)
+        finally:
+            with self._lock:
+                session.active -= 1
+                done = session.requests == 0 and session.active == 0
+            if done:
+                self._finish(session.profiler)
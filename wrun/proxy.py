@@ -0,0 +1,172 @@
+import json
+import os
+
+from .transport import SecureTCPClient, TCPClient, UnixClient
+
+ENCODING = "utf-8"
+
+
+class StringTranslator:
+    encoding = ENCODING
+
+    def decode(self, binary_buffer):
+        return binary_buffer.decode(self.encoding)
+
+    def encode(self, string_buffer):
+        return string_buffer.encode(self.encoding)
+
+
+class Client:
+    """ Encode and request actions """
+
+    def __init__(self, translator, channel):
+        self.translator = translator
+        self.channel = channel
+
+    def request(self, request):
+        binary_request = self.translator.encode(request)
+        binary_response = self.channel.request(binary_request)
+        return self.translator.decode(binary_response)
+
+
+def signed_channel(channel, hmac_key):
+    from .signing import SignedChannel, Signer  # hashing is imported by the HMAC_KEY clients only
+    return SignedChannel(Signer(hmac_key), channel)
+
+
+def client_channel(server_address, timeout=None, **kwargs):
+    if isinstance(server_address, str):
+        client_class = UnixClient
+    elif kwargs:
+        client_class = SecureTCPClient
+    else:
+        client_class = TCPClient
+    return client_class(server_address, timeout=timeout, **kwargs)
+
+
+def client(server_address, request, timeout=None, hmac_key=None, **kwargs):
+    translate = StringTranslator()
+    with client_channel(server_address, timeout, **kwargs) as channel:
+        if hmac_key:
+            channel = signed_channel(channel, hmac_key)
+        client = Client(translate, channel)
+        return client.request(request)
+
+
+def fetch(server_address, request, path, offset=0, timeout=None, hmac_key=None, **kwargs):
+    """ Requests a file: the response header is returned, the file data is written in path at offset
+
+    the local file ends with the data received, an older and longer one is truncated
+    """
+    binary_request = StringTranslator().encode(request)
+    with client_channel(server_address, timeout, **kwargs) as channel:
+        if hmac_key:
+            chunks = iter([signed_channel(channel, hmac_key).request(binary_request)])
+        else:
+            channel.send(binary_request)
+            chunks = channel.receive_chunks()
+        head = bytes()
+        for chunk in chunks:
+            head += chunk
+            if b"\n" in head:
+                break
+        header, _, data = head.partition(b"\n")
+        header = json.loads(header.decode(ENCODING))
+        if "error" in header:
+            return header
+        received = len(data)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+            for chunk in chunks:
+                f.write(chunk)
+                received += len(chunk)
+            f.truncate()
+    if received != header["size"]:
+        raise ConnectionError("incomplete file, {} of {} bytes received".format(received, header["size"]))
+    return header
+
+
+class Proxy:
+    def __init__(self, host, port=None, **kwargs):
+        """ without port, host is the path of the daemon AF_UNIX socket """
+        self.server_address = host if port is None else (host, port)
+        self.kwargs = kwargs
+        self.client = lambda request: client(self.server_address, request, **kwargs)
+
+    def run(self, executable_name, args, input_stdin="", **options):
+        """ options:
+        idempotency_key, concurrent requests with the same key share a single execution
+        limits, resource limits stricter than the daemon ones
+        output_filter, stdout is filtered by the daemon (see wrun.filters.build)
+        stdin_hash, input_stdin is the blob with this hash (see put_blob)
+        store_stdin, input_stdin is stored as a blob too
+        """
+        request = [executable_name, args, input_stdin]
+        if options:
+            request.append(options)
+        result = self.client(json.dumps(request))
+        return json.loads(result)
+
+    def control(self, action, **kwargs):
+        kwargs["action"] = action
+        return json.loads(self.client(json.dumps(kwargs)))
+
+    def catalog(self):
+        return self.control("catalog")
+
+    def ping(self):
+        """ {"pid": <of the daemon>, "uptime": <seconds>}, nothing is executed """
+        return self.control("ping")
+
+    def usage(self):
+        return self.control("usage")
+
+    def put_blob(self, data):
+        """ Hash of data, stored by the daemon to be used as input_stdin of the following runs """
+        return self.control("blob_put", data=data).get("hash")
+
+    def has_blob(self, blob_hash):
+        return self.control("blob_has", hash=blob_hash)["exists"]
+
+    def latest(self, schedule, max_age=None):
+        """ The latest result of a schedule, a live run is done if it is older than max_age seconds
+
+        {"result": <like run>, "timestamp": <of the result, seconds since the epoch>, "age": <seconds>}
+        """
+        return self.control("latest", schedule=schedule, max_age=max_age)
+
+    def run_pipeline(self, stages, input_stdin="", **options):
+        """ Runs [(executable_name, args), ...] connected by pipes, like a shell "|"
+
+        intermediate outputs do not leave the daemon host; options: like run, except idempotency_key
+        """
+        return self.control("pipeline", stages=stages, input_stdin=input_stdin, **options)
+
+    def fetch(self, name, path, offset=0, count=None):
+        """ Writes the artifact name (in ARTIFACT_PATH), from offset, in path at the same offset
+
+        to resume a partial download: offset=os.path.getsize(path)
+        """
+        request = json.dumps({"action": "fetch", "name": name, "offset": offset, "count": count})
+        return fetch(self.server_address, request, path, offset, **self.kwargs)
+
+    def run_cached(self, executable_name, args, input_stdin, **options):
+        """ Like run, input_stdin is sent only if the daemon does not store it already """
+        from .blobs import blob_hash
+        result = self.run(executable_name, args, "", stdin_hash=blob_hash(input_stdin), **options)
+        if result.get("error") == "unknown blob":
+            result = self.run(executable_name, args, input_stdin, store_stdin=True, **options)
+        return result
+
+    def profile(self, mode="cprofile", seconds=None, requests=None):
+        """ Profiles the daemon for some seconds and/or requests, mode: "cprofile" or "sampling" """
+        return self.control("profile", mode=mode, seconds=seconds, requests=requests)
+
+    def profile_result(self, name):
+        """ "data": pstats file (cprofile) or collapsed stacks (sampling) content, once the profiling ended """
+        result = self.control("profile_result", name=name)
+        if "data" in result:
+            import base64
+            result["data"] = base64.b64decode(result["data"])
+        return result
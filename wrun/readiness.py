@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import socket
+import time
+
+log = logging.getLogger(__name__)
+
+
+def sd_notify(state):
+    """ Sends state (e.g. "READY=1") to the service manager socket in NOTIFY_SOCKET (systemd Type=notify), if any """
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address or not hasattr(socket, "AF_UNIX"):
+        return False
+    if address.startswith("@"):  # abstract namespace
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+    except OSError as exc:
+        log.warning("READINESS: notification to '%s' failed: %r", address, exc)
+        return False
+    return True
+
+
+def write_ready_file(path, info):
+    """ info as JSON, the file appears complete or not at all """
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "w") as f:
+        json.dump(info, f)
+    os.replace(temp_path, path)
+
+
+def read_ready_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def remove_ready_file(path, pid):
+    """ The ready file is removed unless it was replaced by another process (e.g. after a restart) """
+    info = read_ready_file(path)
+    if info and info.get("pid") == pid:
+        os.remove(path)
+
+
+def wait_ready_file(path, timeout=10, interval=0.01):
+    """ The content of the ready file, as soon as it exists: {"pid": ..., "address": [host, port], "unix_socket": ...}
+
+    a file left by a previous daemon must be removed before starting the new one
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        info = read_ready_file(path)
+        if info is not None:
+            return info
+        if time.monotonic() >= deadline:
+            raise TimeoutError("'{}' not ready within {} seconds".format(path, timeout))
+        time.sleep(interval)
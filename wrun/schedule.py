@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+
+from .coalesce import SingleFlight
+
+log = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """ Runs the scheduled requests periodically and keeps the latest result of each one
+
+    schedules: {name: {"executable": <name>, "args": [...], "input_stdin": "", "interval": <seconds>}}
+    run: function running a request, called as run(executable, args, input_stdin)
+    """
+
+    def __init__(self, run, schedules=None):
+        self.run = run
+        self.schedules = {}
+        self.latest = {}  # name: (result, timestamp)
+        self._due = {}  # name: monotonic time of the next run
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._single_flight = SingleFlight()
+        self.update(schedules or {})
+
+    def update(self, schedules):
+        for name, schedule in schedules.items():
+            if not schedule.get("executable") or not schedule.get("interval", 0) > 0:
+                raise ValueError("invalid schedule '{}'".format(name))
+        with self._lock:
+            self.schedules = dict(schedules)
+            self._due = {name: self._due.get(name, time.monotonic()) for name in schedules}
+            self.latest = {name: latest for name, latest in self.latest.items() if name in schedules}
+
+    def execute(self, name):
+        """ A live run of the schedule, it becomes the latest result """
+        schedule = self.schedules[name]
+
+        def run():
+            result = self.run(schedule["executable"], schedule.get("args", []), schedule.get("input_stdin", ""))
+            with self._lock:
+                self.latest[name] = result, time.time()
+                self._due[name] = time.monotonic() + schedule["interval"]
+                return self.latest[name]
+        return self._single_flight.do(name, run)
+
+    def run_pending(self):
+        """ Runs the schedules due, it returns the seconds to wait for the next one """
+        with self._lock:
+            now = time.monotonic()
+            due = [name for name, when in self._due.items() if when <= now]
+        for name in due:
+            try:
+                self.execute(name)
+            except Exception:
+                log.exception("SCHEDULER: schedule '%s' failed", name)
+                with self._lock:
+                    if name in self._due:
+                        self._due[name] = time.monotonic() + self.schedules[name]["interval"]
+        with self._lock:
+            return max(0, min(self._due.values(), default=time.monotonic() + 1) - time.monotonic())
+
+    def get(self, name, max_age=None):
+        """ The latest (result, timestamp), from a live run if missing or older than max_age seconds
+
+        None for an unknown schedule
+        """
+        if name not in self.schedules:
+            return None
+        latest = self.latest.get(name)
+        if latest and (max_age is None or time.time() - latest[1] <= max_age):
+            return latest
+        log.debug("SCHEDULER: live run of '%s'", name)
+        return self.execute(name)
+
+    def _loop(self):
+        while not self._stopped.wait(self.run_pending()):
+            pass
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,637 @@
+from functools import reduce
+import base64
+import json
+import logging
+import logging.config
+import multiprocessing
+import operator
+import os
+import re
+import runpy
+import signal
+import subprocess
+import threading
+import time
+
+from . import accounting, filters, limits as rlimits
+from .blobs import BlobStore
+from .catalog import Catalog, ConcurrencyLimits
+from .coalesce import SingleFlight, request_key
+from .prefork import UNIX_LISTEN_FD_ENV, Supervisor, handoff, inherited_socket
+from .profiling import RESULT_NAME, Profiling
+from .proxy import ENCODING, StringTranslator
+from .readiness import remove_ready_file, sd_notify, write_ready_file
+from .schedule import Scheduler
+from .signing import REPLAY_CACHE_SIZE, SignedAction, Signer
+from .spawn import Spawner
+from .transport import TCPServer, UnixServer, bind_listen_socket
+from .transport import UNIX_SOCKET_MODE, FileResponse
+from .transport import SecureTCPServer
+
+log = logging.getLogger(__package__)  # records keep the "wrun" logger name
+
+
+class BaseConfig(object):
+    def __init__(self, filepath, **kwargs):
+        attrs = runpy.run_path(filepath)
+        self.__dict__.update(kwargs)
+        for setting, setting_value in attrs.items():
+            if setting.isupper():
+                setattr(self, setting, setting_value)
+
+    @staticmethod
+    def store(filepath, **kwargs):
+        with open(filepath, "w") as f:
+            for k, v in kwargs.items():
+                f.write('{} = {}\n'.format(k, repr(v)))
+
+
+class Config(BaseConfig):
+    DEFAULTS = {
+        "HOST": "localhost",
+        "COLLECT_STDERR": False,
+        "WORKERS": 1,
+        "REUSE_PORT": False,
+        "DRAIN_TIMEOUT": 30,
+        "RELOAD_INTERVAL": 1,
+        "EXECUTABLE_POLICIES": {},
+        "SPAWN_HELPER": False,
+        "THREADS": 1,
+        "COALESCE": False,
+        "UNIX_SOCKET": None,
+        "UNIX_SOCKET_MODE": UNIX_SOCKET_MODE,
+        "PROFILE_PATH": None,
+        "COLLECT_USAGE": False,
+        "RESOURCE_LIMITS": {},
+        "BLOB_CACHE_SIZE": 64 * 2 ** 20,
+        "ARTIFACT_PATH": None,
+        "SCHEDULES": {},
+        "READY_FILE": None,
+    }
+    MANDATORY_SETTINGS = ("EXECUTABLE_PATH", "PORT")
+    # settings bound to sockets, processes or log handlers: a reload does not change them
+    RESTART_SETTINGS = (
+        "HOST", "PORT", "SECURE", "HMAC_KEY", "WORKERS", "REUSE_PORT", "THREADS", "UNIX_SOCKET", "UNIX_SOCKET_MODE",
+        "BLOB_CACHE_SIZE", "READY_FILE", "LOG_PATH", "LOG_FILECONFIG", "LOG_DICTCONFIG")
+    # secrets, their values are not logged
+    REDACTED_SETTINGS = ("HMAC_KEY", "SECURE")
+
+    def __init__(self, filepath, configure_logging=True):
+        super(Config, self).__init__(filepath, **self.DEFAULTS)
+        if configure_logging:
+            log_config(self)
+        log.info("settings_file '%s'", filepath)
+        log.info("settings \"%s\"", {
+            k: "<redacted>" if k in self.REDACTED_SETTINGS else v for k, v in self.__dict__.items()})
+
+    def reload(self, filepath):
+        """ New settings read from filepath, restart settings are kept from the current ones """
+        settings = Config(filepath, configure_logging=False)
+        for name in self.MANDATORY_SETTINGS:
+            if not hasattr(settings, name):
+                raise AttributeError("missing mandatory setting {}".format(name))
+        for name in self.RESTART_SETTINGS:
+            if getattr(settings, name, None) != getattr(self, name, None):
+                log.warning("setting %s changes on restart only", name)
+            settings.__dict__.pop(name, None)
+            if hasattr(self, name):
+                setattr(settings, name, getattr(self, name))
+        return settings
+
+
+LOGGING_PARAMS = {
+    "LOG_PATH": lambda param: logging.basicConfig(filename=param, level=logging.DEBUG, filemode='a'),
+    "LOG_FILECONFIG": logging.config.fileConfig,
+    "LOG_DICTCONFIG": logging.config.dictConfig,
+}
+
+
+def log_config(config, logging_params=LOGGING_PARAMS):
+    assert reduce(operator.xor, [hasattr(config, k) for k in logging_params], False)
+    for k, f in logging_params.items():
+        if hasattr(config, k):
+            f(getattr(config, k))
+            return
+
+
+class Manservant:
+    """ Interprets and run actions """
+
+    def __init__(self, translator, action):
+        self.translator = translator
+        self.action = action
+
+    def __call__(self, encoded_request):
+        decoded_request = self.translator.decode(encoded_request)
+        decoded_response = self.action(decoded_request)
+        if isinstance(decoded_response, FileResponse):
+            return decoded_response
+        return self.translator.encode(decoded_response)
+
+
+def daemon(
+        server_address, action, reuse_port=False, listen_socket=None, on_open=None, threads=1, hmac_key=None,
+        **kwargs):
+    """ server_address: (host, port) or the path of an AF_UNIX socket (kwargs: mode, the socket file permissions)
+
+    on_open(server) is called once the server accepts connections, with port 0 server.server_address has the actual one
+    """
+    translate = StringTranslator()
+    manservant = Manservant(translate, action)
+    if hmac_key:
+        manservant = SignedAction(Signer(hmac_key, replay_cache_size=REPLAY_CACHE_SIZE), manservant)
+    if isinstance(server_address, str):
+        server_class = UnixServer
+    elif kwargs:
+        server_class = SecureTCPServer
+    else:
+        server_class = TCPServer
+    kwargs.update(reuse_port=reuse_port, listen_socket=listen_socket, threads=threads)
+    with server_class(server_address, manservant, **kwargs) as channel:
+        if on_open:
+            on_open(channel)
+        channel.serve()
+
+
+def run_executable(
+        exe_path, exe_name, args, input_stdin, collect_stderr=False, timeout=None, max_output=None,
+        collect_usage=False, limits=None, output_filter=None):
+    """ collect_usage: results contain "usage", the process resource usage
+
+    limits: resource limits of the process (see wrun.limits), a stopping breach is reported as "error"
+    output_filter: declaration of a filter applied to stdout while it is read (see wrun.filters.build)
+    """
+    log.debug("executor %s %s", exe_name, " ".join(args))
+    cmd = [os.path.join(exe_path, exe_name)]
+    cmd.extend(args)
+    kwargs = {"stdout": subprocess.PIPE, "stderr": subprocess.PIPE, "args": cmd, "cwd": exe_path}
+    if input_stdin:
+        kwargs["stdin"] = subprocess.PIPE
+    if limits:
+        kwargs["preexec_fn"] = rlimits.preexec(limits)
+    start = time.monotonic()
+    process = accounting.Popen(**kwargs)
+    kwargs = {"timeout": timeout}
+    if input_stdin:
+        kwargs["input"] = input_stdin.encode(ENCODING)
+    results = {}
+    if output_filter:
+        try:
+            output, (error,), timed_out = filters.communicate(
+                [process], kwargs.get("input"), filters.build(output_filter), timeout)
+        except filters.FilterError as exc:
+            log.warning("executor %s output filter failed: %s", exe_name, exc)
+            output, error, timed_out = bytes(), bytes(), False
+            results["error"] = "output filter failed"
+        if timed_out:
+            log.warning("executor %s timeout after %s seconds", exe_name, timeout)
+            results["error"] = "timeout"
+    else:
+        try:
+            output, error = process.communicate(**kwargs)
+        except subprocess.TimeoutExpired:
+            log.warning("executor %s timeout after %s seconds", exe_name, timeout)
+            process.kill()
+            output, error = process.communicate()
+            results["error"] = "timeout"
+    results.update(stdout=decode_output(output, max_output), returncode=process.poll())
+    if collect_stderr:
+        results["stderr"] = decode_output(error, max_output)
+    usage = accounting.usage(process, time.monotonic() - start)
+    exceeded = rlimits.exceeded(limits, process.returncode, usage) if limits else None
+    if exceeded and "error" not in results:
+        log.warning("executor %s exceeded the %s limit", exe_name, exceeded)
+        results.update(error="limit exceeded", limit=exceeded)
+    if collect_usage:
+        results["usage"] = usage
+    return results
+
+
+def run_pipeline(
+        exe_path, stages, input_stdin, collect_stderr=False, timeout=None, max_output=None,
+        collect_usage=False, limits=None, output_filter=None):
+    """ Runs the stages, [(exe_name, args), ...], connected by pipes: stdout of each one is stdin of the next one
+
+    the results have stdout of the last stage, and "returncodes", "stderr" and "usage" of each one;
+    limits are a list, one for each stage
+    """
+    log.debug("executor pipeline %s", " | ".join(exe_name for exe_name, _ in stages))
+    limits = limits or [None] * len(stages)
+    output_filter = filters.build(output_filter or [])
+    processes = []
+    start = time.monotonic()
+    try:
+        for (exe_name, args), stage_limits in zip(stages, limits):
+            stdin = processes[-1].stdout if processes else (subprocess.PIPE if input_stdin else None)
+            processes.append(accounting.Popen(
+                [os.path.join(exe_path, exe_name)] + list(args), cwd=exe_path,
+                stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                preexec_fn=rlimits.preexec(stage_limits) if stage_limits else None))
+            if processes[:-1]:
+                stdin.close()  # the next stage is the only reader
+    except OSError:
+        for process in processes:
+            process.kill()
+            process.wait()
+        raise
+    results = {}
+    try:
+        output, errors, timed_out = filters.communicate(
+            processes, input_stdin.encode(ENCODING) if input_stdin else None, output_filter, timeout)
+    except filters.FilterError as exc:
+        log.warning("executor pipeline output filter failed: %s", exc)
+        output, errors, timed_out = bytes(), [bytes()] * len(processes), False
+        results["error"] = "output filter failed"
+    if timed_out:
+        log.warning("executor pipeline timeout after %s seconds", timeout)
+        results["error"] = "timeout"
+    wall_time = time.monotonic() - start
+    returncodes = [process.returncode for process in processes]
+    results.update(stdout=decode_output(output, max_output), returncode=returncodes[-1], returncodes=returncodes)
+    if collect_stderr:
+        results["stderr"] = [decode_output(error, max_output) for error in errors]
+    usage = [accounting.usage(process, wall_time) for process in processes]
+    for (exe_name, _), process, stage_limits, stage_usage in zip(stages, processes, limits, usage):
+        exceeded = rlimits.exceeded(stage_limits, process.returncode, stage_usage) if stage_limits else None
+        if exceeded and "error" not in results:
+            log.warning("executor %s exceeded the %s limit", exe_name, exceeded)
+            results.update(error="limit exceeded", limit=exceeded)
+    if collect_usage:
+        results["usage"] = usage
+    return results
+
+
+def decode_output(output, max_output=None):
+    if max_output is None or len(output) <= max_output:
+        return output.decode(ENCODING)
+    return output[:max_output].decode(ENCODING, "ignore")  # a truncated multibyte character is dropped
+
+
+def executor(exe_path, command, collect_stderr=False):
+    exe_name, args, input_stdin = json.loads(command)
+    return json.dumps(run_executable(exe_path, exe_name, args, input_stdin, collect_stderr))
+
+
+def service_worker(service_class, settings_file, listen_socket=None, unix_socket=None, listening=None):
+    service_class(settings_file).serve(listen_socket, unix_socket, report_ready=False, listening=listening)
+
+
+def listen_signal(name, handler):
+    signum = getattr(signal, name, None)
+    if signum is not None and threading.current_thread() is threading.main_thread():
+        signal.signal(signum, handler)
+
+
+class Service:
+    def __init__(self, settings_file):
+        self.settings_file = settings_file
+        settings = Config(settings_file)
+        # (settings, catalog): swapped as a whole on reload, each request uses a single snapshot of it
+        self._config = settings, Catalog(settings.EXECUTABLE_PATH, settings.EXECUTABLE_POLICIES)
+        self._settings_stat = self._stat_settings()
+        self._settings_check = time.monotonic()
+        self.concurrency = ConcurrencyLimits()
+        self.spawner = Spawner()
+        self.single_flight = SingleFlight()
+        self.profiling = Profiling()
+        self.usage = accounting.UsageStats()
+        self.blobs = BlobStore(self.settings.BLOB_CACHE_SIZE)
+        self.scheduler = Scheduler(self.run_command, self.settings.SCHEDULES)
+        self._server = None
+        self._unix_server = None
+        self._supervisor = None
+        self._draining = False
+        self._drain_timer = None
+        self._stopped = threading.Event()
+        self._started = time.monotonic()
+        self._report_ready = True
+        self._listening = None
+        self._ready_lock = threading.Lock()
+
+    @property
+    def settings(self):
+        return self._config[0]
+
+    @property
+    def catalog(self):
+        return self._config[1]
+
+    def start(self):
+        # put any start-up code here
+        pass
+
+    def _on_open(self, server):
+        if isinstance(server, UnixServer):
+            self._unix_server = server
+        else:
+            self._server = server
+        if self._draining:
+            server.stop()
+        with self._ready_lock:
+            if self._server and (self._unix_server or not self.settings.UNIX_SOCKET):
+                if self._listening is not None:
+                    self._listening.set()
+                if self._report_ready:
+                    self._report_ready = False
+                    self._ready(self._server.server_address)
+
+    def _ready(self, address):
+        self.ready({"pid": os.getpid(), "address": address, "unix_socket": self.settings.UNIX_SOCKET})
+
+    def ready(self, info):
+        """ Called once the daemon accepts requests, info: {"pid": ..., "address": (host, port), "unix_socket": ...}
+
+        with PORT 0, address has the port chosen by the system
+        """
+        log.info("SERVICE: ready %s", info)
+        if self.settings.READY_FILE:
+            write_ready_file(self.settings.READY_FILE, info)
+        sd_notify("READY=1\nMAINPID={}\nSTATUS=listening on {}".format(info["pid"], info["address"]))
+
+    def _stat_settings(self):
+        st = os.stat(self.settings_file)
+        return st.st_mtime_ns, st.st_size
+
+    def watch_settings(self):
+        """ A changed settings file is reloaded, if valid, and applies to the following requests """
+        interval = self.settings.RELOAD_INTERVAL
+        if interval is None or time.monotonic() - self._settings_check < interval:
+            return
+        self._settings_check = time.monotonic()
+        try:
+            settings_stat = self._stat_settings()
+            if settings_stat == self._settings_stat:
+                return
+            self._settings_stat = settings_stat
+            settings = self.settings.reload(self.settings_file)
+            catalog = Catalog(settings.EXECUTABLE_PATH, settings.EXECUTABLE_POLICIES)
+            self.scheduler.update(settings.SCHEDULES)
+            self._config = settings, catalog
+        except Exception:
+            log.exception("SERVICE: invalid settings file '%s', current settings are kept", self.settings_file)
+            return
+        log.info("SERVICE: settings reloaded")
+
+    def _request_kwargs(self, settings, entries, input_stdin, options):
+        """ run_executable/run_pipeline kwargs common to the given catalog entries, or an error result """
+        if options.get("stdin_hash"):
+            input_stdin = self.blobs.get(options["stdin_hash"])
+            if input_stdin is None:
+                return {"error": "unknown blob"}
+        elif options.get("store_stdin"):
+            self.blobs.put(input_stdin)
+        try:
+            limits = [
+                rlimits.merge(settings.RESOURCE_LIMITS, e.policy.get("limits"), options.get("limits")) for e in entries]
+        except (ValueError, TypeError):
+            log.warning("SERVICE: invalid limits %s", options.get("limits"))
+            return {"error": "invalid limits"}
+        output_filter = options.get("output_filter")
+        if output_filter:
+            try:
+                filters.build(output_filter)
+            except (ValueError, TypeError, re.error):
+                log.warning("SERVICE: invalid output filter %s", output_filter)
+                return {"error": "invalid output filter"}
+        timeouts = [e.policy["timeout"] for e in entries if e.policy.get("timeout") is not None]
+        return dict(
+            exe_path=settings.EXECUTABLE_PATH, input_stdin=input_stdin, collect_stderr=settings.COLLECT_STDERR,
+            timeout=min(timeouts) if timeouts else None, max_output=entries[-1].policy.get("max_output"),
+            limits=limits, output_filter=output_filter)
+
+    def _results(self, settings, results):
+        if not settings.COLLECT_USAGE:
+            results = {k: v for k, v in results.items() if k != "usage"}
+        return results
+
+    def run_command(self, exe_name, args, input_stdin, options=None):
+        s, catalog = self._config
+        entry = catalog.get(exe_name)
+        if not entry:
+            log.warning("SERVICE: unknown executable '%s'", exe_name)
+            return {"error": "unknown executable"}
+        options = options or {}
+        kwargs = self._request_kwargs(s, [entry], input_stdin, options)
+        if "error" in kwargs:
+            return kwargs
+        kwargs.update(exe_name=exe_name, args=args, limits=kwargs["limits"][0])
+        if s.COALESCE or entry.policy.get("coalesce"):
+            key = request_key(
+                exe_name, args, kwargs["input_stdin"], options.get("idempotency_key"), kwargs["output_filter"],
+                kwargs["limits"])
+            results = self.single_flight.do(key, self._run_accounted, s, entry, **kwargs)
+        else:
+            results = self._run_accounted(s, entry, **kwargs)
+        return self._results(s, results)
+
+    def pipeline(self, stages, input_stdin="", **options):
+        """ the strictest timeout of the stages applies, max_output of the last one """
+        s, catalog = self._config
+        entries = [catalog.get(exe_name) for exe_name, _ in stages]
+        if not entries or not all(entries):
+            log.warning("SERVICE: unknown executable in pipeline %s", stages)
+            return {"error": "unknown executable"}
+        kwargs = self._request_kwargs(s, entries, input_stdin, options)
+        if "error" in kwargs:
+            return kwargs
+        with self.concurrency.slots(entries):
+            results = run_pipeline(stages=stages, collect_usage=True, **kwargs)
+        for (exe_name, _), usage in zip(stages, results["usage"]):
+            self.usage.add(exe_name, usage)
+        return self._results(s, results)
+
+    def _run_accounted(self, settings, entry, **kwargs):
+        run = self.spawner.run if settings.SPAWN_HELPER else run_executable
+        with self.concurrency.slots([entry]):
+            results = run(collect_usage=True, **kwargs)
+        self.usage.add(kwargs["exe_name"], results["usage"])
+        return results
+
+    def latest(self, schedule, max_age=None):
+        latest = self.scheduler.get(schedule, max_age)
+        if latest is None:
+            return {"error": "unknown schedule"}
+        result, timestamp = latest
+        return {"result": result, "timestamp": timestamp, "age": time.time() - timestamp}
+
+    def fetch(self, name, offset=0, count=None):
+        s = self.settings
+        if not s.ARTIFACT_PATH:
+            return {"error": "artifacts not enabled"}
+        root = os.path.realpath(s.ARTIFACT_PATH)
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            log.warning("SERVICE: artifact '%s' not available", name)
+            return {"error": "artifact not available"}
+        if offset < 0 or (count is not None and count < 0):
+            return {"error": "invalid range"}
+        return FileResponse(path, offset, count)
+
+    def blob_put(self, data):
+        key = self.blobs.put(data)
+        if key is None:
+            return {"error": "blob too large"}
+        return {"hash": key}
+
+    def blob_has(self, hash):
+        return {"exists": hash in self.blobs}
+
+    def _profiling_enabled(self):
+        # profiles expose the daemon internals: authenticated clients only
+        return self.settings.PROFILE_PATH and getattr(self.settings, "HMAC_KEY", None)
+
+    def profile(self, mode="cprofile", seconds=None, requests=None):
+        if not self._profiling_enabled():
+            return {"error": "profiling not enabled"}
+        if mode not in Profiling.MODES:
+            return {"error": "unknown profiling mode"}
+        # a session that cannot end would refuse all the following ones
+        if seconds is not None and (
+                isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or not 0 < seconds < float("inf")):
+            return {"error": "invalid profiling duration"}
+        if requests is not None and (isinstance(requests, bool) or not isinstance(requests, int) or requests <= 0):
+            return {"error": "invalid profiling duration"}
+        name = self.profiling.start(self.settings.PROFILE_PATH, mode, seconds, requests)
+        if name is None:
+            return {"error": "profiling in progress"}
+        return {"name": name}
+
+    def profile_result(self, name):
+        if not self._profiling_enabled():
+            return {"error": "profiling not enabled"}
+        path = os.path.join(self.settings.PROFILE_PATH, name)
+        if not RESULT_NAME.match(name) or not os.path.isfile(path):
+            return {"error": "profile not available"}
+        with open(path, "rb") as f:
+            return {"name": name, "data": base64.b64encode(f.read()).decode()}
+
+    def ping(self):
+        return {"pid": os.getpid(), "uptime": time.monotonic() - self._started}
+
+    def control(self, action, **params):
+        actions = {
+            "ping": self.ping,
+            "catalog": self.catalog.describe,
+            "usage": self.usage.describe,
+            "blob_put": self.blob_put,
+            "blob_has": self.blob_has,
+            "fetch": self.fetch,
+            "pipeline": self.pipeline,
+            "latest": self.latest,
+            "profile": self.profile,
+            "profile_result": self.profile_result,
+        }
+        if action not in actions:
+            log.warning("SERVICE: unknown action '%s'", action)
+            return {"error": "unknown action"}
+        return actions[action](**params)
+
+    def execute(self, command):
+        self.watch_settings()
+        request = json.loads(command)
+        if isinstance(request, dict):
+            response = self.control(**request)
+            return response if isinstance(response, FileResponse) else json.dumps(response)
+        return json.dumps(self.profiling.call(self.run_command, *request))
+
+    def _unix_daemon(self, unix_socket):
+        """ Thread serving the UNIX_SOCKET too, it shares the requests handling with the TCP daemon """
+        s = self.settings
+        if unix_socket is None:
+            unix_socket = bind_listen_socket(s.UNIX_SOCKET, s.UNIX_SOCKET_MODE)
+        thread = threading.Thread(
+            target=daemon, args=(s.UNIX_SOCKET, self.execute),
+            kwargs=dict(
+                listen_socket=unix_socket, on_open=self._on_open, threads=s.THREADS,
+                hmac_key=getattr(s, "HMAC_KEY", None)),
+            daemon=True)
+        thread.start()
+        return thread
+
+    def serve(self, listen_socket=None, unix_socket=None, report_ready=True, listening=None):
+        """ listening: an Event set once the servers are open, e.g. for the supervisor of the worker processes """
+        s = self.settings
+        self._report_ready = report_ready
+        self._listening = listening
+        secure = getattr(s, "SECURE", {})
+        listen_signal("SIGTERM", self.drain)
+        self.scheduler.start()
+        unix_daemon = self._unix_daemon(unix_socket) if s.UNIX_SOCKET else None
+        daemon(
+            (s.HOST, s.PORT), self.execute,
+            reuse_port=listen_socket is None and s.REUSE_PORT, listen_socket=listen_socket, on_open=self._on_open,
+            threads=s.THREADS, hmac_key=getattr(s, "HMAC_KEY", None),
+            **secure
+        )
+        if unix_daemon:
+            unix_daemon.join()
+
+    def supervise(self, listen_socket=None, unix_socket=None):
+        s = self.settings
+        if listen_socket is None and (not s.REUSE_PORT or s.PORT == 0):  # workers share the port chosen
+            listen_socket = bind_listen_socket((s.HOST, s.PORT))
+        if unix_socket is None and s.UNIX_SOCKET:
+            unix_socket = bind_listen_socket(s.UNIX_SOCKET, s.UNIX_SOCKET_MODE)
+        listening = multiprocessing.Event()
+        self._supervisor = Supervisor(
+            service_worker, s.WORKERS, (type(self), self.settings_file, listen_socket, unix_socket, listening),
+            s.DRAIN_TIMEOUT)
+
+        def restart(*args):
+            handoff(listen_socket, unix_socket)
+            self._supervisor.shutdown()
+
+        listen_signal("SIGTERM", self._supervisor.shutdown)
+        listen_signal("SIGHUP", restart)
+        if listen_socket:  # connections wait in its backlog until a worker accepts them
+            self._ready(listen_socket.getsockname())
+        else:  # REUSE_PORT: nothing listens before a worker binds the port
+            threading.Thread(
+                target=lambda: listening.wait() and self._ready((s.HOST, s.PORT)), daemon=True).start()
+        self._supervisor.run()
+
+    def run(self):
+        s = self.settings
+        listen_socket = inherited_socket()
+        unix_socket = inherited_socket(UNIX_LISTEN_FD_ENV)
+        try:
+            if s.WORKERS > 1:
+                self.supervise(listen_socket, unix_socket)
+            else:
+                listen_signal("SIGHUP", self.restart)
+                self.serve(listen_socket, unix_socket)
+        finally:
+            if self._drain_timer:  # drained in time, the host process must not be stopped later
+                self._drain_timer.cancel()
+            if s.READY_FILE:
+                remove_ready_file(s.READY_FILE, os.getpid())
+            self._stopped.set()
+
+    def _drain_timeout(self):
+        log.warning("SERVICE: drain timeout expired, requests in progress are aborted")
+        os._exit(1)
+
+    def drain(self, *args):
+        """ Stops accepting requests and lets the ones in progress complete within DRAIN_TIMEOUT """
+        log.info("SERVICE: draining...")
+        self._draining = True
+        sd_notify("STOPPING=1")
+        self.scheduler.stop()
+        for server in (self._server, self._unix_server):
+            if server:
+                server.stop()
+        self._drain_timer = threading.Timer(self.settings.DRAIN_TIMEOUT, self._drain_timeout)
+        self._drain_timer.daemon = True
+        self._drain_timer.start()
+
+    def restart(self, *args):
+        """ Hands the listening sockets off to a new daemon process, then drains """
+        handoff(None if self.settings.REUSE_PORT else self._server, self._unix_server)
+        self.drain()
+
+    def stop(self):
+        if self._supervisor:
+            self._supervisor.shutdown()
+        else:
+            self.drain()
+        self._stopped.wait()
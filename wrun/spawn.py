@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Spawner:
+    """ Runs executables in small helper processes, so spawn cost does not grow with the daemon size
+
+    requests and results are exchanged as JSON lines on the helper stdin and stdout;
+    a helper runs one executable at a time, concurrent runs get their own helpers, idle ones are reused
+    """
+
+    def __init__(self):
+        self._helpers = []
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        python_path = os.pathsep.join(filter(None, [package_path, os.environ.get("PYTHONPATH")]))
+        env = dict(os.environ, PYTHONPATH=python_path)
+        process = subprocess.Popen(
+            [sys.executable, "-c", "from wrun.spawn import main; main()"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        log.info("SPAWNER: started helper %s", process.pid)
+        with self._lock:
+            self._helpers.append(process)
+        return process
+
+    def _acquire(self):
+        with self._lock:
+            while self._idle:
+                process = self._idle.pop()
+                if process.poll() is None:
+                    return process
+                self._helpers.remove(process)
+                process.stdin.close()
+                process.stdout.close()
+        return self._start()
+
+    def _release(self, process):
+        with self._lock:
+            if process in self._helpers:  # not stopped meanwhile
+                self._idle.append(process)
+
+    def _discard(self, process):
+        process.kill()
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+        with self._lock:
+            if process in self._helpers:
+                self._helpers.remove(process)
+
+    def stop(self):
+        with self._lock:
+            helpers, self._helpers, self._idle = self._helpers, [], []
+        for process in helpers:
+            process.stdin.close()
+            process.wait()
+            process.stdout.close()
+
+    @staticmethod
+    def _request(process, request):
+        process.stdin.write(json.dumps(request).encode() + b"\n")
+        process.stdin.flush()
+        response = process.stdout.readline()
+        if not response:
+            raise EOFError("spawner helper exited")
+        return json.loads(response)
+
+    def run(self, **kwargs):
+        """ run_executable in a helper process """
+        process = self._acquire()
+        try:
+            result = self._request(process, kwargs)
+        except (OSError, EOFError, ValueError):
+            log.exception("SPAWNER: helper %s failure", process.pid)
+            self._discard(process)
+            raise
+        self._release(process)
+        return result
+
+
+def main():
+    from .server import run_executable
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    for request in stdin:
+        stdout.write(json.dumps(run_executable(**json.loads(request))).encode() + b"\n")
+        stdout.flush()
+
@@ -1,15 +1,59 @@
+import json
 import logging
+import os
 import socket
-import ssl
+import stat
+import threading
 
 BUFFER_SIZE = 4096
+FILE_BUFFER_SIZE = 65536
+REQUEST_QUEUE_SIZE = socket.SOMAXCONN
+UNIX_SOCKET_MODE = 0o660  # owner and group can connect
 
 log = logging.getLogger(__name__)
 
 
 class Socket(socket.socket):
-    def __init__(self):
-        super(Socket, self).__init__(socket.AF_INET, socket.SOCK_STREAM)
+    def __init__(self, family=socket.AF_INET):
+        super(Socket, self).__init__(family, socket.SOCK_STREAM)
+
+
+def bind_unix_socket(sock, path, mode=UNIX_SOCKET_MODE):
+    """ A socket file left by a previous daemon is replaced, access is granted by the file permissions """
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock.bind(path)
+    os.chmod(path, mode)
+
+
+class FileResponse:
+    """ Response streamed from a file with sendfile: a JSON header line, then size bytes from offset """
+
+    def __init__(self, path, offset=0, count=None):
+        self.path = path
+        file_size = os.stat(path).st_size
+        self.offset = min(offset, file_size)
+        self.size = file_size - self.offset if count is None else min(count, file_size - self.offset)
+
+    def __repr__(self):
+        return "FileResponse({!r}, offset={}, size={})".format(self.path, self.offset, self.size)
+
+    def header(self):
+        return json.dumps({"offset": self.offset, "size": self.size}).encode() + b"\n"
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            return self.header() + f.read(self.size)
+
+    def send(self, sock):
+        with open(self.path, "rb") as f:
+            sock.sendall(self.header())
+            if self.size:
+                sock.sendfile(f, self.offset, self.size)
 
 
 class TCPClientHandler:
@@ -31,7 +75,10 @@ class TCPClientHandler:
 
     def send(self, response):
         log.debug("SERVER: sending %s ...", response)
-        self.client_socket.sendall(response)
+        if isinstance(response, FileResponse):
+            response.send(self.client_socket)
+        else:
+            self.client_socket.sendall(response)
         log.debug("SERVER: sent")
 
     def handle(self, action):
@@ -41,15 +88,31 @@ class TCPClientHandler:
 
 
 class TCPServer:
+    FAMILY = socket.AF_INET
     HANDLER = TCPClientHandler
+    POLL_INTERVAL = 0.5  # seconds between checks of the stop request while idle
 
-    def __init__(self, server_address, action, build_handler=HANDLER):
+    def __init__(
+            self, server_address, action, build_handler=HANDLER, reuse_port=False, listen_socket=None, threads=1):
         self.server_address = server_address
         self.action = action
         self.build_handler = build_handler
-        self._server_socket = Socket()
+        self.reuse_port = reuse_port
+        self.threads = threads
+        self._inherited = listen_socket is not None
+        self._server_socket = listen_socket if self._inherited else Socket(self.FAMILY)
+        self._serving = True
+        self._slots = threading.BoundedSemaphore(threads)
+        self._handlers = set()
 
     def _bind(self):
+        if self._inherited:
+            self.server_address = self._server_socket.getsockname()
+            log.debug("SERVER: inherited server socket binded to '%s'", self.server_address)
+            return
+        if self.reuse_port:
+            log.debug("SERVER: enable port reuse on server socket...")
+            self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         log.debug("SERVER: bind server socket...")
         self._server_socket.bind(self.server_address)
         self.server_address = self._server_socket.getsockname()
@@ -57,11 +120,20 @@ class TCPServer:
 
     def _listen(self):
         log.debug("SERVER: listen on server socket...")
-        self._server_socket.listen(1)
+        self._server_socket.listen(REQUEST_QUEUE_SIZE)
 
     def _accept(self):
         log.debug("SERVER: waiting for a connection on server socket...")
-        return self._server_socket.accept()
+        while self._serving:
+            try:
+                return self._server_socket.accept()
+            except socket.timeout:
+                pass
+        log.debug("SERVER: stopped waiting for connections")
+        return None
+
+    def fileno(self):
+        return self._server_socket.fileno()
 
     def open(self):
         self._bind()
@@ -72,8 +144,7 @@ class TCPServer:
         self._server_socket.close()
         log.debug("SERVER: closed server socket")
 
-    def process(self):
-        sc, ad = self._accept()
+    def _handle(self, sc, ad):
         try:
             log.debug("SERVER: handling client request...")
             handler = self.build_handler(sc, ad)
@@ -87,9 +158,36 @@ class TCPServer:
             sc.close()
             log.debug("SERVER: closed client socket")
 
+    def _handle_thread(self, sc, ad):
+        try:
+            self._handle(sc, ad)
+        finally:
+            self._handlers.discard(threading.current_thread())
+            self._slots.release()
+
+    def process(self):
+        accepted = self._accept()
+        if not accepted:
+            return
+        if self.threads <= 1:
+            self._handle(*accepted)
+            return
+        self._slots.acquire()  # at most "threads" requests in progress
+        handler = threading.Thread(target=self._handle_thread, args=accepted)
+        self._handlers.add(handler)
+        handler.start()
+
     def serve(self):
-        while True:
+        self._server_socket.settimeout(self.POLL_INTERVAL)
+        while self._serving:
             self.process()
+        for handler in list(self._handlers):
+            handler.join()
+
+    def stop(self):
+        """ Stops accepting connections, the requests in progress are completed """
+        log.debug("SERVER: stop requested")
+        self._serving = False
 
     def __enter__(self):
         try:
@@ -103,10 +201,48 @@ class TCPServer:
         self.close()
 
 
+class UnixServer(TCPServer):
+    """ Server for same-host clients on an AF_UNIX socket, server_address is the socket file path """
+    FAMILY = getattr(socket, "AF_UNIX", None)
+
+    def __init__(self, *args, mode=UNIX_SOCKET_MODE, **kwargs):
+        self.mode = mode
+        super().__init__(*args, **kwargs)
+
+    def _bind(self):
+        if self._inherited:
+            return super()._bind()
+        log.debug("SERVER: bind server socket...")
+        bind_unix_socket(self._server_socket, self.server_address, self.mode)
+        log.debug("SERVER: binded server socket to '%s", self.server_address)
+
+
+def bind_listen_socket(server_address, mode=UNIX_SOCKET_MODE):
+    """ Bound and listening socket to be shared among worker processes
+
+    a str server_address is the path of an AF_UNIX socket with the given permissions
+    """
+    unix = isinstance(server_address, str)
+    sock = Socket(UnixServer.FAMILY if unix else socket.AF_INET)
+    try:
+        if unix:
+            bind_unix_socket(sock, server_address, mode)
+        else:
+            sock.bind(server_address)
+        sock.listen(REQUEST_QUEUE_SIZE)
+    except:
+        sock.close()
+        raise
+    return sock
+
+
 class TCPClient:
-    def __init__(self, server_address):
+    FAMILY = socket.AF_INET
+
+    def __init__(self, server_address, timeout=None):
         self.server_address = server_address
-        self._client_socket = Socket()
+        self._client_socket = Socket(self.FAMILY)
+        self._client_socket.settimeout(timeout)
 
     def open(self):
         log.debug("CLIENT: connecting '%s' ...", self.server_address)
@@ -139,6 +275,16 @@ class TCPClient:
             response += data
         return response
 
+    def receive_chunks(self):
+        """ The response, chunk by chunk: large responses are not kept in memory """
+        log.debug("CLIENT: receiving chunks...")
+        while True:
+            data = self._client_socket.recv(FILE_BUFFER_SIZE)
+            if not data:
+                log.debug("CLIENT: no more data to receive")
+                return
+            yield data
+
     def request(self, request):
         self.send(request)
         return self.receive()
@@ -155,6 +301,10 @@ class TCPClient:
         self.close()
 
 
+class UnixClient(TCPClient):
+    FAMILY = UnixServer.FAMILY
+
+
 class SecureTCPServer(TCPServer):
     def __init__(self, *args, **kwargs):
         self.cafile = kwargs.pop('cafile')
@@ -164,6 +314,7 @@ class SecureTCPServer(TCPServer):
     def _listen(self):
         super()._listen()
         log.debug("SERVER: securing socket...")
+        import ssl  # imported by the SECURE daemons and clients only
         context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         context.load_cert_chain(self.cafile, self.keyfile)
         self._server_socket = context.wrap_socket(self._server_socket, server_side=True)
@@ -174,6 +325,7 @@ class SecureTCPClient(TCPClient):
         cafile = kwargs.pop('cafile')
         super().__init__(*args, **kwargs)
         log.debug("CLIENT: securing socket...")
+        import ssl
         context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=cafile)
         context.check_hostname = False
         self._client_socket = context.wrap_socket(self._client_socket)